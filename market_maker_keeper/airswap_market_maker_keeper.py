@@ -33,10 +33,10 @@ from market_maker_keeper.limit import SideLimits, History
 from market_maker_keeper.band import Band, Bands, BuyBand, SellBand
 from market_maker_keeper.control_feed import create_control_feed
 from market_maker_keeper.gas import GasPriceFactory
-from market_maker_keeper.limit import History
+from market_maker_keeper.limit import History, create_history
 from market_maker_keeper.order_book import OrderBookManager
 from market_maker_keeper.order_history_reporter import create_order_history_reporter
-from market_maker_keeper.price_feed import PriceFeedFactory
+from market_maker_keeper.price_feed import PriceFeedFactory, add_price_feed_aggregation_arguments
 from market_maker_keeper.reloadable_config import ReloadableConfig
 from market_maker_keeper.spread_feed import create_spread_feed
 from market_maker_keeper.util import setup_logging
@@ -116,6 +116,8 @@ class AirswapMarketMakerKeeper:
         parser.add_argument("--price-feed-expiry", type=int, default=120,
                             help="Maximum age of the price feed (in seconds, default: 120)")
 
+        add_price_feed_aggregation_arguments(parser)
+
         parser.add_argument("--spread-feed", type=str,
                             help="Source of spread feed")
 
@@ -134,6 +136,9 @@ class AirswapMarketMakerKeeper:
         parser.add_argument("--order-history-every", type=int, default=30,
                             help="Frequency of reporting active orders (in seconds, default: 30)")
 
+        parser.add_argument("--trade-limit-journal", type=str,
+                            help="File to persist trade limit usage in, so limits survive keeper restarts")
+
         parser.add_argument("--debug", dest='debug', action='store_true',
                             help="Enable debug output")
 
@@ -162,11 +167,12 @@ class AirswapMarketMakerKeeper:
         self.control_feed = create_control_feed(self.arguments)
         self.order_history_reporter = create_order_history_reporter(self.arguments)
 
-        self.history = History()
+        self.history = create_history(self.arguments)
 
     def main(self):
         self.startup()
         app.run(host=self.arguments.orderserver_host, port=self.arguments.orderserver_port)
+        self.history.flush()
 
     def startup(self):
         #approvals are a bit tricky as the call below is made to the airswap API but the actual approval takes place on the blockchain. They only need to be run once so double check on etherscan that this has been executed for all token pairs.
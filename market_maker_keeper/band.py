@@ -17,17 +17,19 @@
 
 import itertools
 import logging
-import operator
-from functools import reduce
+import uuid
+from bisect import bisect_left
 from pprint import pformat
 from typing import Tuple, Optional
 
 import time
 
 from market_maker_keeper.feed import Feed
+from market_maker_keeper.fixed_point import raw, wad_mul, wad_sum
 from market_maker_keeper.limit import SideLimits, History
 from market_maker_keeper.price_feed import Price
 from market_maker_keeper.reloadable_config import ReloadableConfig
+from market_maker_keeper.tick_timer import timed_phase
 from pymaker.numeric import Wad
 
 
@@ -69,12 +71,35 @@ class Band:
         assert(self.avg_margin <= self.max_margin)
         assert(self.min_margin < self.max_margin)
 
+        # Raw values of the multipliers `_apply_margin()` would use, calculated once for the band.
+        self._min_margin_multiplier = self._margin_multiplier(self.min_margin)
+        self._avg_margin_multiplier = self._margin_multiplier(self.avg_margin)
+        self._max_margin_multiplier = self._margin_multiplier(self.max_margin)
+
     def order_price(self, order) -> Wad:
         raise NotImplemented()
 
-    def includes(self, order, target_price: Wad) -> bool:
+    def price_range(self, target_price: Wad) -> Tuple[Wad, Wad]:
+        """Return the `(low, high)` price boundaries of the band, an order belongs to it if `low < price <= high`."""
+        price_low, price_high = self._raw_price_range(target_price.value)
+        return Wad(price_low), Wad(price_high)
+
+    def _raw_price_range(self, target_price: int) -> Tuple[int, int]:
         raise NotImplemented()
 
+    def _margin_multiplier(self, margin: float) -> int:
+        raise NotImplemented()
+
+    def includes(self, order, target_price: Wad) -> bool:
+        return self.includes_price(self.order_price(order), target_price)
+
+    def includes_price(self, price: Wad, target_price: Wad) -> bool:
+        price_low, price_high = self._raw_price_range(target_price.value)
+        return (price.value > price_low) and (price.value <= price_high)
+
+    def avg_price(self, target_price: Wad) -> Wad:
+        return Wad(wad_mul(target_price.value, self._avg_margin_multiplier))
+
     def type(self) -> str:
         raise NotImplemented()
 
@@ -83,30 +108,37 @@ class Band:
 
         # Get all orders which are currently present in the band.
         orders_in_band = [order for order in orders if self.includes(order, target_price)]
-        orders_total = Bands.total_amount(orders_in_band)
 
+        return self._excessive_orders(orders_in_band, target_price, is_first_band, is_last_band)
+
+    def _excessive_orders(self, orders_in_band: list, target_price: Wad, is_first_band: bool, is_last_band: bool):
         # The sorting in which we remove orders depends on which band we are in.
         # * In the first band we start cancelling with orders closest to the target price.
         # * In the last band we start cancelling with orders furthest from the target price.
         # * In remaining cases we remove orders starting from the smallest one.
         if is_first_band:
-            sorting = lambda order: abs(self.order_price(order) - target_price)
+            sorting = lambda order: abs(self.order_price(order).value - target_price.value)
             reverse = True
 
         elif is_last_band:
-            sorting = lambda order: abs(self.order_price(order) - target_price)
+            sorting = lambda order: abs(self.order_price(order).value - target_price.value)
             reverse = False
 
         else:
-            sorting = lambda order: order.remaining_sell_amount
+            sorting = lambda order: order.remaining_sell_amount.value
             reverse = True
 
-        # Keep removing orders until their total amount stops being greater than `maxAmount`.
-        orders_to_leave = sorted(orders_in_band, key=sorting, reverse=reverse)
-        while Bands.total_amount(orders_to_leave) > self.max_amount:
-            orders_to_leave.pop()
+        # Keep removing orders from the end until their total amount stops being greater than `maxAmount`.
+        # Cumulative amounts let us find the cut point without summing up the remaining orders each time.
+        sorted_orders = sorted(orders_in_band, key=sorting, reverse=reverse)
+        cumulative_amounts = list(itertools.accumulate(order.remaining_sell_amount.value for order in sorted_orders))
+        orders_total = Wad(cumulative_amounts[-1]) if len(cumulative_amounts) > 0 else Wad(0)
 
-        result = set(orders_in_band) - set(orders_to_leave)
+        orders_to_leave_count = len(sorted_orders)
+        while orders_to_leave_count > 0 and cumulative_amounts[orders_to_leave_count - 1] > self.max_amount.value:
+            orders_to_leave_count -= 1
+
+        result = set(sorted_orders[orders_to_leave_count:])
 
         if len(result) > 0:
             logger = logging.getLogger()
@@ -131,18 +163,15 @@ class BuyBand(Band):
     def order_price(self, order) -> Wad:
         return order.sell_to_buy_price
 
-    def includes(self, order, target_price: Wad) -> bool:
-        price = self.order_price(order)
-        price_min = self._apply_margin(target_price, self.min_margin)
-        price_max = self._apply_margin(target_price, self.max_margin)
-        return (price > price_max) and (price <= price_min)
+    def _raw_price_range(self, target_price: int) -> Tuple[int, int]:
+        return wad_mul(target_price, self._max_margin_multiplier), wad_mul(target_price, self._min_margin_multiplier)
+
+    def _margin_multiplier(self, margin: float) -> int:
+        return raw(1 - margin)
 
     def type(self) -> str:
         return "buy"
 
-    def avg_price(self, target_price: Wad) -> Wad:
-        return self._apply_margin(target_price, self.avg_margin)
-
     @staticmethod
     def _apply_margin(price: Wad, margin: float) -> Wad:
         return price * Wad.from_number(1 - margin)
@@ -162,25 +191,30 @@ class SellBand(Band):
     def order_price(self, order) -> Wad:
         return order.buy_to_sell_price
 
-    def includes(self, order, target_price: Wad) -> bool:
-        price = self.order_price(order)
-        price_min = self._apply_margin(target_price, self.min_margin)
-        price_max = self._apply_margin(target_price, self.max_margin)
-        return (price > price_min) and (price <= price_max)
+    def _raw_price_range(self, target_price: int) -> Tuple[int, int]:
+        return wad_mul(target_price, self._min_margin_multiplier), wad_mul(target_price, self._max_margin_multiplier)
+
+    def _margin_multiplier(self, margin: float) -> int:
+        return raw(1 + margin)
 
     def type(self) -> str:
         return "sell"
 
-    def avg_price(self, target_price: Wad) -> Wad:
-        return self._apply_margin(target_price, self.avg_margin)
-
     @staticmethod
     def _apply_margin(price: Wad, margin: float) -> Wad:
         return price * Wad.from_number(1 + margin)
 
 
 class NewOrder:
-    def __init__(self, is_sell: bool, price: Wad, amount: Wad, pay_amount: Wad, buy_amount: Wad, band: Band, confirm_function):
+    """Order which is about to be placed.
+
+    Each new order gets a unique `client_order_id`, which exchanges supporting client-generated order ids
+    can be given when placing it. This way a placement which failed with an uncertain outcome (i.e. timed out)
+    can be told apart from one which did not happen, see `OrderBookManager.resolve_placements_with()`.
+    """
+
+    def __init__(self, is_sell: bool, price: Wad, amount: Wad, pay_amount: Wad, buy_amount: Wad, band: Band, confirm_function,
+                 client_order_id: str = None):
         assert(isinstance(is_sell, bool))
         assert(isinstance(price, Wad))
         assert(isinstance(amount, Wad))
@@ -188,6 +222,7 @@ class NewOrder:
         assert(isinstance(buy_amount, Wad))
         assert(isinstance(band, Band))
         assert(callable(confirm_function))
+        assert(isinstance(client_order_id, str) or client_order_id is None)
 
         self.is_sell = is_sell
         self.price = price
@@ -195,48 +230,235 @@ class NewOrder:
         self.pay_amount = pay_amount
         self.buy_amount = buy_amount
         self.band = band
+        self.client_order_id = client_order_id if client_order_id is not None else uuid.uuid4().hex
         self._confirm_function = confirm_function
 
     def confirm(self):
         self._confirm_function()
 
+    def is_stale(self, target_price: Price) -> bool:
+        """Return `True` if the order would not fall into its band at `target_price` anymore."""
+        assert(isinstance(target_price, Price))
+
+        side_price = target_price.sell_price if self.is_sell else target_price.buy_price
+        return side_price is None or not self.band.includes_price(self.price, side_price)
+
     def __repr__(self):
         return pformat(vars(self))
 
 
+class Reconciliation:
+    """Operations bringing keeper orders in line with the bands, see `Bands.reconcile()`.
+
+    Attributes:
+        orders_to_cancel: Orders which need to be cancelled.
+        orders_to_place: New orders which need to be placed. They only use balances available
+            before `orders_to_cancel` get cancelled, so they can be placed straight away.
+        orders_to_amend: List of `(order, new_order)` tuples, for orders which need to be amended
+            to become new orders instead of being cancelled. Only used if asked for.
+        missing_buy_amount: Amount missing in buy bands, see `Bands.new_orders()`.
+        missing_sell_amount: Amount missing in sell bands, see `Bands.new_orders()`.
+    """
+
+    def __init__(self, orders_to_cancel: list, orders_to_place: list, missing_buy_amount: Wad, missing_sell_amount: Wad,
+                 orders_to_amend: list = None):
+        assert(isinstance(orders_to_cancel, list))
+        assert(isinstance(orders_to_place, list))
+        assert(isinstance(missing_buy_amount, Wad))
+        assert(isinstance(missing_sell_amount, Wad))
+        assert(isinstance(orders_to_amend, list) or orders_to_amend is None)
+
+        self.orders_to_cancel = orders_to_cancel
+        self.orders_to_place = orders_to_place
+        self.orders_to_amend = orders_to_amend if orders_to_amend is not None else []
+        self.missing_buy_amount = missing_buy_amount
+        self.missing_sell_amount = missing_sell_amount
+
+    def __repr__(self):
+        return f"Reconciliation(cancel={[order.order_id for order in self.orders_to_cancel]}," \
+               f" amend={[order.order_id for order, _ in self.orders_to_amend]}," \
+               f" place={len(self.orders_to_place)} order(s))"
+
+
+def pair_amendments(orders: list, new_orders: list, order_band_function) -> Tuple[list, list, list]:
+    """Pair orders to cancel with new orders to place, so each pair can be amended in a single request.
+
+    An order only gets paired with a new order created for the band the order itself has been placed for,
+    as told by `order_band_function`, so an amendment only ever changes the price or amount of an order
+    within its band. If there is more than one such order, the one closest in price gets paired.
+
+    Returns:
+        A tuple of the list of `(order, new_order)` amendments, orders which remain to be cancelled
+        and new orders which remain to be placed.
+    """
+    assert(isinstance(orders, list))
+    assert(isinstance(new_orders, list))
+    assert(callable(order_band_function))
+
+    # Bands are compared by identity, as not all of them can be compared by their contents.
+    orders_by_band = {}
+    for order in orders:
+        band = order_band_function(order)
+        if band is not None:
+            orders_by_band.setdefault(id(band), []).append(order)
+
+    amendments = []
+    remaining_new_orders = []
+    for new_order in new_orders:
+        band = getattr(new_order, 'band', None)
+        candidates = orders_by_band.get(id(band), []) if band is not None else []
+
+        if len(candidates) == 0:
+            remaining_new_orders.append(new_order)
+            continue
+
+        if len(candidates) == 1:
+            order = candidates[0]
+        else:
+            order = min(candidates, key=lambda order: abs(band.order_price(order).value - new_order.price.value))
+
+        candidates.remove(order)
+        amendments.append((order, new_order))
+
+    amended = set(id(order) for order, _ in amendments)
+    remaining_orders = [order for order in orders if id(order) not in amended]
+
+    return amendments, remaining_orders, remaining_new_orders
+
+
+class BandMembership:
+    """Assignment of orders on one side of the book to the bands they fall into.
+
+    Price boundaries of all bands are calculated once for the target price and kept sorted,
+    so each order gets located with a single binary search instead of being tested against
+    every band. The same membership is then used both for cancelling and for placing orders.
+
+    Attributes:
+        orders_in_band: For each band (in the order of `bands`), list of orders which fall into it.
+        orders_outside_bands: List of orders which do not fall into any band.
+    """
+
+    def __init__(self, bands: list, orders: list, target_price: Wad):
+        assert(isinstance(bands, list))
+        assert(isinstance(orders, list))
+        assert(isinstance(target_price, Wad))
+
+        self.bands = bands
+        self.orders = list(orders)
+        self.target_price = target_price
+        self.orders_in_band = [[] for _ in bands]
+        self.orders_outside_bands = []
+
+        price_ranges = [band._raw_price_range(target_price.value) for band in bands]
+        sorted_indices = sorted(range(len(bands)), key=lambda index: price_ranges[index][0])
+        lows = [price_ranges[index][0] for index in sorted_indices]
+        highs = [price_ranges[index][1] for index in sorted_indices]
+
+        # Bands which do not overlap have disjoint price ranges. If rounding ever makes two adjacent
+        # ranges overlap each other, we fall back to testing each order against every band.
+        if len(bands) == 0:
+            self.orders_outside_bands = list(orders)
+
+        elif all(highs[position] <= lows[position + 1] for position in range(len(bands) - 1)):
+            for order in orders:
+                price = bands[0].order_price(order).value
+                position = bisect_left(lows, price) - 1
+
+                if position >= 0 and price <= highs[position]:
+                    self.orders_in_band[sorted_indices[position]].append(order)
+                else:
+                    self.orders_outside_bands.append(order)
+
+        else:
+            for order in orders:
+                included = False
+                for index, band in enumerate(bands):
+                    if band.includes(order, target_price):
+                        self.orders_in_band[index].append(order)
+                        included = True
+
+                if not included:
+                    self.orders_outside_bands.append(order)
+
+    def matches(self, bands: list, orders: list, target_price: Wad) -> bool:
+        """Check if this membership has been calculated for the same bands, orders and target price."""
+        return self.bands is bands \
+            and self.target_price == target_price \
+            and len(self.orders) == len(orders) \
+            and all(order1 is order2 for order1, order2 in zip(self.orders, orders))
+
+
 class Bands:
     logger = logging.getLogger()
 
+    # Most recently compiled `Bands` for each (reloadable config, history) pair, see `Bands.read()`.
+    _compiled_bands = {}
+
     @staticmethod
+    @timed_phase('bands')
     def read(reloadable_config: ReloadableConfig, spread_feed: Feed, control_feed: Feed, history: History):
+        """Return bands for the current config file, spread feed and control feed state.
+
+        Parsing and validating the bands only happens if any of these have changed since the last call
+        made with the same `reloadable_config` and `history`. Otherwise the previously compiled `Bands`
+        instance is returned, so callers must treat it as immutable.
+        """
         assert(isinstance(reloadable_config, ReloadableConfig))
         assert(isinstance(spread_feed, Feed))
         assert(isinstance(control_feed, Feed))
         assert(isinstance(history, History))
 
         try:
-            config = reloadable_config.get_config(spread_feed.get()[0])
+            spread_feed_value = spread_feed.get()[0]
+            config = reloadable_config.get_config(spread_feed_value)
             control_feed_value = control_feed.get()[0]
 
+            if 'canBuy' not in control_feed_value or 'canSell' not in control_feed_value:
+                logging.getLogger().warning("Control feed expired. Assuming no buy bands and no sell bands.")
+
+                can_buy = False
+                can_sell = False
+
+            else:
+                can_buy = bool(control_feed_value['canBuy'])
+                can_sell = bool(control_feed_value['canSell'])
+
+                if not can_buy:
+                    logging.getLogger().warning("Control feed says we shall not buy. Assuming no buy bands.")
+
+                if not can_sell:
+                    logging.getLogger().warning("Control feed says we shall not sell. Assuming no sell bands.")
+
+            fingerprint = (reloadable_config.config_checksum(), dict(spread_feed_value), can_buy, can_sell)
+
+            compiled = Bands._compiled_bands.get((id(reloadable_config), id(history)))
+            if compiled is not None \
+                    and compiled['reloadable_config'] is reloadable_config \
+                    and compiled['history'] is history \
+                    and compiled['fingerprint'] == fingerprint \
+                    and (compiled['config'] is config or compiled['config'] == config):
+                return compiled['bands']
+
             buy_bands = list(map(BuyBand, config['buyBands']))
             buy_limits = SideLimits(config['buyLimits'] if 'buyLimits' in config else [], history.buy_history)
             sell_bands = list(map(SellBand, config['sellBands']))
             sell_limits = SideLimits(config['sellLimits'] if 'sellLimits' in config else [], history.sell_history)
 
-            if 'canBuy' not in control_feed_value or 'canSell' not in control_feed_value:
-                logging.getLogger().warning("Control feed expired. Assuming no buy bands and no sell bands.")
-
+            if not can_buy:
                 buy_bands = []
+
+            if not can_sell:
                 sell_bands = []
 
-            else:
-                if not control_feed_value['canBuy']:
-                    logging.getLogger().warning("Control feed says we shall not buy. Assuming no buy bands.")
-                    buy_bands = []
+            bands = Bands(buy_bands=buy_bands, buy_limits=buy_limits, sell_bands=sell_bands, sell_limits=sell_limits)
 
-                if not control_feed_value['canSell']:
-                    logging.getLogger().warning("Control feed says we shall not sell. Assuming no sell bands.")
-                    sell_bands = []
+            Bands._compiled_bands[(id(reloadable_config), id(history))] = {'reloadable_config': reloadable_config,
+                                                                           'history': history,
+                                                                           'fingerprint': fingerprint,
+                                                                           'config': config,
+                                                                           'bands': bands}
+
+            return bands
 
         except Exception as e:
             logging.getLogger().exception(f"Config file is invalid ({e}). Treating the config file as it has no bands.")
@@ -258,6 +480,7 @@ class Bands:
         self.buy_limits = buy_limits
         self.sell_bands = sell_bands
         self.sell_limits = sell_limits
+        self._memberships = {}
 
         if self._bands_overlap(self.buy_bands) or self._bands_overlap(self.sell_bands):
             self.logger.warning("Bands in the config file overlap. Treating the config file as it has no bands.")
@@ -265,15 +488,29 @@ class Bands:
             self.buy_bands = []
             self.sell_bands = []
 
+    def band_membership(self, bands: list, orders: list, target_price: Wad) -> BandMembership:
+        """Return the assignment of `orders` to `bands`, reusing the last one calculated for the same inputs."""
+        assert(isinstance(bands, list))
+        assert(isinstance(orders, list))
+        assert(isinstance(target_price, Wad))
+
+        membership = self._memberships.get(id(bands))
+        if membership is None or not membership.matches(bands, orders, target_price):
+            membership = BandMembership(bands, orders, target_price)
+            self._memberships[id(bands)] = membership
+
+        return membership
+
     def _excessive_sell_orders(self, our_sell_orders: list, target_price: Wad):
         """Return sell orders which need to be cancelled to bring total amounts within all sell bands below maximums."""
         assert(isinstance(our_sell_orders, list))
         assert(isinstance(target_price, Wad))
 
         bands = self.sell_bands
+        membership = self.band_membership(bands, our_sell_orders, target_price)
 
-        for band in bands:
-            for order in band.excessive_orders(our_sell_orders, target_price, band == bands[0], band == bands[-1]):
+        for index, band in enumerate(bands):
+            for order in band._excessive_orders(membership.orders_in_band[index], target_price, index == 0, index == len(bands) - 1):
                 yield order
 
     def _excessive_buy_orders(self, our_buy_orders: list, target_price: Wad):
@@ -282,9 +519,10 @@ class Bands:
         assert(isinstance(target_price, Wad))
 
         bands = self.buy_bands
+        membership = self.band_membership(bands, our_buy_orders, target_price)
 
-        for band in bands:
-            for order in band.excessive_orders(our_buy_orders, target_price, band == bands[0], band == bands[-1]):
+        for index, band in enumerate(bands):
+            for order in band._excessive_orders(membership.orders_in_band[index], target_price, index == 0, index == len(bands) - 1):
                 yield order
 
     def _outside_any_band_orders(self, orders: list, bands: list, target_price: Wad):
@@ -293,12 +531,12 @@ class Bands:
         assert(isinstance(bands, list))
         assert(isinstance(target_price, Wad))
 
-        for order in orders:
-            if not any(band.includes(order, target_price) for band in bands):
-                self.logger.info(f"Order #{order.order_id} doesn't belong to any band, scheduling it for cancellation")
+        for order in self.band_membership(bands, orders, target_price).orders_outside_bands:
+            self.logger.info(f"Order #{order.order_id} doesn't belong to any band, scheduling it for cancellation")
 
-                yield order
+            yield order
 
+    @timed_phase('cancellable')
     def cancellable_orders(self, our_buy_orders: list, our_sell_orders: list, target_price: Price) -> list:
         assert(isinstance(our_buy_orders, list))
         assert(isinstance(our_sell_orders, list))
@@ -322,6 +560,7 @@ class Bands:
 
         return buy_orders_to_cancel + sell_orders_to_cancel
 
+    @timed_phase('new_orders')
     def new_orders(self, our_buy_orders: list, our_sell_orders: list, our_buy_balance: Wad, our_sell_balance: Wad, target_price: Price) -> Tuple[list, Wad, Wad]:
         assert(isinstance(our_buy_orders, list))
         assert(isinstance(our_sell_orders, list))
@@ -343,6 +582,52 @@ class Bands:
         else:
             return [], Wad(0), Wad(0)
 
+    def reconcile(self, our_buy_orders: list, our_sell_orders: list, our_buy_balance: Wad, our_sell_balance: Wad, target_price: Price,
+                  order_band_function=None) -> Reconciliation:
+        """Return orders to cancel and new orders to place in order to bring keeper orders in line with the bands.
+
+        New orders are calculated as if the orders to cancel had been cancelled already, so both can be
+        submitted in the same round trip instead of placing new orders only once the cancellations
+        got confirmed. As new orders only use `our_buy_balance` and `our_sell_balance`, orders which
+        need the balance freed by the cancellations will only get created on one of the next calls.
+
+        If `order_band_function` is passed, orders to cancel get paired with new orders created for the band
+        they have been placed for, as told by the function, and returned as `orders_to_amend` instead
+        (see `pair_amendments()`). This way an order which only needs its price or amount changed within
+        its band takes one request instead of two. `OrderBookManager.order_band()` can be used for orders
+        placed through the order book manager.
+        """
+        assert(isinstance(our_buy_orders, list))
+        assert(isinstance(our_sell_orders, list))
+        assert(isinstance(our_buy_balance, Wad))
+        assert(isinstance(our_sell_balance, Wad))
+        assert(isinstance(target_price, Price))
+        assert(callable(order_band_function) or order_band_function is None)
+
+        orders_to_cancel = self.cancellable_orders(our_buy_orders=our_buy_orders,
+                                                   our_sell_orders=our_sell_orders,
+                                                   target_price=target_price)
+
+        # Orders are compared by identity, as not all of them can be compared by their contents.
+        cancelled = set(map(id, orders_to_cancel))
+        orders_to_place, missing_buy_amount, missing_sell_amount = \
+            self.new_orders(our_buy_orders=[order for order in our_buy_orders if id(order) not in cancelled],
+                            our_sell_orders=[order for order in our_sell_orders if id(order) not in cancelled],
+                            our_buy_balance=our_buy_balance,
+                            our_sell_balance=our_sell_balance,
+                            target_price=target_price)
+
+        orders_to_amend = []
+        if order_band_function is not None:
+            orders_to_amend, orders_to_cancel, orders_to_place = pair_amendments(orders_to_cancel, orders_to_place,
+                                                                                 order_band_function)
+
+        return Reconciliation(orders_to_cancel=orders_to_cancel,
+                              orders_to_place=orders_to_place,
+                              missing_buy_amount=missing_buy_amount,
+                              missing_sell_amount=missing_sell_amount,
+                              orders_to_amend=orders_to_amend)
+
     def _new_sell_orders(self, our_sell_orders: list, our_sell_balance: Wad, target_price: Wad):
         """Return sell orders which need to be placed to bring total amounts within all sell bands above minimums."""
         assert(isinstance(our_sell_orders, list))
@@ -353,8 +638,10 @@ class Bands:
         limit_amount = self.sell_limits.available_limit(time.time())
         missing_amount = Wad(0)
 
-        for band in self.sell_bands:
-            orders = [order for order in our_sell_orders if band.includes(order, target_price)]
+        membership = self.band_membership(self.sell_bands, our_sell_orders, target_price)
+
+        for index, band in enumerate(self.sell_bands):
+            orders = membership.orders_in_band[index]
             total_amount = self.total_amount(orders)
             if total_amount < band.min_amount:
                 price = band.avg_price(target_price)
@@ -389,8 +676,10 @@ class Bands:
         limit_amount = self.buy_limits.available_limit(time.time())
         missing_amount = Wad(0)
 
-        for band in self.buy_bands:
-            orders = [order for order in our_buy_orders if band.includes(order, target_price)]
+        membership = self.band_membership(self.buy_bands, our_buy_orders, target_price)
+
+        for index, band in enumerate(self.buy_bands):
+            orders = membership.orders_in_band[index]
             total_amount = self.total_amount(orders)
             if total_amount < band.min_amount:
                 price = band.avg_price(target_price)
@@ -417,7 +706,7 @@ class Bands:
 
     @staticmethod
     def total_amount(orders):
-        return reduce(operator.add, map(lambda order: order.remaining_sell_amount, orders), Wad(0))
+        return Wad(wad_sum(order.remaining_sell_amount.value for order in orders))
 
     @staticmethod
     def _bands_overlap(bands: list):
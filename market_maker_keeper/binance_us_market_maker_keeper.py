@@ -16,23 +16,31 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import argparse
+import hashlib
+import hmac
 import logging
 import sys
 from datetime import datetime
 from typing import List
+from urllib.parse import urlencode
 
+import requests
 import time
 from math import log10
 
 from market_maker_keeper.band import Band, Bands, NewOrder
 from market_maker_keeper.control_feed import create_control_feed
 from market_maker_keeper.feed import Feed
-from market_maker_keeper.limit import History
+from market_maker_keeper.fixed_point import wad_mul
+from market_maker_keeper.limit import History, create_history
 from market_maker_keeper.order_book import OrderBookManager
 from market_maker_keeper.order_history_reporter import create_order_history_reporter
-from market_maker_keeper.price_feed import PriceFeedFactory
+from market_maker_keeper.price_feed import PriceFeedFactory, add_price_feed_aggregation_arguments
+from market_maker_keeper.rate_limit import RateLimitGovernor, add_rate_limit_arguments, create_rate_limit_governor
+from market_maker_keeper.refresh_scheduler import add_refresh_scheduler_arguments, create_refresh_scheduler
 from market_maker_keeper.reloadable_config import ReloadableConfig
 from market_maker_keeper.spread_feed import create_spread_feed
+from market_maker_keeper.sync_scheduler import SyncScheduler
 from market_maker_keeper.util import setup_logging
 from pymaker.lifecycle import Lifecycle
 from pymaker.numeric import Wad
@@ -55,6 +63,7 @@ class BinanceBands(Bands):
         self.buy_limits = bands.buy_limits
         self.sell_bands = bands.sell_bands
         self.sell_limits = bands.sell_limits
+        self._memberships = bands._memberships
 
         self.rules = rules
 
@@ -69,8 +78,10 @@ class BinanceBands(Bands):
         limit_amount = self.sell_limits.available_limit(time.time())
         missing_amount = Wad(0)
 
-        for band in self.sell_bands:
-            orders = [order for order in our_sell_orders if band.includes(order, target_price)]
+        membership = self.band_membership(self.sell_bands, our_sell_orders, target_price)
+
+        for index, band in enumerate(self.sell_bands):
+            orders = membership.orders_in_band[index]
             total_amount = self.total_amount(orders)
             if total_amount < band.min_amount:
                 price = self._calculate_price(band, target_price)
@@ -105,8 +116,10 @@ class BinanceBands(Bands):
         limit_amount = self.buy_limits.available_limit(time.time())
         missing_amount = Wad(0)
 
-        for band in self.buy_bands:
-            orders = [order for order in our_buy_orders if band.includes(order, target_price)]
+        membership = self.band_membership(self.buy_bands, our_buy_orders, target_price)
+
+        for index, band in enumerate(self.buy_bands):
+            orders = membership.orders_in_band[index]
             total_amount = self.total_amount(orders)
             if total_amount < band.min_amount:
                 price = self._calculate_price(band, target_price)
@@ -142,7 +155,7 @@ class BinanceBands(Bands):
         return price
 
     def _calculate_buy_amount_for_sell_orders(self, price: Wad, pay_amount: Wad) -> Wad:
-        buy_amount = pay_amount * price
+        buy_amount = Wad(wad_mul(pay_amount.value, price.value))
 
         if self._is_incorrect_amount(buy_amount):
             precision = self._get_decimal_places(self.rules.tick_size)
@@ -160,10 +173,10 @@ class BinanceBands(Bands):
         return buy_amount
 
     def _is_incorrect_price(self, price: Wad) -> bool:
-        return not ((price - self.rules.min_price) % self.rules.tick_size == Wad(0))
+        return (price.value - self.rules.min_price.value) % self.rules.tick_size.value != 0
 
     def _is_incorrect_amount(self, amount: Wad) -> bool:
-        return not ((amount - self.rules.min_quantity) % self.rules.step_size == Wad(0))
+        return (amount.value - self.rules.min_quantity.value) % self.rules.step_size.value != 0
               
     @staticmethod
     def _get_decimal_places(number: Wad) -> int:
@@ -202,6 +215,8 @@ class BinanceUsMarketMakerKeeper:
         parser.add_argument("--price-feed-expiry", type=int, default=120,
                             help="Maximum age of the price feed (in seconds, default: 120)")
 
+        add_price_feed_aggregation_arguments(parser)
+
         parser.add_argument("--spread-feed", type=str,
                             help="Source of spread feed")
 
@@ -220,9 +235,24 @@ class BinanceUsMarketMakerKeeper:
         parser.add_argument("--order-history-every", type=int, default=30,
                             help="Frequency of reporting active orders (in seconds, default: 30)")
 
+        parser.add_argument("--trade-limit-journal", type=str,
+                            help="File to persist trade limit usage in, so limits survive keeper restarts")
+
         parser.add_argument("--refresh-frequency", type=int, default=3,
                             help="Order book refresh frequency (in seconds, default: 3)")
 
+        add_refresh_scheduler_arguments(parser)
+
+        parser.add_argument("--rules-refresh-frequency", type=int, default=3600,
+                            help="Trading rules refresh frequency (in seconds, default: 3600)."
+                                 " Rules also get refreshed after an order has been rejected")
+
+        parser.add_argument("--amend-orders", dest='amend_orders', action='store_true',
+                            help="Replace orders which only need their price or amount changed within their band"
+                                 " with a single cancel-replace request, instead of cancelling and placing them separately")
+
+        add_rate_limit_arguments(parser)
+
         parser.add_argument("--debug", dest='debug', action='store_true',
                             help="Enable debug output")
 
@@ -235,26 +265,41 @@ class BinanceUsMarketMakerKeeper:
         self.control_feed = create_control_feed(self.arguments)
         self.order_history_reporter = create_order_history_reporter(self.arguments)
 
-        self.history = History()
+        self.history = create_history(self.arguments)
+
+        self.rules = None
+        self.rules_timestamp = None
 
         self.binance_api = BinanceUsApi(api_server=self.arguments.binance_us_api_server,
                                         api_key=self.arguments.binance_us_api_key,
                                         secret_key=self.arguments.binance_us_secret_key,
                                         timeout=self.arguments.binance_us_timeout)
 
+        self.rate_limit_governor = create_rate_limit_governor(self.arguments)
         self.order_book_manager = OrderBookManager(refresh_frequency=self.arguments.refresh_frequency)
+        self.order_book_manager.govern_requests_with(self.rate_limit_governor)
+        self.order_book_manager.schedule_refresh_with(create_refresh_scheduler(self.arguments, self.price_feed))
         self.order_book_manager.get_orders_with(lambda: self.binance_api.get_orders(self.pair()))
         self.order_book_manager.get_balances_with(lambda: self.binance_api.get_balances())
         self.order_book_manager.cancel_orders_with(lambda order: self.binance_api.cancel_order(order.order_id, self.pair()))
+        self.order_book_manager.drop_stale_placements_with(lambda new_order: new_order.is_stale(self.price_feed.get_price()))
+        self.order_book_manager.track_balances_with(self.token_buy(), self.token_sell())
+
+        if self.arguments.amend_orders:
+            self.order_book_manager.amend_orders_with(self.amend_order)
+
         self.order_book_manager.enable_history_reporting(self.order_history_reporter, self.our_buy_orders,
                                                          self.our_sell_orders)
         self.order_book_manager.start()
 
+        self.sync_scheduler = SyncScheduler(self.synchronize_orders)
+        self.sync_scheduler.watch(self.price_feed, self.spread_feed, self.control_feed, self.order_book_manager)
+
     def main(self):
         with Lifecycle() as lifecycle:
             lifecycle.initial_delay(10)
             lifecycle.on_startup(self.startup)
-            lifecycle.every(1, self.synchronize_orders)
+            lifecycle.every(1, self.sync_scheduler.heartbeat)
             lifecycle.on_shutdown(self.shutdown)
 
     def startup(self):
@@ -263,7 +308,9 @@ class BinanceUsMarketMakerKeeper:
         self.quote_precision = quote_precision
 
     def shutdown(self):
+        self.sync_scheduler.stop()
         self.order_book_manager.cancel_all_orders()
+        self.history.flush()
 
     def pair(self):
         return self.arguments.pair.upper()
@@ -288,34 +335,50 @@ class BinanceUsMarketMakerKeeper:
     def our_buy_orders(self, our_orders: list) -> list:
         return list(filter(lambda order: not order.is_sell, our_orders))
 
+    def get_rules(self) -> BinanceUsRules:
+        rules = self.rules
+
+        if rules is None or time.time() - self.rules_timestamp >= self.arguments.rules_refresh_frequency:
+            rules = self.rate_limit_governor.call(RateLimitGovernor.REFRESH, self.binance_api.get_rules, self.pair())
+
+            self.rules = rules
+            self.rules_timestamp = time.time()
+
+        return rules
+
+    def invalidate_rules(self):
+        # Rejected orders may be caused by rules which changed since we fetched them,
+        # so they get fetched again before the next synchronization.
+        self.rules = None
+
     def synchronize_orders(self):
-        rules = self.binance_api.get_rules(self.pair())
-        bands = BinanceBands.read(self.bands_config, self.spread_feed, self.control_feed, self.history, rules)
+        bands = BinanceBands.read(self.bands_config, self.spread_feed, self.control_feed, self.history, self.get_rules())
 
         order_book = self.order_book_manager.get_order_book()
         target_price = self.price_feed.get_price()
 
-        # Cancel orders
-        cancellable_orders = bands.cancellable_orders(our_buy_orders=self.our_buy_orders(order_book.orders),
-                                                      our_sell_orders=self.our_sell_orders(order_book.orders),
-                                                      target_price=target_price)
-        if len(cancellable_orders) > 0:
-            self.order_book_manager.cancel_orders(cancellable_orders)
-            return
-
-        # Do not place new orders if order book state is not confirmed
-        if order_book.orders_being_placed or order_book.orders_being_cancelled:
-            self.logger.debug("Order book is in progress, not placing new orders")
+        # Cancel orders and place new orders which do not depend on balance freed by these cancellations,
+        # all in one go. Cancellations are always executed before placements anyway.
+        reconciliation = bands.reconcile(our_buy_orders=self.our_buy_orders(order_book.orders),
+                                         our_sell_orders=self.our_sell_orders(order_book.orders),
+                                         our_buy_balance=self.our_available_balance(order_book.balances, self.token_buy()) + order_book.balance_adjustment(self.token_buy()),
+                                         our_sell_balance=self.our_available_balance(order_book.balances, self.token_sell()) + order_book.balance_adjustment(self.token_sell()),
+                                         target_price=target_price,
+                                         order_band_function=self.order_book_manager.order_band if self.arguments.amend_orders else None)
+        if len(reconciliation.orders_to_cancel) > 0:
+            self.order_book_manager.cancel_orders(reconciliation.orders_to_cancel)
+
+        # Amend orders which only need their price or amount changed within their band
+        if len(reconciliation.orders_to_amend) > 0:
+            self.order_book_manager.amend_orders(reconciliation.orders_to_amend)
+
+        # Do not place new orders while other orders are being placed, as these are not in the order book yet
+        if order_book.orders_being_placed:
+            self.logger.debug("Orders are being placed, not placing new orders")
             return
 
         # Place new orders
-        new_orders = bands.new_orders(our_buy_orders=self.our_buy_orders(order_book.orders),
-                                      our_sell_orders=self.our_sell_orders(order_book.orders),
-                                      our_buy_balance=self.our_available_balance(order_book.balances, self.token_buy()),
-                                      our_sell_balance=self.our_available_balance(order_book.balances, self.token_sell()),
-                                      target_price=target_price)[0]
-
-        self.place_orders(new_orders)
+        self.place_orders(reconciliation.orders_to_place)
 
     def place_orders(self, new_orders: List[NewOrder]):
         def place_order_function(new_order_to_be_placed):
@@ -323,7 +386,11 @@ class BinanceUsMarketMakerKeeper:
             amount = new_order_to_be_placed.pay_amount if new_order_to_be_placed.is_sell else new_order_to_be_placed.buy_amount
             amount = round(amount, self.quote_asset_precision)
 
-            order_id = self.binance_api.place_order(self.pair(), new_order_to_be_placed.is_sell, price, amount)
+            try:
+                order_id = self.binance_api.place_order(self.pair(), new_order_to_be_placed.is_sell, price, amount)
+            except Exception:
+                self.invalidate_rules()
+                raise
 
             return Order(order_id=order_id,
                          pair=self.pair(),
@@ -333,7 +400,41 @@ class BinanceUsMarketMakerKeeper:
                          amount=amount)
 
         for new_order in new_orders:
-            self.order_book_manager.place_order(lambda new_order=new_order: place_order_function(new_order))
+            self.order_book_manager.place_order(lambda new_order=new_order: place_order_function(new_order), new_order)
+
+    def amend_order(self, order: Order, new_order: NewOrder) -> Order:
+        price = round(new_order.price, self.quote_precision)
+        amount = new_order.pay_amount if new_order.is_sell else new_order.buy_amount
+        amount = round(amount, self.quote_asset_precision)
+
+        # With `STOP_ON_FAILURE` the new order does not get placed if the cancellation fails. If the cancellation
+        # succeeds but the placement fails, the request fails as well and the next refresh notices the order is gone.
+        parameters = urlencode({'symbol': self.pair().replace('-', ''),
+                                'side': 'SELL' if new_order.is_sell else 'BUY',
+                                'type': 'LIMIT',
+                                'timeInForce': 'GTC',
+                                'cancelReplaceMode': 'STOP_ON_FAILURE',
+                                'cancelOrderId': order.order_id,
+                                'quantity': f"{float(amount):.{self.quote_asset_precision}f}",
+                                'price': f"{float(price):.{self.quote_precision}f}",
+                                'timestamp': int(time.time() * 1000)})
+        signature = hmac.new(self.arguments.binance_us_secret_key.encode('utf-8'), parameters.encode('utf-8'), hashlib.sha256).hexdigest()
+
+        response = requests.post(f"{self.arguments.binance_us_api_server}/api/v3/order/cancelReplace?{parameters}&signature={signature}",
+                                 headers={'X-MBX-APIKEY': self.arguments.binance_us_api_key},
+                                 timeout=self.arguments.binance_us_timeout)
+        if not response.ok:
+            self.invalidate_rules()
+            raise Exception(f"Binance US API invalid HTTP response: {response.status_code} {response.text}")
+
+        self.logger.info(f"Amended order #{order.order_id} to {'sell' if new_order.is_sell else 'buy'} {amount} @ {price}")
+
+        return Order(order_id=response.json()['newOrderResponse']['orderId'],
+                     pair=self.pair(),
+                     is_sell=new_order.is_sell,
+                     price=price,
+                     timestamp=int(datetime.now().timestamp()),
+                     amount=amount)
 
 
 if __name__ == '__main__':
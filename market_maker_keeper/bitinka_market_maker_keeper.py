@@ -22,12 +22,15 @@ from typing import List
 
 from market_maker_keeper.band import Bands, NewOrder
 from market_maker_keeper.control_feed import create_control_feed
-from market_maker_keeper.limit import History
+from market_maker_keeper.limit import create_history
 from market_maker_keeper.order_book import OrderBookManager
 from market_maker_keeper.order_history_reporter import create_order_history_reporter
-from market_maker_keeper.price_feed import PriceFeedFactory
+from market_maker_keeper.price_feed import PriceFeedFactory, add_price_feed_aggregation_arguments
+from market_maker_keeper.rate_limit import add_rate_limit_arguments, create_rate_limit_governor
+from market_maker_keeper.refresh_scheduler import add_refresh_scheduler_arguments, create_refresh_scheduler
 from market_maker_keeper.reloadable_config import ReloadableConfig
 from market_maker_keeper.spread_feed import create_spread_feed
+from market_maker_keeper.sync_scheduler import SyncScheduler
 from market_maker_keeper.util import setup_logging
 from pymaker.lifecycle import Lifecycle
 from pymaker.numeric import Wad
@@ -66,6 +69,8 @@ class BitinkaMarketMakerKeeper:
         parser.add_argument("--price-feed-expiry", type=int, default=120,
                             help="Maximum age of the price feed (in seconds, default: 120)")
 
+        add_price_feed_aggregation_arguments(parser)
+
         parser.add_argument("--spread-feed", type=str,
                             help="Source of spread feed")
 
@@ -84,9 +89,16 @@ class BitinkaMarketMakerKeeper:
         parser.add_argument("--order-history-every", type=int, default=30,
                             help="Frequency of reporting active orders (in seconds, default: 30)")
 
+        parser.add_argument("--trade-limit-journal", type=str,
+                            help="File to persist trade limit usage in, so limits survive keeper restarts")
+
         parser.add_argument("--refresh-frequency", type=int, default=3,
                             help="Order book refresh frequency (in seconds, default: 3)")
 
+        add_refresh_scheduler_arguments(parser)
+
+        add_rate_limit_arguments(parser)
+
         parser.add_argument("--debug", dest='debug', action='store_true',
                             help="Enable debug output")
 
@@ -99,29 +111,39 @@ class BitinkaMarketMakerKeeper:
         self.control_feed = create_control_feed(self.arguments)
         self.order_history_reporter = create_order_history_reporter(self.arguments)
 
-        self.history = History()
+        self.history = create_history(self.arguments)
 
         self.bitinka_api = BitinkaApi(api_server=self.arguments.bitinka_api_server,
                                       api_key=self.arguments.bitinka_api_key,
                                       secret_key=self.arguments.bitinka_secret_key,
                                       timeout=self.arguments.bitinka_timeout)
 
+        self.rate_limit_governor = create_rate_limit_governor(self.arguments)
         self.order_book_manager = OrderBookManager(refresh_frequency=self.arguments.refresh_frequency)
+        self.order_book_manager.govern_requests_with(self.rate_limit_governor)
+        self.order_book_manager.schedule_refresh_with(create_refresh_scheduler(self.arguments, self.price_feed))
         self.order_book_manager.get_orders_with(lambda: self.bitinka_api.get_orders(self.pair()))
         self.order_book_manager.get_balances_with(lambda: self.bitinka_api.get_trade_balances())
         self.order_book_manager.cancel_orders_with(lambda order: self.bitinka_api.cancel_order(order.order_id))
+        self.order_book_manager.drop_stale_placements_with(lambda new_order: new_order.is_stale(self.price_feed.get_price()))
+        self.order_book_manager.track_balances_with(self.token_buy(), self.token_sell())
         self.order_book_manager.enable_history_reporting(self.order_history_reporter, self.our_buy_orders,
                                                          self.our_sell_orders)
         self.order_book_manager.start()
 
+        self.sync_scheduler = SyncScheduler(self.synchronize_orders)
+        self.sync_scheduler.watch(self.price_feed, self.spread_feed, self.control_feed, self.order_book_manager)
+
     def main(self):
         with Lifecycle() as lifecycle:
             lifecycle.initial_delay(10)
-            lifecycle.every(1, self.synchronize_orders)
+            lifecycle.every(1, self.sync_scheduler.heartbeat)
             lifecycle.on_shutdown(self.shutdown)
 
     def shutdown(self):
+        self.sync_scheduler.stop()
         self.order_book_manager.cancel_all_orders()
+        self.history.flush()
 
     def pair(self):
         return self.arguments.pair.upper()
@@ -150,27 +172,23 @@ class BitinkaMarketMakerKeeper:
 
         order_book = self.order_book_manager.get_order_book()
         target_price = self.price_feed.get_price()
-        # Cancel orders
-        cancellable_orders = bands.cancellable_orders(our_buy_orders=self.our_buy_orders(order_book.orders),
-                                                      our_sell_orders=self.our_sell_orders(order_book.orders),
-                                                      target_price=target_price)
-        if len(cancellable_orders) > 0:
-            self.order_book_manager.cancel_orders(cancellable_orders)
-            return
-
-        # Do not place new orders if order book state is not confirmed
-        if order_book.orders_being_placed or order_book.orders_being_cancelled:
-            self.logger.debug("Order book is in progress, not placing new orders")
+        # Cancel orders and place new orders which do not depend on balance freed by these cancellations,
+        # all in one go. Cancellations are always executed before placements anyway.
+        reconciliation = bands.reconcile(our_buy_orders=self.our_buy_orders(order_book.orders),
+                                         our_sell_orders=self.our_sell_orders(order_book.orders),
+                                         our_buy_balance=self.our_available_balance(order_book.balances, self.token_buy()) + order_book.balance_adjustment(self.token_buy()),
+                                         our_sell_balance=self.our_available_balance(order_book.balances, self.token_sell()) + order_book.balance_adjustment(self.token_sell()),
+                                         target_price=target_price)
+        if len(reconciliation.orders_to_cancel) > 0:
+            self.order_book_manager.cancel_orders(reconciliation.orders_to_cancel)
+
+        # Do not place new orders while other orders are being placed, as these are not in the order book yet
+        if order_book.orders_being_placed:
+            self.logger.debug("Orders are being placed, not placing new orders")
             return
 
         # Place new orders
-        new_orders = bands.new_orders(our_buy_orders=self.our_buy_orders(order_book.orders),
-                                      our_sell_orders=self.our_sell_orders(order_book.orders),
-                                      our_buy_balance=self.our_available_balance(order_book.balances, self.token_buy()),
-                                      our_sell_balance=self.our_available_balance(order_book.balances, self.token_sell()),
-                                      target_price=target_price)[0]
-
-        self.place_orders(new_orders)
+        self.place_orders(reconciliation.orders_to_place)
 
     def place_orders(self, new_orders: List[NewOrder]):
         def place_order_function(new_order_to_be_placed):
@@ -186,7 +204,7 @@ class BitinkaMarketMakerKeeper:
                          amount=amount)
 
         for new_order in new_orders:
-            self.order_book_manager.place_order(lambda new_order=new_order: place_order_function(new_order))
+            self.order_book_manager.place_order(lambda new_order=new_order: place_order_function(new_order), new_order)
 
 
 if __name__ == '__main__':
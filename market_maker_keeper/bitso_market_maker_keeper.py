@@ -22,12 +22,15 @@ import time
 
 from market_maker_keeper.band import Bands
 from market_maker_keeper.control_feed import create_control_feed
-from market_maker_keeper.limit import History
+from market_maker_keeper.limit import create_history
 from market_maker_keeper.order_book import OrderBookManager
 from market_maker_keeper.order_history_reporter import create_order_history_reporter
-from market_maker_keeper.price_feed import PriceFeedFactory
+from market_maker_keeper.price_feed import PriceFeedFactory, add_price_feed_aggregation_arguments
+from market_maker_keeper.rate_limit import add_rate_limit_arguments, create_rate_limit_governor
+from market_maker_keeper.refresh_scheduler import add_refresh_scheduler_arguments, create_refresh_scheduler
 from market_maker_keeper.reloadable_config import ReloadableConfig
 from market_maker_keeper.spread_feed import create_spread_feed
+from market_maker_keeper.sync_scheduler import SyncScheduler
 from market_maker_keeper.util import setup_logging
 from pyexchange.bitso import BitsoApi
 from pyexchange.model import Order
@@ -67,6 +70,8 @@ class BitsoMarketMakerKeeper:
         parser.add_argument("--price-feed-expiry", type=int, default=120,
                             help="Maximum age of the price feed (in seconds, default: 120)")
 
+        add_price_feed_aggregation_arguments(parser)
+
         parser.add_argument("--spread-feed", type=str,
                             help="Source of spread feed")
 
@@ -85,9 +90,16 @@ class BitsoMarketMakerKeeper:
         parser.add_argument("--order-history-every", type=int, default=30,
                             help="Frequency of reporting active orders (in seconds, default: 30)")
 
+        parser.add_argument("--trade-limit-journal", type=str,
+                            help="File to persist trade limit usage in, so limits survive keeper restarts")
+
         parser.add_argument("--refresh-frequency", type=int, default=3,
                             help="Order book refresh frequency (in seconds, default: 3)")
 
+        add_refresh_scheduler_arguments(parser)
+
+        add_rate_limit_arguments(parser)
+
         parser.add_argument("--debug", dest='debug', action='store_true',
                             help="Enable debug output")
 
@@ -100,27 +112,36 @@ class BitsoMarketMakerKeeper:
         self.control_feed = create_control_feed(self.arguments)
         self.order_history_reporter = create_order_history_reporter(self.arguments)
 
-        self.history = History()
+        self.history = create_history(self.arguments)
         self.bitso_api = BitsoApi(api_server=self.arguments.bitso_api_server,
                                 api_key=self.arguments.bitso_api_key,
                                 secret_key=self.arguments.bitso_secret_key,
                                 timeout=self.arguments.bitso_timeout)
 
+        self.rate_limit_governor = create_rate_limit_governor(self.arguments)
         self.order_book_manager = OrderBookManager(refresh_frequency=self.arguments.refresh_frequency)
+        self.order_book_manager.govern_requests_with(self.rate_limit_governor)
+        self.order_book_manager.schedule_refresh_with(create_refresh_scheduler(self.arguments, self.price_feed))
         self.order_book_manager.get_orders_with(lambda: self.bitso_api.get_orders(self.pair()))
         self.order_book_manager.get_balances_with(lambda: self.bitso_api.get_balances())
         self.order_book_manager.cancel_orders_with(lambda order: self.bitso_api.cancel_order(order.order_id))
+        self.order_book_manager.drop_stale_placements_with(lambda new_order: new_order.is_stale(self.price_feed.get_price()))
         self.order_book_manager.enable_history_reporting(self.order_history_reporter, self.our_buy_orders, self.our_sell_orders)
         self.order_book_manager.start()
 
+        self.sync_scheduler = SyncScheduler(self.synchronize_orders)
+        self.sync_scheduler.watch(self.price_feed, self.spread_feed, self.control_feed, self.order_book_manager)
+
     def main(self):
         with Lifecycle() as lifecycle:
             lifecycle.initial_delay(10)
-            lifecycle.every(1, self.synchronize_orders)
+            lifecycle.every(1, self.sync_scheduler.heartbeat)
             lifecycle.on_shutdown(self.shutdown)
 
     def shutdown(self):
+        self.sync_scheduler.stop()
         self.order_book_manager.cancel_all_orders()
+        self.history.flush()
 
     def pair(self):
         return self.arguments.pair.lower()
@@ -146,25 +167,31 @@ class BitsoMarketMakerKeeper:
         order_book = self.order_book_manager.get_order_book()
         target_price = self.price_feed.get_price()
 
-        # Cancel orders
-        cancellable_orders = bands.cancellable_orders(our_buy_orders=self.our_buy_orders(order_book.orders),
-                                                      our_sell_orders=self.our_sell_orders(order_book.orders),
-                                                      target_price=target_price)
-        if len(cancellable_orders) > 0:
-            self.order_book_manager.cancel_orders(cancellable_orders)
-            return
-
-        # Do not place new orders if order book state is not confirmed
+        # In case of Bitso, the `total` balance still contains amounts "locked" by currently open orders,
+        # so we need to explicitly subtract these amounts.
+        our_buy_balance = self.our_available_balance(order_book.balances, self.token_buy()) - Bands.total_amount(self.our_buy_orders(order_book.orders))
+        our_sell_balance = self.our_available_balance(order_book.balances, self.token_sell()) - Bands.total_amount(self.our_sell_orders(order_book.orders))
+
+        # Cancel orders and place new orders which do not depend on balance freed by these cancellations,
+        # all in one go. Cancellations are always executed before placements anyway.
+        reconciliation = bands.reconcile(our_buy_orders=self.our_buy_orders(order_book.orders),
+                                         our_sell_orders=self.our_sell_orders(order_book.orders),
+                                         our_buy_balance=our_buy_balance,
+                                         our_sell_balance=our_sell_balance,
+                                         target_price=target_price)
+        if len(reconciliation.orders_to_cancel) > 0:
+            self.order_book_manager.cancel_orders(reconciliation.orders_to_cancel)
+
+        # Do not place new orders if order book state is not confirmed. Orders being cancelled are not
+        # in the order book anymore, but as we subtract open orders from the total balance ourselves,
+        # amounts locked by them would look available before the exchange actually releases them.
+        # Orders cancelled above are still in `order_book`, so placing alongside them is safe.
         if order_book.orders_being_placed or order_book.orders_being_cancelled:
             self.logger.debug("Order book is in progress, not placing new orders")
             return
 
         # Place new orders
-        self.place_orders(bands.new_orders(our_buy_orders=self.our_buy_orders(order_book.orders),
-                                           our_sell_orders=self.our_sell_orders(order_book.orders),
-                                           our_buy_balance=self.our_available_balance(order_book.balances, self.token_buy()),
-                                           our_sell_balance=self.our_available_balance(order_book.balances, self.token_sell()),
-                                           target_price=target_price)[0])
+        self.place_orders(reconciliation.orders_to_place)
 
     def place_orders(self, new_orders):
         def place_order_function(new_order_to_be_placed):
@@ -183,7 +210,7 @@ class BitsoMarketMakerKeeper:
             return Order(str(order_id), int(time.time()), self.pair(), new_order_to_be_placed.is_sell, new_order_to_be_placed.price, amount)
 
         for new_order in new_orders:
-            self.order_book_manager.place_order(lambda new_order=new_order: place_order_function(new_order))
+            self.order_book_manager.place_order(lambda new_order=new_order: place_order_function(new_order), new_order)
 
 if __name__ == '__main__':
     BitsoMarketMakerKeeper(sys.argv[1:]).main()
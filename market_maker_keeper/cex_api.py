@@ -19,12 +19,15 @@ from argparse import Namespace
 
 from market_maker_keeper.band import Bands
 from market_maker_keeper.control_feed import create_control_feed
-from market_maker_keeper.limit import History
+from market_maker_keeper.limit import create_history
 from market_maker_keeper.order_book import OrderBookManager
 from market_maker_keeper.order_history_reporter import create_order_history_reporter
 from market_maker_keeper.price_feed import PriceFeedFactory
+from market_maker_keeper.rate_limit import create_rate_limit_governor
+from market_maker_keeper.refresh_scheduler import create_refresh_scheduler
 from market_maker_keeper.reloadable_config import ReloadableConfig
 from market_maker_keeper.spread_feed import create_spread_feed
+from market_maker_keeper.sync_scheduler import SyncScheduler
 from market_maker_keeper.util import setup_logging
 
 from pymaker.lifecycle import Lifecycle
@@ -47,31 +50,46 @@ class CEXKeeperAPI:
         self.control_feed = create_control_feed(arguments)
 
         self.order_history_reporter = create_order_history_reporter(arguments)
-        self.history = History()
+        self.history = create_history(arguments)
+        self.rate_limit_governor = create_rate_limit_governor(arguments)
 
         self.init_order_book_manager(arguments, pyex_api)
 
+        self.sync_scheduler = SyncScheduler(self.synchronize_orders)
+        self.sync_scheduler.watch(self.price_feed, self.spread_feed, self.control_feed, self.order_book_manager)
+
     def init_order_book_manager(self, arguments: Namespace, pyex_api: PyexAPI):
         self.order_book_manager = OrderBookManager(refresh_frequency=self.arguments.refresh_frequency)
+        self.order_book_manager.govern_requests_with(self.rate_limit_governor)
+        self.order_book_manager.schedule_refresh_with(create_refresh_scheduler(self.arguments, self.price_feed))
         self.order_book_manager.get_orders_with(lambda: pyex_api.get_orders(self.pair()))
         self.order_book_manager.get_balances_with(lambda: pyex_api.get_balances())
         self.order_book_manager.cancel_orders_with(lambda order: pyex_api.cancel_order(order.order_id))
+        self.order_book_manager.drop_stale_placements_with(lambda new_order: new_order.is_stale(self.price_feed.get_price()))
+        self.order_book_manager.track_balances_with(self.token_buy(), self.token_sell())
         self.order_book_manager.enable_history_reporting(self.order_history_reporter, self.our_buy_orders,
                                                         self.our_sell_orders)
+        self.configure_order_book_manager(arguments, pyex_api)
         self.order_book_manager.start()
 
+    def configure_order_book_manager(self, arguments: Namespace, pyex_api: PyexAPI):
+        """Lets exchange specific keepers configure the order book manager further, before it gets started."""
+        pass
+
     def main(self):
         with Lifecycle() as lifecycle:
             lifecycle.initial_delay(10)
             lifecycle.on_startup(self.startup)
-            lifecycle.every(1, self.synchronize_orders)
+            lifecycle.every(1, self.sync_scheduler.heartbeat)
             lifecycle.on_shutdown(self.shutdown)
 
     def startup(self):
         pass
 
     def shutdown(self):
+        self.sync_scheduler.stop()
         self.order_book_manager.cancel_all_orders()
+        self.history.flush()
 
     # Each exchange takes pair input as a different format
     def pair(self):
@@ -98,27 +116,33 @@ class CEXKeeperAPI:
         order_book = self.order_book_manager.get_order_book()
         target_price = self.price_feed.get_price()
 
-        # Cancel orders
-        cancellable_orders = bands.cancellable_orders(our_buy_orders=self.our_buy_orders(order_book.orders),
-                                                      our_sell_orders=self.our_sell_orders(order_book.orders),
-                                                      target_price=target_price)
-        if len(cancellable_orders) > 0:
-            self.order_book_manager.cancel_orders(cancellable_orders)
-            return
-
-        # Do not place new orders if order book state is not confirmed
-        if order_book.orders_being_placed or order_book.orders_being_cancelled:
-            self.logger.debug("Order book is in progress, not placing new orders")
+        # Cancel orders and place new orders which do not depend on balance freed by these cancellations,
+        # all in one go. Cancellations are always executed before placements anyway.
+        reconciliation = bands.reconcile(our_buy_orders=self.our_buy_orders(order_book.orders),
+                                         our_sell_orders=self.our_sell_orders(order_book.orders),
+                                         our_buy_balance=self.our_available_balance(order_book.balances,
+                                                                                    self.token_buy()) +
+                                                         order_book.balance_adjustment(self.token_buy()),
+                                         our_sell_balance=self.our_available_balance(order_book.balances,
+                                                                                     self.token_sell()) +
+                                                          order_book.balance_adjustment(self.token_sell()),
+                                         target_price=target_price,
+                                         order_band_function=self.order_book_manager.order_band
+                                         if self.order_book_manager.amend_order_function is not None else None)
+        if len(reconciliation.orders_to_cancel) > 0:
+            self.order_book_manager.cancel_orders(reconciliation.orders_to_cancel)
+
+        # Amend orders, if the exchange supports it and an amend function has been configured
+        if len(reconciliation.orders_to_amend) > 0:
+            self.order_book_manager.amend_orders(reconciliation.orders_to_amend)
+
+        # Do not place new orders while other orders are being placed, as these are not in the order book yet
+        if order_book.orders_being_placed:
+            self.logger.debug("Orders are being placed, not placing new orders")
             return
 
         # Place new orders
-        self.place_orders(bands.new_orders(our_buy_orders=self.our_buy_orders(order_book.orders),
-                                            our_sell_orders=self.our_sell_orders(order_book.orders),
-                                            our_buy_balance=self.our_available_balance(order_book.balances,
-                                                                                        self.token_buy()),
-                                            our_sell_balance=self.our_available_balance(order_book.balances,
-                                                                                        self.token_sell()),
-                                            target_price=target_price)[0])
+        self.place_orders(reconciliation.orders_to_place)
 
     def place_orders(self, new_orders: list):
         raise NotImplementedError()
@@ -25,6 +25,9 @@ from pyexchange.coinone import CoinoneApi, Order
 from pymaker.numeric import Wad
 
 from market_maker_keeper.order_book import OrderBookManager
+from market_maker_keeper.price_feed import add_price_feed_aggregation_arguments
+from market_maker_keeper.rate_limit import add_rate_limit_arguments, create_rate_limit_governor
+from market_maker_keeper.refresh_scheduler import add_refresh_scheduler_arguments, create_refresh_scheduler
 from market_maker_keeper.cex_api import CEXKeeperAPI
 from market_maker_keeper.band import Bands
 
@@ -59,6 +62,8 @@ class CoinoneMarketMakerKeeper(CEXKeeperAPI):
         parser.add_argument("--price-feed-expiry", type=int, default=120,
                             help="Maximum age of the price feed (in seconds, default: 120)")
 
+        add_price_feed_aggregation_arguments(parser)
+
         parser.add_argument("--spread-feed", type=str,
                             help="Source of spread feed")
 
@@ -77,9 +82,16 @@ class CoinoneMarketMakerKeeper(CEXKeeperAPI):
         parser.add_argument("--order-history-every", type=int, default=30,
                             help="Frequency of reporting active orders (in seconds, default: 30)")
 
+        parser.add_argument("--trade-limit-journal", type=str,
+                            help="File to persist trade limit usage in, so limits survive keeper restarts")
+
         parser.add_argument("--refresh-frequency", type=int, default=3,
                             help="Order book refresh frequency (in seconds, default: 3)")
 
+        add_refresh_scheduler_arguments(parser)
+
+        add_rate_limit_arguments(parser)
+
         parser.add_argument("--debug", dest='debug', action='store_true',
                             help="Enable debug output")
 
@@ -93,11 +105,15 @@ class CoinoneMarketMakerKeeper(CEXKeeperAPI):
 
     # override init as cancel_orders() has a non standard interface
     def init_order_book_manager(self, arguments, coinone_api):
+        self.rate_limit_governor = create_rate_limit_governor(self.arguments)
         self.order_book_manager = OrderBookManager(refresh_frequency=self.arguments.refresh_frequency)
+        self.order_book_manager.govern_requests_with(self.rate_limit_governor)
+        self.order_book_manager.schedule_refresh_with(create_refresh_scheduler(self.arguments, self.price_feed))
         self.order_book_manager.get_orders_with(lambda: self.coinone_api.get_orders(self.pair()))
         self.order_book_manager.get_balances_with(lambda: self.coinone_api.get_balances())
         self.order_book_manager.cancel_orders_with(
             lambda order: self.coinone_api.cancel_order(order.order_id, self.pair(), order.price, order.amount, order.is_sell))
+        self.order_book_manager.drop_stale_placements_with(lambda new_order: new_order.is_stale(self.price_feed.get_price()))
         self.order_book_manager.enable_history_reporting(self.order_history_reporter, self.our_buy_orders,
                                                          self.our_sell_orders)
 
@@ -129,7 +145,7 @@ class CoinoneMarketMakerKeeper(CEXKeeperAPI):
                          new_order_to_be_placed.price, amount)
 
         for new_order in new_orders:
-            self.order_book_manager.place_order(lambda new_order=new_order: place_order_function(new_order))
+            self.order_book_manager.place_order(lambda new_order=new_order: place_order_function(new_order), new_order)
 
 
 
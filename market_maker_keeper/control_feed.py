@@ -15,13 +15,13 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from market_maker_keeper.feed import Feed, ExpiringFeed, WebSocketFeed, EmptyFeed, FixedFeed
+from market_maker_keeper.feed import Feed, ExpiringFeed, EmptyFeed, FixedFeed, feed_registry
 
 
 def create_control_feed(arguments) -> Feed:
     try:
         if arguments.control_feed:
-            web_socket_feed = WebSocketFeed(arguments.control_feed, 5)
+            web_socket_feed = feed_registry.web_socket_feed(arguments.control_feed, 5)
             expiring_web_socket_feed = ExpiringFeed(web_socket_feed, arguments.control_feed_expiry)
 
             return expiring_web_socket_feed
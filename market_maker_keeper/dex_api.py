@@ -20,7 +20,7 @@ from web3 import Web3, HTTPProvider
 
 from market_maker_keeper.band import Bands
 from market_maker_keeper.control_feed import create_control_feed
-from market_maker_keeper.limit import History
+from market_maker_keeper.limit import create_history
 from market_maker_keeper.order_book import OrderBookManager
 from market_maker_keeper.order_history_reporter import create_order_history_reporter
 from market_maker_keeper.price_feed import PriceFeedFactory
@@ -62,7 +62,7 @@ class DEXKeeperAPI:
 
         self.order_history_reporter = create_order_history_reporter(arguments)
 
-        self.history = History()
+        self.history = create_history(arguments)
 
         self.init_order_book_manager(arguments, pyex_api)
 
@@ -104,6 +104,7 @@ class DEXKeeperAPI:
 
     def shutdown(self):
         self.order_book_manager.cancel_all_orders()
+        self.history.flush()
 
     def approve(self):
         raise NotImplementedError()
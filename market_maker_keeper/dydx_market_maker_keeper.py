@@ -29,6 +29,9 @@ from pymaker.numeric import Wad
 from market_maker_keeper.cex_api import CEXKeeperAPI
 from market_maker_keeper.band import Bands
 from market_maker_keeper.order_book import OrderBookManager
+from market_maker_keeper.price_feed import add_price_feed_aggregation_arguments
+from market_maker_keeper.rate_limit import add_rate_limit_arguments
+from market_maker_keeper.refresh_scheduler import add_refresh_scheduler_arguments, create_refresh_scheduler
 
 def total_amount(orders: list) -> Wad:
     return reduce(operator.add, map(lambda order: order.remaining_sell_amount, orders), Wad(0))
@@ -63,6 +66,8 @@ class DyDxMarketMakerKeeper(CEXKeeperAPI):
         parser.add_argument("--price-feed-expiry", type=int, default=120,
                             help="Maximum age of the price feed (in seconds, default: 120)")
 
+        add_price_feed_aggregation_arguments(parser)
+
         parser.add_argument("--spread-feed", type=str,
                             help="Source of spread feed")
 
@@ -81,9 +86,16 @@ class DyDxMarketMakerKeeper(CEXKeeperAPI):
         parser.add_argument("--order-history-every", type=int, default=30,
                             help="Frequency of reporting active orders (in seconds, default: 30)")
 
+        parser.add_argument("--trade-limit-journal", type=str,
+                            help="File to persist trade limit usage in, so limits survive keeper restarts")
+
         parser.add_argument("--refresh-frequency", type=int, default=3,
                             help="Order book refresh frequency (in seconds, default: 3)")
 
+        add_refresh_scheduler_arguments(parser)
+
+        add_rate_limit_arguments(parser)
+
         parser.add_argument("--debug", dest='debug', action='store_true',
                             help="Enable debug output")
 
@@ -101,9 +113,13 @@ class DyDxMarketMakerKeeper(CEXKeeperAPI):
 
     def init_order_book_manager(self, arguments, pyex_api):
         self.order_book_manager = OrderBookManager(refresh_frequency=self.arguments.refresh_frequency)
+        self.order_book_manager.govern_requests_with(self.rate_limit_governor)
+        self.order_book_manager.schedule_refresh_with(create_refresh_scheduler(self.arguments, self.price_feed))
         self.order_book_manager.get_orders_with(lambda: pyex_api.get_orders(self.pair()))
         self.order_book_manager.get_balances_with(lambda: pyex_api.get_balances())
         self.order_book_manager.cancel_orders_with(lambda order: pyex_api.cancel_order(order.order_id))
+        self.order_book_manager.drop_stale_placements_with(lambda new_order: new_order.is_stale(self.price_feed.get_price()))
+        self.order_book_manager.track_balances_with(self.token_buy(), self.token_sell())
         self.order_book_manager.enable_history_reporting(self.order_history_reporter, self.our_buy_orders,
                                                         self.our_sell_orders)
         self.order_book_manager.start()
@@ -140,7 +156,7 @@ class DyDxMarketMakerKeeper(CEXKeeperAPI):
             side = 'Sell' if new_order.is_sell else 'Buy'
             minimum_order_size = Wad(int(self.market_info[self.pair().upper()]['smallOrderThreshold']))
             if self._should_place_order(new_order, minimum_order_size):
-                self.order_book_manager.place_order(lambda new_order=new_order: place_order_function(new_order))
+                self.order_book_manager.place_order(lambda new_order=new_order: place_order_function(new_order), new_order)
             else:
                 logging.info(f"New {side} Order below size minimum of {minimum_order_size}. Order of amount {amount} ignored.")
 
@@ -149,25 +165,23 @@ class DyDxMarketMakerKeeper(CEXKeeperAPI):
         order_book = self.order_book_manager.get_order_book()
         target_price = self.price_feed.get_price()
 
-        # Cancel orders
-        cancellable_orders = bands.cancellable_orders(our_buy_orders=self.our_buy_orders(order_book.orders),
-                                                      our_sell_orders=self.our_sell_orders(order_book.orders),
-                                                      target_price=target_price)
-        if len(cancellable_orders) > 0:
-            self.order_book_manager.cancel_orders(cancellable_orders)
-            return
-
-        # Do not place new orders if order book state is not confirmed
-        if order_book.orders_being_placed or order_book.orders_being_cancelled:
-            self.logger.debug("Order book is in progress, not placing new orders")
+        # Cancel orders and place new orders which do not depend on balance freed by these cancellations,
+        # all in one go. Cancellations are always executed before placements anyway.
+        reconciliation = bands.reconcile(our_buy_orders=self.our_buy_orders(order_book.orders),
+                                         our_sell_orders=self.our_sell_orders(order_book.orders),
+                                         our_buy_balance=self.our_available_balance(order_book.balances, self.token_buy()) + order_book.balance_adjustment(self.token_buy()),
+                                         our_sell_balance=self.our_available_balance(order_book.balances, self.token_sell()) + order_book.balance_adjustment(self.token_sell()),
+                                         target_price=target_price)
+        if len(reconciliation.orders_to_cancel) > 0:
+            self.order_book_manager.cancel_orders(reconciliation.orders_to_cancel)
+
+        # Do not place new orders while other orders are being placed, as these are not in the order book yet
+        if order_book.orders_being_placed:
+            self.logger.debug("Orders are being placed, not placing new orders")
             return
 
         # Place new orders
-        self.place_orders(bands.new_orders(our_buy_orders=self.our_buy_orders(order_book.orders),
-                                           our_sell_orders=self.our_sell_orders(order_book.orders),
-                                           our_buy_balance=self.our_available_balance(order_book.balances, self.token_buy()),
-                                           our_sell_balance=self.our_available_balance(order_book.balances, self.token_sell()),
-                                           target_price=target_price)[0])
+        self.place_orders(reconciliation.orders_to_place)
 
 
 if __name__ == '__main__':
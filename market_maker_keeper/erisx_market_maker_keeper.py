@@ -35,6 +35,8 @@ from pymaker.lifecycle import Lifecycle
 from market_maker_keeper.band import Bands
 from market_maker_keeper.cex_api import CEXKeeperAPI
 from market_maker_keeper.order_book import OrderBookManager
+from market_maker_keeper.price_feed import add_price_feed_aggregation_arguments
+from market_maker_keeper.rate_limit import RateLimitGovernor, add_rate_limit_arguments
 from market_maker_keeper.util import setup_logging
 
 class ErisXLifecycle(Lifecycle):
@@ -102,6 +104,8 @@ class ErisXOrderBookManager(OrderBookManager):
         self._report_order_book_updated()
 
         try:
+            self._acquire_request_budget(RateLimitGovernor.PLACE)
+
             with self._lock:
                 new_order = place_order_function()
 
@@ -112,6 +116,7 @@ class ErisXOrderBookManager(OrderBookManager):
         finally:
             with self._lock:
                 self._currently_placing_orders -= 1
+                self._order_book_changed()
             self._report_order_book_updated()
 
     def cancel_orders(self, orders: list):
@@ -127,11 +132,15 @@ class ErisXOrderBookManager(OrderBookManager):
             for order in orders:
                 self._order_ids_cancelling.add(order.order_id)
 
+            self._order_book_changed()
+
         self._report_order_book_updated()
 
         for order in orders:
             order_id = order.order_id
             try:
+                self._acquire_request_budget(RateLimitGovernor.CANCEL)
+
                 with self._lock:
                     cancel_result, order_unknown = self.cancel_order_function(order)
 
@@ -147,15 +156,20 @@ class ErisXOrderBookManager(OrderBookManager):
             except BaseException as exception:
                 self.logger.exception(f"Failed to cancel {order_id}")
             finally:
-                try:
-                    self._order_ids_cancelling.remove(order_id)
-                except KeyError:
-                    pass
+                with self._lock:
+                    try:
+                        self._order_ids_cancelling.remove(order_id)
+                    except KeyError:
+                        pass
+
+                    self._order_book_changed()
                 self._report_order_book_updated()
 
     def _thread_refresh_order_book(self):
         while True:
             try:
+                self._acquire_request_budget(RateLimitGovernor.REFRESH)
+
                 with self._lock:
                     orders_already_cancelled_before = set(self._order_ids_cancelled)
                     orders_already_placed_before = set(self._orders_placed)
@@ -178,16 +192,20 @@ class ErisXOrderBookManager(OrderBookManager):
 
                     self.order_history_reporter.report_orders(orders_buy, orders_sell)
 
+                index = {order.order_id: order for order in orders}
+
                 with self._lock:
                     self._order_ids_cancelled = self._order_ids_cancelled - orders_already_cancelled_before
                     for order in orders_already_placed_before:
                         self._orders_placed.remove(order)
 
-                    if self._state is None:
-                        self.logger.info("Order book became available")
+                    timestamp = time.time()
+                    self._update_state(orders=orders, index=index, orders_timestamp=timestamp)
+                    if self.get_balances_function is not None:
+                        self._update_state(balances=balances, balances_timestamp=timestamp)
 
-                    self._state = {'orders': orders, 'balances': balances}
                     self._refresh_count += 1
+                    self._order_book_changed()
 
                 self._report_order_book_updated()
 
@@ -251,6 +269,8 @@ class ErisXMarketMakerKeeper(CEXKeeperAPI):
         parser.add_argument("--price-feed-expiry", type=int, default=120,
                             help="Maximum age of the price feed (in seconds, default: 120)")
 
+        add_price_feed_aggregation_arguments(parser)
+
         parser.add_argument("--spread-feed", type=str,
                             help="Source of spread feed")
 
@@ -269,9 +289,14 @@ class ErisXMarketMakerKeeper(CEXKeeperAPI):
         parser.add_argument("--order-history-every", type=int, default=30,
                             help="Frequency of reporting active orders (in seconds, default: 30)")
 
+        parser.add_argument("--trade-limit-journal", type=str,
+                            help="File to persist trade limit usage in, so limits survive keeper restarts")
+
         parser.add_argument("--refresh-frequency", type=int, default=3,
                             help="Order book refresh frequency (in seconds, default: 3)")
 
+        add_rate_limit_arguments(parser)
+
         parser.add_argument("--debug", dest='debug', action='store_true',
                             help="Enable debug output")
 
@@ -304,6 +329,7 @@ class ErisXMarketMakerKeeper(CEXKeeperAPI):
 
     def init_order_book_manager(self, arguments, erisx_api):
         self.order_book_manager = ErisXOrderBookManager(refresh_frequency=self.arguments.refresh_frequency)
+        self.order_book_manager.govern_requests_with(self.rate_limit_governor)
         self.order_book_manager.get_orders_with(lambda: self.get_orders())
         self.order_book_manager.get_balances_with(lambda: self.erisx_api.get_balances())
         self.order_book_manager.cancel_orders_with(
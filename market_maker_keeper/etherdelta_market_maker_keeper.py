@@ -26,9 +26,9 @@ from web3 import Web3, HTTPProvider
 from market_maker_keeper.band import Bands
 from market_maker_keeper.control_feed import create_control_feed
 from market_maker_keeper.gas import GasPriceFactory
-from market_maker_keeper.limit import History
+from market_maker_keeper.limit import create_history
 from market_maker_keeper.order_history_reporter import create_order_history_reporter
-from market_maker_keeper.price_feed import PriceFeedFactory
+from market_maker_keeper.price_feed import PriceFeedFactory, add_price_feed_aggregation_arguments
 from market_maker_keeper.reloadable_config import ReloadableConfig
 from market_maker_keeper.spread_feed import create_spread_feed
 from market_maker_keeper.util import setup_logging
@@ -93,6 +93,8 @@ class EtherDeltaMarketMakerKeeper:
         parser.add_argument("--price-feed-expiry", type=int, default=120,
                             help="Maximum age of the price feed (in seconds, default: 120)")
 
+        add_price_feed_aggregation_arguments(parser)
+
         parser.add_argument("--spread-feed", type=str,
                             help="Source of spread feed")
 
@@ -111,6 +113,9 @@ class EtherDeltaMarketMakerKeeper:
         parser.add_argument("--order-history-every", type=int, default=30,
                             help="Frequency of reporting active orders (in seconds, default: 30)")
 
+        parser.add_argument("--trade-limit-journal", type=str,
+                            help="File to persist trade limit usage in, so limits survive keeper restarts")
+
         parser.add_argument("--order-age", type=int, required=True,
                             help="Age of created orders (in blocks)")
 
@@ -183,7 +188,7 @@ class EtherDeltaMarketMakerKeeper:
         assert(self.arguments.order_expiry_threshold >= 0)
         assert(self.arguments.order_no_cancel_threshold >= self.arguments.order_expiry_threshold)
 
-        self.history = History()
+        self.history = create_history(self.arguments)
         self.etherdelta = EtherDelta(web3=self.web3, address=Address(self.arguments.etherdelta_address))
         self.etherdelta_api = EtherDeltaApi(client_tool_directory="lib/pymaker/utils/etherdelta-client",
                                             client_tool_command="node main.js",
@@ -212,6 +217,8 @@ class EtherDeltaMarketMakerKeeper:
         if self.arguments.withdraw_on_shutdown:
             self.withdraw_everything()
 
+        self.history.flush()
+
     def approve(self):
         token_addresses = filter(lambda address: address != EtherDelta.ETH_TOKEN, [self.token_sell(), self.token_buy()])
         tokens = list(map(lambda address: ERC20Token(web3=self.web3, address=address), token_addresses))
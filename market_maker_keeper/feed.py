@@ -25,8 +25,7 @@ from typing import Tuple
 import re
 from urllib.parse import urlparse
 
-import websocket
-
+from market_maker_keeper.feed_engine import FeedEngine, feed_engine
 from market_maker_keeper.util import sanitize_url
 
 
@@ -42,6 +41,10 @@ class EmptyFeed(Feed):
     def get(self) -> Tuple[dict, float]:
         return {}, 0.0
 
+    def on_update(self, on_update_function):
+        # The feed never changes.
+        assert(callable(on_update_function))
+
 
 class FixedFeed(Feed):
     def __init__(self, value: dict):
@@ -52,24 +55,65 @@ class FixedFeed(Feed):
     def get(self) -> Tuple[dict, float]:
         return self.value, time.time()
 
+    def on_update(self, on_update_function):
+        # The feed never changes.
+        assert(callable(on_update_function))
+
 
 class WebSocketFeed(Feed):
+    """Feed receiving its value over a WebSocket connection hosted by the (shared) `FeedEngine`.
+
+    Messages only ever get parsed on the engine thread, each one into a new immutable `(data, timestamp)`
+    snapshot replacing the previous one in one assignment, so `get()` never has to wait for anything.
+    Any number of functions can subscribe to updates with `on_update()`, so a single feed (and a single
+    connection) can be shared by everything interested in it, see `FeedRegistry`. They get called from
+    the engine thread, so must not block.
+
+    Each subscriber picks how it gets notified. By default it gets notified of every message. Subscribers
+    of high-frequency feeds, where only the latest value matters, can subscribe with `coalesce=True`
+    and get notified at most once every `notify_interval` seconds, however many messages arrived
+    in the meantime. As long as nobody needs every message, only the newest raw message gets kept
+    and it only gets parsed right before coalesced subscribers get notified, so messages superseded
+    in the meantime cost next to nothing. `get()` may then lag behind the newest message by up to
+    `notify_interval`, just like the notifications do.
+    """
+
     logger = logging.getLogger()
 
-    def __init__(self, ws_url: str, reconnect_delay: int):
+    def __init__(self, ws_url: str, reconnect_delay: int, engine: FeedEngine = None, notify_interval: float = 0.05):
         assert(isinstance(ws_url, str))
         assert(isinstance(reconnect_delay, int))
+        assert(isinstance(engine, FeedEngine) or engine is None)
+        assert(isinstance(notify_interval, (int, float)))
 
         self.ws_url = ws_url
         self.reconnect_delay = reconnect_delay
+        self.notify_interval = notify_interval
 
+        self._engine = engine or feed_engine
         self._header = self._get_header(ws_url)
         self._sanitized_url = sanitize_url(ws_url)
         self._last = {}, 0.0
         self._lock = threading.Lock()
-        self._on_update_function = None
-
-        threading.Thread(target=self._background_run, daemon=True).start()
+        self._on_update_functions = ()
+        self._on_coalesced_update_functions = ()
+
+        # The newest raw message with its sequence number, and the sequence number
+        # of the message `_last` has been parsed from. Only used on the engine thread.
+        self._frame = 0, None
+        self._parsed_sequence = 0
+        self._version = 0
+        self._notified_version = 0
+        self._refresh_pending = False
+
+        self._received = 0
+        self._invalid = 0
+        self._dropped = 0
+        self._coalesced = 0
+
+        self.connection = self._engine.connect(ws_url, self._on_message,
+                                               headers=self._header,
+                                               reconnect_delay=reconnect_delay)
 
     @staticmethod
     def _get_header(ws_url: str):
@@ -78,50 +122,115 @@ class WebSocketFeed(Feed):
 
         return ["Authorization: Basic %s" % basic_header]
 
-    def _background_run(self):
-        while True:
-            ws = websocket.WebSocketApp(url=self.ws_url,
-                                        header=self._header,
-                                        on_message=self._on_message,
-                                        on_error=self._on_error,
-                                        on_open=self._on_open,
-                                        on_close=self._on_close)
-            ws.run_forever(ping_interval=15, ping_timeout=10)
-            time.sleep(self.reconnect_delay)
+    def _on_message(self, message):
+        self._received += 1
+        self._frame = self._received, message
+
+        if len(self._on_update_functions) > 0 and self._parse_newest():
+            self._notify(self._on_update_functions)
+
+        if self._refresh_pending:
+            if len(self._on_coalesced_update_functions) > 0:
+                self._coalesced += 1
 
-    def _on_open(self, ws):
-        self.logger.info(f"WebSocket '{self._sanitized_url}' connected")
+        # Messages parsed right away above only need a refresh to notify coalesced subscribers.
+        elif len(self._on_coalesced_update_functions) > 0:
+            self._refresh_pending = True
+            self._engine.call_later(self.notify_interval, self._refresh)
 
-    def _on_close(self, ws):
-        self.logger.info(f"WebSocket '{self._sanitized_url}' disconnected")
+        # Nobody gets notified, so the message only needs parsing for `get()`. Parsing it on the next
+        # iteration of the engine loop still skips messages superseded within the same read.
+        elif len(self._on_update_functions) == 0:
+            self._refresh_pending = True
+            self._engine.call_soon(self._refresh)
 
-    def _on_message(self, ws, message):
+    def _parse_newest(self) -> bool:
+        sequence, message = self._frame
+        if sequence == self._parsed_sequence:
+            return False
+
+        self._dropped += sequence - self._parsed_sequence - 1
+        self._parsed_sequence = sequence
+        return self._parse(message)
+
+    def _parse(self, message) -> bool:
         try:
             message_obj = json.loads(message)
 
-            data = dict(message_obj['data'])
+            data = message_obj['data']
+            if not isinstance(data, dict):
+                raise ValueError("'data' is not an object")
+
             timestamp = float(message_obj['timestamp'])
-            with self._lock:
-                self._last = data, timestamp
+        except:
+            self._invalid += 1
+            self.logger.warning("WebSocket '%s' received invalid message: '%s'", self._sanitized_url, message)
+            return False
+
+        self._last = data, timestamp
+        self._version += 1
+        self.logger.debug("WebSocket '%s' received message: '%s'", self._sanitized_url, message)
+        return True
+
+    def _refresh(self):
+        self._refresh_pending = False
+        self._parse_newest()
+
+        if self._version != self._notified_version:
+            self._notified_version = self._version
+            self._notify(self._on_coalesced_update_functions)
+
+    def _notify(self, on_update_functions: tuple):
+        for on_update_function in on_update_functions:
+            try:
+                on_update_function()
+            except Exception as e:
+                self.logger.exception(f"WebSocket '{self._sanitized_url}' update subscriber failed ({e})")
 
-            if self._on_update_function is not None:
-                self._on_update_function()
+    def get(self) -> Tuple[dict, float]:
+        return self._last
 
-            self.logger.debug(f"WebSocket '{self._sanitized_url}' received message: '{message}'")
-        except:
-            self.logger.warning(f"WebSocket '{self._sanitized_url}' received invalid message: '{message}'")
+    def on_update(self, on_update_function, coalesce: bool = False):
+        """Subscribes `on_update_function` to updates of the feed.
 
-    def _on_error(self, ws, error):
-        self.logger.info(f"WebSocket '{self._sanitized_url}' error: '{error}'")
+        Args:
+            on_update_function: Function to call when the feed gets updated.
+            coalesce: If `True`, the function gets called at most once every `notify_interval` seconds,
+                otherwise it gets called for every valid message received.
+        """
+        assert(callable(on_update_function))
+        assert(isinstance(coalesce, bool))
 
-    def get(self) -> Tuple[dict, float]:
+        # Subscribers get replaced rather than modified, so the engine thread can iterate over them without locking.
+        # The lock only keeps concurrent subscriptions from losing one another.
         with self._lock:
-            return self._last
+            if coalesce:
+                self._on_coalesced_update_functions = self._on_coalesced_update_functions + (on_update_function,)
+            else:
+                self._on_update_functions = self._on_update_functions + (on_update_function,)
 
-    def on_update(self, on_update_function):
-        assert(callable(on_update_function))
+    def metrics(self) -> dict:
+        """Returns the number of messages received, found invalid, superseded before being parsed (`dropped`)
+        and received while a coalesced notification was already pending (`coalesced`)."""
+        return {'received': self._received,
+                'invalid': self._invalid,
+                'dropped': self._dropped,
+                'coalesced': self._coalesced}
 
-        self._on_update_function = on_update_function
+
+class CoalescingFeed(Feed):
+    """Subscribes everything subscribing to it to coalesced updates of a `WebSocketFeed`, see `WebSocketFeed.on_update()`."""
+
+    def __init__(self, feed: WebSocketFeed):
+        assert(isinstance(feed, WebSocketFeed))
+
+        self.feed = feed
+
+    def get(self) -> Tuple[dict, float]:
+        return self.feed.get()
+
+    def on_update(self, on_update_function):
+        self.feed.on_update(on_update_function, coalesce=True)
 
 
 class ExpiringFeed(Feed):
@@ -142,3 +251,64 @@ class ExpiringFeed(Feed):
 
     def on_update(self, on_update_function):
         self.feed.on_update(on_update_function)
+
+
+class FeedRegistry:
+    """Registry of feeds shared within the process, so identical feeds only get created once.
+
+    Feeds are keyed by what identifies their source, i.e. the normalized URL of a WebSocket feed.
+    Everything asking for a feed with the same key gets the same instance, sharing its connection,
+    its background thread and its last value, and can subscribe to its updates independently.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._feeds = {}
+
+    def get(self, key: tuple, create_function):
+        """Returns the feed registered under `key`, creating it with `create_function` the first time."""
+        assert(isinstance(key, tuple))
+        assert(callable(create_function))
+
+        with self._lock:
+            if key not in self._feeds:
+                self._feeds[key] = create_function()
+
+            return self._feeds[key]
+
+    def web_socket_feed(self, ws_url: str, reconnect_delay: int) -> WebSocketFeed:
+        """Returns the `WebSocketFeed` for `ws_url`, shared with everything else using an equivalent URL.
+
+        Each subscriber picks whether it gets coalesced updates or all of them, see `WebSocketFeed.on_update()`.
+        """
+        assert(isinstance(ws_url, str))
+        assert(isinstance(reconnect_delay, int))
+
+        return self.get(('ws', self.normalize_url(ws_url)),
+                        lambda: WebSocketFeed(ws_url, reconnect_delay))
+
+    def size(self) -> int:
+        with self._lock:
+            return len(self._feeds)
+
+    @staticmethod
+    def normalize_url(url: str) -> str:
+        """Returns the URL with case-insensitive parts lowercased, and with the default port and trailing slash removed."""
+        parsed_url = urlparse(url)
+        scheme = parsed_url.scheme.lower()
+
+        netloc = parsed_url.hostname or ''
+        if parsed_url.port is not None and parsed_url.port != {'ws': 80, 'wss': 443}.get(scheme):
+            netloc = f"{netloc}:{parsed_url.port}"
+
+        if parsed_url.username is not None:
+            credentials = parsed_url.username if parsed_url.password is None else f"{parsed_url.username}:{parsed_url.password}"
+            netloc = f"{credentials}@{netloc}"
+
+        path = parsed_url.path.rstrip('/')
+        query = f"?{parsed_url.query}" if parsed_url.query else ''
+
+        return f"{scheme}://{netloc}{path}{query}"
+
+
+feed_registry = FeedRegistry()
@@ -0,0 +1,207 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2020 MakerDAO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import logging
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from tornado.httpclient import HTTPRequest
+from tornado.websocket import websocket_connect
+
+from market_maker_keeper.util import sanitize_url
+
+
+class FeedConnection:
+    """WebSocket connection hosted by a `FeedEngine`, kept open (reconnecting if necessary) until closed.
+
+    All callbacks get called from the engine thread, so they have to be quick and must not block.
+
+    Attributes:
+        ws_url: WebSocket URL to connect to.
+        on_message: The function which will be called with every message received.
+        on_open: The (optional) function which will be called with the connection every time it gets
+            (re)connected, i.e. to send subscribe messages with `send()`.
+        on_close: The (optional) function which will be called with the connection every time it gets disconnected.
+        headers: The (optional) list of HTTP headers sent with the connection request, as `'Name: value'` strings,
+            or a function returning such list. The function gets called on every (re)connect, i.e. to sign
+            the request with a fresh nonce.
+        reconnect_delay: Time (in seconds) to wait before reconnecting for the first time, doubling after
+            each consecutive failure up to `max_reconnect_delay`.
+        max_reconnect_delay: Maximum time (in seconds) to wait before reconnecting.
+        ping_interval: Interval (in seconds) between pings sent to keep the connection alive.
+        ping_timeout: Time (in seconds) without a pong after which the connection is considered dead.
+    """
+
+    logger = logging.getLogger()
+
+    def __init__(self, engine, ws_url: str, on_message, on_open=None, on_close=None, headers: list = None,
+                 reconnect_delay: float = 5, max_reconnect_delay: float = 60, ping_interval: float = 15,
+                 ping_timeout: float = 10):
+        assert(isinstance(ws_url, str))
+        assert(callable(on_message))
+        assert(callable(on_open) or on_open is None)
+        assert(callable(on_close) or on_close is None)
+        assert(isinstance(headers, list) or callable(headers) or headers is None)
+        assert(isinstance(reconnect_delay, (int, float)))
+        assert(isinstance(max_reconnect_delay, (int, float)))
+
+        self.engine = engine
+        self.ws_url = ws_url
+        self.on_message = on_message
+        self.on_open = on_open
+        self.on_close = on_close
+        self.headers = headers or []
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max(max_reconnect_delay, reconnect_delay)
+        self.ping_interval = ping_interval
+        self.ping_timeout = ping_timeout
+
+        self.connected = False
+        self.connections = 0
+
+        self._sanitized_url = sanitize_url(ws_url)
+        self._ws = None
+        self._closed = False
+
+    def send(self, message: str):
+        """Sends the message if connected. Can be called from any thread."""
+        assert(isinstance(message, str))
+
+        self.engine.call_soon(self._send, message)
+
+    def close(self):
+        """Closes the connection for good. Can be called from any thread."""
+        self._closed = True
+        self.engine.call_soon(self._close)
+
+    def _send(self, message: str):
+        if self._ws is not None:
+            self._ws.write_message(message)
+
+    def _close(self):
+        if self._ws is not None:
+            self._ws.close()
+
+    async def _run(self):
+        delay = self.reconnect_delay
+
+        while not self._closed:
+            try:
+                headers = self.headers() if callable(self.headers) else self.headers
+                request = HTTPRequest(self.ws_url, headers=dict(header.split(': ', 1) for header in headers))
+                self._ws = await websocket_connect(request, ping_interval=self.ping_interval, ping_timeout=self.ping_timeout)
+            except Exception as e:
+                self.logger.info(f"WebSocket '{self._sanitized_url}' error: '{e}'")
+            else:
+                delay = self.reconnect_delay
+                await self._receive()
+
+            if self._closed:
+                break
+
+            # Jitter spreads reconnections of many feeds to the same server which dropped all of them at once.
+            await asyncio.sleep(delay * random.uniform(1.0, 1.2))
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+    async def _receive(self):
+        self.connected = True
+        self.connections += 1
+        self.logger.info(f"WebSocket '{self._sanitized_url}' connected")
+        self._callback(self.on_open)
+
+        try:
+            while True:
+                message = await self._ws.read_message()
+                if message is None:
+                    break
+
+                try:
+                    self.on_message(message)
+                except Exception as e:
+                    self.logger.exception(f"WebSocket '{self._sanitized_url}' failed to handle message ({e})")
+        finally:
+            self._ws = None
+            self.connected = False
+            self.logger.info(f"WebSocket '{self._sanitized_url}' disconnected")
+            self._callback(self.on_close)
+
+    def _callback(self, function):
+        if function is not None:
+            try:
+                function(self)
+            except Exception as e:
+                self.logger.exception(f"WebSocket '{self._sanitized_url}' callback failed ({e})")
+
+
+class FeedEngine:
+    """Single asyncio event loop thread hosting WebSocket connections of all feeds in the process.
+
+    Instead of every feed running its own connection on its own thread, all connections share one event
+    loop, started on the first `connect()`. Connections reconnect with exponential backoff and get kept
+    alive with pings, see `FeedConnection`. Values received are meant to be published by simply replacing
+    an immutable snapshot, so readers never have to wait for the engine thread.
+
+    Connections are made with Tornado, which needs to be 5.0 or newer to run on an asyncio event loop.
+    Host names get resolved on a small pool of `feed-engine-resolver` threads shared by all connections.
+    """
+
+    logger = logging.getLogger()
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+
+    def connect(self, ws_url: str, on_message, **kwargs) -> FeedConnection:
+        """Opens a new connection hosted by the engine, see `FeedConnection` for all arguments."""
+        connection = FeedConnection(self, ws_url, on_message, **kwargs)
+
+        asyncio.run_coroutine_threadsafe(connection._run(), self._start())
+        return connection
+
+    def call_soon(self, function, *args):
+        """Calls `function` on the engine thread."""
+        self._start().call_soon_threadsafe(function, *args)
+
+    def call_later(self, delay: float, function, *args):
+        """Calls `function` on the engine thread after `delay` seconds."""
+        assert(isinstance(delay, (int, float)))
+
+        loop = self._start()
+        loop.call_soon_threadsafe(loop.call_later, delay, function, *args)
+
+    def thread(self) -> threading.Thread:
+        return self._thread
+
+    def _start(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._loop.set_default_executor(ThreadPoolExecutor(max_workers=2, thread_name_prefix='feed-engine-resolver'))
+                self._thread = threading.Thread(target=self._background_run, name='feed-engine', daemon=True)
+                self._thread.start()
+
+            return self._loop
+
+    def _background_run(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+
+feed_engine = FeedEngine()
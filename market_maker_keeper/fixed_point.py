@@ -0,0 +1,98 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2020 MakerDAO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from decimal import getcontext, ROUND_HALF_EVEN
+
+from pymaker.numeric import Wad
+
+# Raw fixed-point arithmetic on integers scaled by 10^18, i.e. on `Wad.value`.
+#
+# It lets the hot band calculations avoid allocating intermediate `Wad` (and `Decimal`)
+# objects, while still returning exactly the same values `Wad` arithmetic would return.
+# Addition, subtraction and comparisons of `Wad`s are plain integer operations already,
+# multiplication needs to replicate the rounding `Wad.__mul__` gets from `Decimal`.
+
+WAD = 10**18
+
+_POWERS_OF_TEN = [10**exponent for exponent in range(160)]
+
+
+def _digits(value: int) -> int:
+    """Number of decimal digits of a non-negative integer."""
+    digits = (value.bit_length() * 1233 >> 12) + 1
+    if digits < len(_POWERS_OF_TEN) and value >= _POWERS_OF_TEN[digits]:
+        digits += 1
+    if digits > 1 and value < _POWERS_OF_TEN[digits - 1]:
+        digits -= 1
+    return digits
+
+
+def _wad_mul(x: int, y: int) -> int:
+    # `Wad.__mul__` multiplies two `Decimal`s in the current context (rounding the product to
+    # `prec` significant digits, half-even), divides it by 10^18 and truncates towards zero.
+    context = getcontext()
+    if context.rounding != ROUND_HALF_EVEN:
+        return (Wad(x) * Wad(y)).value
+
+    product = x * y
+    magnitude = -product if product < 0 else product
+
+    excess_digits = _digits(magnitude) - context.prec
+    if excess_digits > 0:
+        unit = _POWERS_OF_TEN[excess_digits] if excess_digits < len(_POWERS_OF_TEN) else 10**excess_digits
+        quotient, remainder = divmod(magnitude, unit)
+        half = unit >> 1
+        if remainder > half or (remainder == half and quotient & 1):
+            quotient += 1
+        magnitude = quotient * unit
+
+    result = magnitude // WAD
+    return -result if product < 0 else result
+
+
+def _wad_mul_matches_wad() -> bool:
+    samples = [(100 * WAD, Wad.from_number(0.98).value),
+               (123456789012345678901, 987654321098765432),
+               (-123456789012345678901, 987654321098765432),
+               (200039000000000000000, 1040000000000000000),
+               (99999999999999999999999, 999999999999999999999),
+               (1, 1),
+               (0, 5 * WAD)]
+
+    return all(_wad_mul(x, y) == (Wad(x) * Wad(y)).value for x, y in samples)
+
+
+# Should `Wad.__mul__` ever round differently than we expect, we use it directly instead of returning different values.
+_wad_mul_emulated = _wad_mul_matches_wad()
+
+
+def wad_mul(x: int, y: int) -> int:
+    """Multiplies two raw fixed-point values, returns the same value as `(Wad(x) * Wad(y)).value`."""
+    if _wad_mul_emulated:
+        return _wad_mul(x, y)
+    else:
+        return (Wad(x) * Wad(y)).value
+
+
+def wad_sum(values) -> int:
+    """Sums raw fixed-point values, returns the same value as adding them up as `Wad`s."""
+    return sum(values, 0)
+
+
+def raw(number) -> int:
+    """Returns the raw value of `Wad.from_number(number)`, so constants can be converted once and reused."""
+    return Wad.from_number(number).value
@@ -16,14 +16,23 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import argparse
+import base64
+import hashlib
+import hmac
+import json
 import logging
 from math import log10
 import sys
+import time
 from datetime import datetime
 from typing import List
 
 from market_maker_keeper.band import NewOrder
 from market_maker_keeper.cex_api import CEXKeeperAPI
+from market_maker_keeper.price_feed import add_price_feed_aggregation_arguments
+from market_maker_keeper.order_stream import OrderEvent, WebSocketOrderStream
+from market_maker_keeper.rate_limit import add_rate_limit_arguments
+from market_maker_keeper.refresh_scheduler import add_refresh_scheduler_arguments
 from pymaker.numeric import Wad
 from pyexchange.gemini import GeminiApi, GeminiOrder as Order
 
@@ -59,6 +68,8 @@ class GeminiMarketMakerKeeper(CEXKeeperAPI):
         parser.add_argument("--price-feed-expiry", type=int, default=120,
                             help="Maximum age of the price feed (in seconds, default: 120)")
 
+        add_price_feed_aggregation_arguments(parser)
+
         parser.add_argument("--spread-feed", type=str,
                             help="Source of spread feed")
 
@@ -77,9 +88,23 @@ class GeminiMarketMakerKeeper(CEXKeeperAPI):
         parser.add_argument("--order-history-every", type=int, default=30,
                             help="Frequency of reporting active orders (in seconds, default: 30)")
 
+        parser.add_argument("--trade-limit-journal", type=str,
+                            help="File to persist trade limit usage in, so limits survive keeper restarts")
+
         parser.add_argument("--refresh-frequency", type=int, default=3,
                             help="Order book refresh frequency (in seconds, default: 3)")
 
+        add_refresh_scheduler_arguments(parser)
+
+        add_rate_limit_arguments(parser)
+
+        parser.add_argument("--order-stream", dest='order_stream', action='store_true',
+                            help="Receive order changes from the gemini order events WebSocket instead of polling for them")
+
+        parser.add_argument("--order-stream-reconciliation-frequency", type=int, default=60,
+                            help="Order book refresh frequency while the order events WebSocket is connected"
+                                 " (in seconds, default: 60)")
+
         parser.add_argument("--debug", dest='debug', action='store_true',
                             help="Enable debug output")
 
@@ -92,6 +117,54 @@ class GeminiMarketMakerKeeper(CEXKeeperAPI):
 
         super().__init__(self.arguments, self.gemini_api)
 
+    def configure_order_book_manager(self, arguments, pyex_api):
+        if self.arguments.order_stream:
+            order_stream = WebSocketOrderStream(self.arguments.gemini_api_server.replace('https://', 'wss://', 1) + '/v1/order/events',
+                                                parse_message_function=self.parse_order_events,
+                                                headers_function=self.order_events_headers)
+
+            self.order_book_manager.stream_orders_with(order_stream, self.arguments.order_stream_reconciliation_frequency)
+
+    def order_events_headers(self) -> list:
+        # The request gets signed with a new nonce every time the WebSocket (re)connects.
+        payload = base64.b64encode(json.dumps({'request': '/v1/order/events',
+                                               'nonce': int(time.time() * 1000)}).encode('utf-8'))
+        signature = hmac.new(self.arguments.gemini_secret_key.encode('utf-8'), payload, hashlib.sha384).hexdigest()
+
+        return [f"X-GEMINI-APIKEY: {self.arguments.gemini_api_key}",
+                f"X-GEMINI-PAYLOAD: {payload.decode('utf-8')}",
+                f"X-GEMINI-SIGNATURE: {signature}"]
+
+    def parse_order_events(self, message) -> list:
+        # Subscription acknowledgements and heartbeats are objects, order events always come in arrays.
+        if not isinstance(message, list):
+            return []
+
+        events = []
+        for event in message:
+            if event['symbol'].upper() != self.pair().replace('-', ''):
+                continue
+
+            if event['type'] in ['initial', 'booked']:
+                events.append(OrderEvent.placed(self._order_from_event(event)))
+
+            elif event['type'] == 'fill':
+                remaining_order = self._order_from_event(event) if float(event['remaining_amount']) > 0 else None
+                events.append(OrderEvent.filled(event['order_id'], remaining_order))
+
+            elif event['type'] == 'cancelled' or (event['type'] == 'closed' and event.get('is_cancelled')):
+                events.append(OrderEvent.cancelled(event['order_id']))
+
+        return events
+
+    def _order_from_event(self, event: dict) -> Order:
+        return Order(order_id=event['order_id'],
+                     pair=self.pair(),
+                     is_sell=event['side'] == 'sell',
+                     price=Wad.from_number(float(event['price'])),
+                     timestamp=int(event['timestampms']) // 1000,
+                     amount=Wad.from_number(float(event['remaining_amount'])))
+
     def startup(self):
         minimum_order_size, tick_size, quote_currency_price_increment = self.gemini_api.get_rules(self.pair())
 
@@ -102,6 +175,7 @@ class GeminiMarketMakerKeeper(CEXKeeperAPI):
     def shutdown(self):
         self.logger.info(f'Keeper shutting down...')
         self.order_book_manager.cancel_all_orders(final_wait_time=60)
+        self.history.flush()
 
     def pair(self):
         return self.arguments.pair.upper()
@@ -141,7 +215,7 @@ class GeminiMarketMakerKeeper(CEXKeeperAPI):
                          amount=amount)
 
         for new_order in new_orders:
-            self.order_book_manager.place_order(lambda new_order=new_order: place_order_function(new_order))
+            self.order_book_manager.place_order(lambda new_order=new_order: place_order_function(new_order), new_order)
 
 
 if __name__ == '__main__':
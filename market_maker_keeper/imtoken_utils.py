@@ -31,6 +31,8 @@ class MarketArgs:
 
         self.price_feed = market['price-feed']
         self.price_feed_expiry = market['price-feed-expiry'] if 'price-feed-expiry' in market else 30
+        self.price_feed_aggregation = market['price-feed-aggregation'] if 'price-feed-aggregation' in market else 'backup'
+        self.price_feed_max_deviation = market['price-feed-max-deviation'] if 'price-feed-max-deviation' in market else None
         self.spread_feed = market['spread-feed'] if 'spread-feed' in market else None
         self.spread_feed_expiry = market['spread-feed-expiry'] if 'spread-feed-expiry' in market else 3600
         self.control_feed = market['control-feed'] if 'control-feed' in market else None
@@ -22,10 +22,10 @@ from typing import List
 from math import log10
 from market_maker_keeper.band import Bands, NewOrder
 from market_maker_keeper.control_feed import create_control_feed
-from market_maker_keeper.limit import History
+from market_maker_keeper.limit import create_history
 from market_maker_keeper.order_book import OrderBookManager
 from market_maker_keeper.order_history_reporter import create_order_history_reporter
-from market_maker_keeper.price_feed import PriceFeedFactory
+from market_maker_keeper.price_feed import PriceFeedFactory, add_price_feed_aggregation_arguments
 from market_maker_keeper.reloadable_config import ReloadableConfig
 from market_maker_keeper.spread_feed import create_spread_feed
 from market_maker_keeper.util import setup_logging
@@ -86,6 +86,8 @@ class LeverjMarketMakerKeeper:
         parser.add_argument("--price-feed-expiry", type=int, default=120,
                             help="Maximum age of the price feed (in seconds, default: 120)")
 
+        add_price_feed_aggregation_arguments(parser)
+
         parser.add_argument("--spread-feed", type=str,
                             help="Source of spread feed")
 
@@ -104,6 +106,9 @@ class LeverjMarketMakerKeeper:
         parser.add_argument("--order-history-every", type=int, default=30,
                             help="Frequency of reporting active orders (in seconds, default: 30)")
 
+        parser.add_argument("--trade-limit-journal", type=str,
+                            help="File to persist trade limit usage in, so limits survive keeper restarts")
+
         parser.add_argument("--refresh-frequency", type=int, default=3,
                             help="Order book refresh frequency (in seconds, default: 3)")
 
@@ -130,7 +135,7 @@ class LeverjMarketMakerKeeper:
         self.order_history_reporter = create_order_history_reporter(self.arguments)
         self.target_price_lean = Wad(0)
 
-        self.history = History()
+        self.history = create_history(self.arguments)
 
         self.leverj_api = LeverjFuturesAPI(web3=self.web3,
                                     api_server=self.arguments.leverj_api_server,
@@ -161,6 +166,7 @@ class LeverjMarketMakerKeeper:
 
     def shutdown(self):
         self.order_book_manager.cancel_all_orders()
+        self.history.flush()
 
     def pair(self):
         name_to_id_map = {'BTCDAI': '1', 'ETHDAI': '2'}
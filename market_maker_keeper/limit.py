@@ -16,32 +16,274 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
+import mmap
+import os
+import queue
+import struct
 import threading
-from functools import reduce
+import time
+from bisect import bisect_right
+from typing import Optional
 
 from pymaker.numeric import Wad
 
 
 class History:
-    def __init__(self):
-        self.buy_history = SideHistory()
-        self.sell_history = SideHistory()
+    def __init__(self, journal_file: Optional[str] = None):
+        assert(isinstance(journal_file, str) or journal_file is None)
+
+        self.journal = LimitJournal(journal_file) if journal_file is not None else None
+        self.buy_history = SideHistory(self.journal, LimitJournal.BUY)
+        self.sell_history = SideHistory(self.journal, LimitJournal.SELL)
+
+    def flush(self):
+        """Waits until all limit usage recorded so far has been written to the journal, if there is one."""
+        if self.journal is not None:
+            self.journal.flush()
+
+
+class LimitJournal:
+    """Append-only journal of trade limit usage, which lets `History` survive keeper restarts.
+
+    Every use of a limit is stored as a fixed-size binary record: timestamp (double), side (byte)
+    and the raw amount (32-byte signed integer). Records are written by a background thread, so
+    appending never blocks the caller. As records are appended in time order, replaying the journal
+    memory-maps it and binary searches for the oldest record still needed, skipping everything older.
+
+    Attributes:
+        filename: Filename of the journal file. It gets created if it does not exist.
+    """
+
+    logger = logging.getLogger()
+
+    BUY = 0
+    SELL = 1
+
+    _record = struct.Struct('<dB32s')
+    _timestamp = struct.Struct('<d')
+
+    def __init__(self, filename: str):
+        assert(isinstance(filename, str))
+
+        self.filename = filename
+        self._queue = queue.Queue()
+
+        with open(self.filename, 'ab') as file:
+            size = file.tell()
+
+            # A record could have been partially written if the keeper got killed, we drop it
+            # so subsequent records stay aligned.
+            if size % self._record.size != 0:
+                self.logger.warning(f"Trade limit journal '{self.filename}' ends with an incomplete record, discarding it")
+                size -= size % self._record.size
+                file.truncate(size)
+
+        # Only records written by previous runs get replayed, ours are already in memory.
+        self._replay_size = size
+
+        threading.Thread(target=self._background_write, daemon=True).start()
+
+    def append(self, side: int, timestamp: float, amount: int):
+        """Schedules a record to be appended to the journal."""
+        assert(isinstance(side, int))
+        assert(isinstance(amount, int))
+
+        self._queue.put((float(timestamp), side, amount))
+
+    def flush(self):
+        """Waits until all scheduled records have been written to the journal."""
+        self._queue.join()
+
+    def replay(self, side: int, since: float, until: Optional[float] = None) -> list:
+        """Returns `(timestamp, amount)` of records on `side` with timestamps within `(since, until]`."""
+        assert(isinstance(side, int))
+
+        if self._replay_size == 0:
+            return []
+
+        with open(self.filename, 'rb') as file:
+            with mmap.mmap(file.fileno(), self._replay_size, access=mmap.ACCESS_READ) as data:
+                count = self._replay_size // self._record.size
+
+                start, end = 0, count
+                while start < end:
+                    middle = (start + end) // 2
+                    if self._timestamp.unpack_from(data, middle * self._record.size)[0] <= since:
+                        start = middle + 1
+                    else:
+                        end = middle
+
+                result = []
+                for offset in range(start * self._record.size, self._replay_size, self._record.size):
+                    timestamp, record_side, amount = self._record.unpack_from(data, offset)
+                    if until is not None and timestamp > until:
+                        break
+
+                    if record_side == side:
+                        result.append((timestamp, int.from_bytes(amount, 'little', signed=True)))
+
+                return result
+
+    def _background_write(self):
+        with open(self.filename, 'ab') as file:
+            while True:
+                records = [self._queue.get()]
+                while not self._queue.empty():
+                    records.append(self._queue.get_nowait())
+
+                try:
+                    file.write(b''.join(self._record.pack(timestamp, side, amount.to_bytes(32, 'little', signed=True))
+                                        for timestamp, side, amount in records))
+                    file.flush()
+                except Exception as e:
+                    self.logger.exception(f"Failed to write to trade limit journal '{self.filename}' ({e})")
+                finally:
+                    for _ in records:
+                        self._queue.task_done()
 
 
 class SideHistory:
-    def __init__(self):
-        self.items = []
+    """Timestamped amounts of orders placed on one side, able to sum them up over sliding time windows.
+
+    Items are kept sorted by timestamp along with running totals, so the amount used in any window
+    is a difference of two running totals. For each window length a cursor remembers where the window
+    was the last time, so as time moves forward it only advances over newly included or excluded items.
+    Items older than the longest window any `SideLimits` asked to retain get evicted. Until some
+    `SideLimits` asks for it, i.e. if there are no limits configured, items get evicted once they
+    are older than `DEFAULT_RETENTION`.
+    """
+
+    # One week, the longest unit a limit period can be expressed in.
+    DEFAULT_RETENTION = 604800
+
+    def __init__(self, journal: Optional[LimitJournal] = None, side: Optional[int] = None):
+        assert(isinstance(journal, LimitJournal) or journal is None)
+        assert(isinstance(side, int) or side is None)
+
+        self._journal = journal
+        self._side = side
+        self._replayed_since = None
+        self._timestamps = []
+        self._totals = [0]
+        self._cursors = {}
+        self._retention = None
+        self._latest_timestamp = None
         self._lock = threading.Lock()
 
     def add_item(self, item: dict):
         assert(isinstance(item, dict))
+        assert(isinstance(item['amount'], Wad))
 
         with self._lock:
-            self.items.append(item)
+            timestamp = item['timestamp']
+            amount = item['amount'].value
+
+            if len(self._timestamps) == 0 or timestamp >= self._timestamps[-1]:
+                self._timestamps.append(timestamp)
+                self._totals.append(self._totals[-1] + amount)
+
+            else:
+                # Items placed concurrently may arrive slightly out of order, so we insert them
+                # at their position, rebuild the running totals after it and reset the cursors.
+                index = bisect_right(self._timestamps, timestamp)
+                amounts = [self._totals[i + 1] - self._totals[i] for i in range(index, len(self._timestamps))]
+
+                self._timestamps.insert(index, timestamp)
+                del self._totals[index + 1:]
+                for next_amount in [amount] + amounts:
+                    self._totals.append(self._totals[-1] + next_amount)
+
+                self._cursors = {}
+
+            self._evict(timestamp)
+
+            if self._journal is not None:
+                self._journal.append(self._side, timestamp, amount)
 
     def get_items(self) -> list:
         with self._lock:
-            return list(self.items)
+            return [{'timestamp': timestamp, 'amount': Wad(self._totals[index + 1] - self._totals[index])}
+                    for index, timestamp in enumerate(self._timestamps)]
+
+    def retain(self, seconds: int):
+        """Make sure items are kept for at least `seconds`, i.e. as long as the longest limit period needs them."""
+        assert(isinstance(seconds, int))
+
+        with self._lock:
+            if self._retention is None or seconds > self._retention:
+                self._retention = seconds
+
+                if self._journal is not None:
+                    self._replay(time.time() - seconds)
+
+    def _replay(self, since: float):
+        # Load items from the journal which we have not loaded yet, i.e. the ones within `since`
+        # and the oldest one loaded so far, and merge them with the items we already have.
+        items = self._journal.replay(self._side, since, self._replayed_since)
+        self._replayed_since = since if self._replayed_since is None else min(since, self._replayed_since)
+
+        if len(items) > 0:
+            items = sorted(items + [(timestamp, self._totals[index + 1] - self._totals[index])
+                                    for index, timestamp in enumerate(self._timestamps)], key=lambda item: item[0])
+
+            self._timestamps = [timestamp for timestamp, _ in items]
+            self._totals = [0]
+            for _, amount in items:
+                self._totals.append(self._totals[-1] + amount)
+
+            self._cursors = {}
+
+    def used_amount(self, timestamp: int, seconds: int) -> Wad:
+        """Return the total amount of items with timestamps within `(timestamp - seconds, timestamp]`."""
+        assert(isinstance(seconds, int))
+
+        with self._lock:
+            self._evict(timestamp)
+
+            timestamps = self._timestamps
+            cursor = self._cursors.get(seconds)
+
+            if cursor is not None and timestamp >= cursor[2]:
+                start, end = cursor[0], cursor[1]
+                while start < len(timestamps) and timestamps[start] <= timestamp - seconds:
+                    start += 1
+                while end < len(timestamps) and timestamps[end] <= timestamp:
+                    end += 1
+
+            else:
+                start = bisect_right(timestamps, timestamp - seconds)
+                end = bisect_right(timestamps, timestamp)
+
+            self._cursors[seconds] = [start, end, timestamp]
+
+            return Wad(self._totals[end] - self._totals[start])
+
+    def _evict(self, timestamp: int):
+        if self._latest_timestamp is None or timestamp > self._latest_timestamp:
+            self._latest_timestamp = timestamp
+
+        retention = self._retention if self._retention is not None else self.DEFAULT_RETENTION
+
+        # Evicting in batches keeps the cost of shifting the lists amortized constant per item.
+        count = bisect_right(self._timestamps, self._latest_timestamp - retention)
+        if count > 0 and count * 2 >= len(self._timestamps):
+            del self._timestamps[:count]
+            del self._totals[:count]
+
+            for cursor in self._cursors.values():
+                cursor[0] = max(cursor[0] - count, 0)
+                cursor[1] = max(cursor[1] - count, 0)
+
+
+def create_history(arguments) -> History:
+    # Arguments built by hand, e.g. in tests, may not define `--trade-limit-journal`.
+    trade_limit_journal = getattr(arguments, 'trade_limit_journal', None)
+
+    if trade_limit_journal:
+        return History(trade_limit_journal)
+
+    else:
+        return History()
 
 
 class SideLimits:
@@ -54,6 +296,9 @@ class SideLimits:
         self.side_limits = list(map(SideLimit, limits))
         self.side_history = side_history
 
+        if len(self.side_limits) > 0:
+            self.side_history.retain(max(limit.seconds for limit in self.side_limits))
+
     def available_limit(self, timestamp: int):
         if len(self.side_limits) > 0:
             return Wad.min(*map(lambda limit: limit.available_limit(timestamp, self.side_history), self.side_limits))
@@ -78,7 +323,6 @@ class SideLimit:
     def available_limit(self, timestamp: int, side_history: SideHistory):
         assert(isinstance(side_history, SideHistory))
 
-        items = filter(lambda item: timestamp - self.seconds < item['timestamp'] <= timestamp, side_history.get_items())
-        used_amount = reduce(Wad.__add__, map(lambda item: item['amount'], items), Wad(0))
+        used_amount = side_history.used_amount(timestamp, self.seconds)
 
         return Wad.max(self.amount - used_amount, Wad(0))
@@ -15,14 +15,23 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import heapq
+import itertools
 import logging
+import queue
 import threading
 
 import time
-from concurrent.futures import ThreadPoolExecutor
 from functools import partial
+from typing import Optional
 
+from market_maker_keeper.band import pair_amendments
 from market_maker_keeper.order_history_reporter import OrderHistoryReporter
+from market_maker_keeper.order_stream import OrderEvent
+from market_maker_keeper.rate_limit import RateLimitGovernor
+from market_maker_keeper.refresh_scheduler import AdaptiveRefreshScheduler
+from market_maker_keeper.tick_timer import timed_phase
+from pymaker.numeric import Wad
 
 
 class OrderBook:
@@ -35,11 +44,9 @@ class OrderBook:
 
         balances: Current balances state. This field only has value when balance retrieval function
             has been configured by invoking  OrderBookManager.get_balances_with()`. Otherwise it's always
-            None. Currently, the balances state is not updated with order placement and cancellation
-            (unlike `orders`) so it may (and will) happen that `orders` and `balances` will get out of sync.
-            There are no serious consequences of it, keeper may be trying to place orders with money
-            it doesn't have yet, which will of course fail, but the state will be rectified the
-            next time a successful orders/balances sync takes place.
+            None. The balances state itself is not updated with order placement and cancellation
+            (unlike `orders`), so it may (and will) happen that `orders` and `balances` will get out of sync
+            until the next successful balances sync takes place. See `balance_adjustments`.
 
         orders_being_placed: `True` if at least one order is currently being placed. `False` otherwise.
             Orders which are currently being placed are not included in `orders`. They will only get
@@ -49,19 +56,164 @@ class OrderBook:
             Orders which are currently being cancelled are immediately removed from `orders`. Having said that,
             they will 'reappear' there again if the cancellation fails. It's the keepers responsibility
             to notice them and try to cancel them again.
+
+        orders_timestamp: Time (as returned by `time.time()`) the orders have been last fetched
+            or updated with changes pushed by the exchange.
+
+        balances_timestamp: Time (as returned by `time.time()`) the balances have been last fetched
+            or pushed by the exchange. `None` if balance retrieval function has not been configured.
+
+        balance_adjustments: Changes of balances (token to `Wad`), caused by orders being placed or
+            cancelled since the balances have been last fetched, which are not reflected in `balances` yet.
+            Amounts paid with new orders are negative, remaining amounts of cancelled orders are positive.
+            Only tracked if configured by invoking `OrderBookManager.track_balances_with()`,
+            otherwise it's always empty.
+
+    Snapshots returned by `OrderBookManager.get_order_book()` are shared by all callers until the
+    order book state changes, so neither the snapshot nor its `orders` list should be modified.
     """
     def __init__(self,
                  orders,
                  balances,
                  orders_being_placed: bool,
-                 orders_being_cancelled: bool):
+                 orders_being_cancelled: bool,
+                 orders_timestamp: float = None,
+                 balances_timestamp: float = None,
+                 balance_adjustments: dict = None):
         assert(isinstance(orders_being_placed, bool))
         assert(isinstance(orders_being_cancelled, bool))
+        assert(isinstance(balance_adjustments, dict) or balance_adjustments is None)
 
         self.orders = orders
         self.balances = balances
         self.orders_being_placed = orders_being_placed
         self.orders_being_cancelled = orders_being_cancelled
+        self.orders_timestamp = orders_timestamp
+        self.balances_timestamp = balances_timestamp
+        self.balance_adjustments = balance_adjustments if balance_adjustments is not None else {}
+
+    def balance_adjustment(self, token: str) -> Wad:
+        """Returns the change of the `token` balance not reflected in `balances` yet, see `balance_adjustments`."""
+        return self.balance_adjustments.get(token, Wad(0))
+
+
+class PriorityExecutor:
+    """Thread pool which runs submitted functions in the order of their priorities.
+
+    Functions with a lower `priority` value always start before the ones with a higher value,
+    functions with equal priorities start in the order they have been submitted. It keeps track
+    of how many functions are queued for each priority, so the number of workers can be sized.
+
+    Functions making an exchange API request can be submitted along with the kind of that request.
+    If the executor is governed by a `RateLimitGovernor` (see `govern_requests_with()`), the budget
+    for the request gets taken before the function is handed over to a worker, so functions waiting
+    for the budget never occupy workers. While waiting, a function of a higher priority submitted
+    in the meantime takes over, so e.g. cancellations do not queue up behind throttled placements.
+
+    Attributes:
+        max_workers: Number of worker threads.
+    """
+
+    logger = logging.getLogger()
+
+    def __init__(self, max_workers: int):
+        assert(isinstance(max_workers, int))
+        assert(max_workers > 0)
+
+        self.max_workers = max_workers
+        self.rate_limit_governor = None
+
+        self._pending = []
+        self._head = None
+        self._ready = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        self._queued = {}
+        self._max_queued = 0
+        self._running = 0
+
+        threading.Thread(target=self._dispatcher, daemon=True).start()
+        for _ in range(max_workers):
+            threading.Thread(target=self._worker, daemon=True).start()
+
+    def govern_requests_with(self, rate_limit_governor: RateLimitGovernor):
+        """Configures the governor which has to give the budget for requests before functions making them start."""
+        assert(isinstance(rate_limit_governor, RateLimitGovernor))
+
+        self.rate_limit_governor = rate_limit_governor
+
+    def submit(self, function, priority: int, request_kind: Optional[str] = None):
+        """Schedules `function` to be run by one of the workers.
+
+        Args:
+            function: The function to run.
+            priority: Priority of the function, the lower the value the sooner it starts.
+            request_kind: Kind of the exchange API request `function` makes (see `RateLimitGovernor`),
+                or `None` if it does not need any budget.
+        """
+        assert(callable(function))
+        assert(isinstance(priority, int))
+        assert(request_kind in RateLimitGovernor.KINDS or request_kind is None)
+
+        with self._lock:
+            self._queued[priority] = self._queued.get(priority, 0) + 1
+            self._max_queued = max(self._max_queued, sum(self._queued.values()))
+
+            heapq.heappush(self._pending, (priority, next(self._sequence), function, request_kind))
+            head_changed = self._pending[0][1] != self._head
+            self._head = self._pending[0][1]
+            self._condition.notify()
+
+        # The dispatcher may be waiting for the budget for a function of a lower priority,
+        # the governor makes it give up the wait so it can pick the new function instead.
+        if head_changed and self.rate_limit_governor is not None:
+            self.rate_limit_governor.notify()
+
+    def metrics(self) -> dict:
+        """Returns the number of functions queued for each priority, running and the maximum ever queued."""
+        with self._lock:
+            return {'queued': dict(self._queued),
+                    'running': self._running,
+                    'max_queued': self._max_queued,
+                    'workers': self.max_workers}
+
+    def _dispatcher(self):
+        while True:
+            with self._lock:
+                while len(self._pending) == 0:
+                    self._condition.wait()
+
+                item = self._pending[0]
+
+            priority, sequence, function, request_kind = item
+
+            if request_kind is not None and self.rate_limit_governor is not None:
+                if not self.rate_limit_governor.acquire(request_kind, abandon=lambda: self._head != sequence):
+                    continue
+
+            with self._lock:
+                self._pending.remove(item)
+                heapq.heapify(self._pending)
+                self._head = self._pending[0][1] if len(self._pending) > 0 else None
+
+            self._ready.put((priority, sequence, function))
+
+    def _worker(self):
+        while True:
+            priority, _, function = self._ready.get()
+
+            with self._lock:
+                self._queued[priority] -= 1
+                self._running += 1
+
+            try:
+                function()
+            except BaseException as exception:
+                self.logger.exception(exception)
+            finally:
+                with self._lock:
+                    self._running -= 1
 
 
 class OrderBookManager:
@@ -81,16 +233,51 @@ class OrderBookManager:
     This way, as long as the `place_order()` call is able to return the id of the newly placed order,
     the keeper can cancel these orders even if no `get_orders()` call has been successful since then.
 
-    Order book manager can also optionally query the balances and include them in the snapshot,
-    along querying the order book.
+    Order book manager can also optionally query the balances and include them in the snapshot.
+    Balances are queried independently of the order book, so one slow call does not delay the other,
+    and can be queried less frequently. As they are likely to change after an order gets placed or filled,
+    they also get queried as soon as that happens.
+
+    Instead of relying on polling only, order book manager can also be fed with changes of orders and balances
+    pushed by the exchange, see `stream_orders_with()`. In that case the order book still gets refreshed
+    periodically to reconcile the state, but much less frequently, unless the stream gets disconnected.
+
+    Instead of refreshing the order book every `refresh_frequency` seconds, order book manager can also
+    refresh it adaptively, often while there is some activity and less and less often while there is none,
+    see `schedule_refresh_with()`.
+
+    For exchanges which can amend (modify) open orders, an order can be replaced with a new one
+    in a single request, see `amend_orders_with()`. The amended order keeps its place in the snapshot.
+    Order book manager remembers the band each order it placed has been created for (see `order_band()`),
+    so orders only get amended to become new orders for the same band.
+
+    Cancellations always take priority over amendments and placements, i.e. queued amendments
+    and placements only start once no cancellations are queued. Queued placements which became stale in the meantime, as decided by
+    the function configured with `drop_stale_placements_with()`, are dropped without being placed.
+
+    All requests made by the order book manager can be kept within the exchange rate limit, with
+    cancellations taking priority over placements and placements over refreshes, see `govern_requests_with()`.
+
+    Placements which failed with an uncertain outcome, i.e. timed out but may have succeeded on the exchange,
+    can be resolved by looking up their client order ids in the order book instead of being considered failed
+    straight away, see `resolve_placements_with()`. New orders with the same client order id are never
+    queued for placement twice.
+
+    Order book manager can also keep track of balances locked by orders being placed and released by
+    orders cancelled since the last balances refresh, see `track_balances_with()`. This way keepers
+    running low on balance do not keep creating orders the exchange will reject anyway.
 
     Attributes:
-        refresh_frequency: Frequency (in seconds) of how often background order book (and balances)
-            refresh takes place.
+        refresh_frequency: Frequency (in seconds) of how often background order book (and, unless configured
+            otherwise, balances) refresh takes place.
     """
 
     logger = logging.getLogger()
 
+    CANCEL_PRIORITY = 0
+    AMEND_PRIORITY = 1
+    PLACE_PRIORITY = 2
+
     def __init__(self, refresh_frequency: int, max_workers: int = 5):
         assert(isinstance(refresh_frequency, int))
         assert(isinstance(max_workers, int))
@@ -98,21 +285,50 @@ class OrderBookManager:
         self.refresh_frequency = refresh_frequency
         self.get_orders_function = None
         self.get_balances_function = None
+        self.balances_refresh_frequency = None
         self.place_order_function = None
         self.cancel_order_function = None
+        self.place_orders_batch_function = None
+        self.place_orders_batch_size = None
+        self.cancel_orders_batch_function = None
+        self.cancel_orders_batch_size = None
+        self.amend_order_function = None
+        self.is_placement_stale_function = None
+        self.client_order_id_function = None
+        self.placement_resolution_refreshes = None
+        self.buy_token = None
+        self.sell_token = None
+        self.order_stream = None
+        self.reconciliation_frequency = None
+        self.refresh_scheduler = None
+        self.rate_limit_governor = None
         self.order_history_reporter = None
         self.buy_filter_function = None
         self.sell_filter_function = None
         self.on_update_function = None
 
-        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._executor = PriorityExecutor(max_workers=max_workers)
         self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
         self._state = None
+        self._components = dict()
+        self._snapshot = None
         self._refresh_count = 0
         self._currently_placing_orders = 0
         self._orders_placed = list()
         self._order_ids_cancelling = set()
         self._order_ids_cancelled = set()
+        self._orders_updated = dict()
+        self._order_bands = dict()
+        self._placements_dropped = 0
+        self._placements_in_flight = dict()
+        self._placements_uncertain = dict()
+        self._refresh_requested = threading.Event()
+        self._balances_refresh_requested = threading.Event()
+        self._balances_pushed = 0
+        self._balance_adjustments = dict()
+        self._balance_keys = itertools.count()
+        self._balance_settlements = 0
 
     def get_orders_with(self, get_orders_function):
         """Configures the function used to fetch active keeper orders.
@@ -125,17 +341,21 @@ class OrderBookManager:
 
         self.get_orders_function = get_orders_function
 
-    def get_balances_with(self, get_balances_function):
+    def get_balances_with(self, get_balances_function, refresh_frequency: int = None):
         """Configures the (optional) function used to fetch current keeper balances.
 
         Args:
             get_balances_function: The function which will be periodically called by the order book manager
                 in order to get current keeper balances. This is optional, is not configured balances
                 will not be fetched.
+            refresh_frequency: Frequency (in seconds) of how often balances get fetched. If not specified,
+                they get fetched as often as the order book.
         """
         assert(callable(get_balances_function))
+        assert(isinstance(refresh_frequency, int) or refresh_frequency is None)
 
         self.get_balances_function = get_balances_function
+        self.balances_refresh_frequency = refresh_frequency
 
     def place_orders_with(self, place_order_function):
         """Configures the function used to place orders.
@@ -157,6 +377,157 @@ class OrderBookManager:
 
         self.cancel_order_function = cancel_order_function
 
+    def place_orders_batch_with(self, place_orders_batch_function, batch_size: int):
+        """Configures the (optional) function used to place orders in batches, for exchanges with bulk endpoints.
+
+        If configured, it is used instead of the function configured with `place_orders_with()`.
+
+        Args:
+            place_orders_batch_function: The function which will be called with a list of up to `batch_size`
+                new orders. It has to return a list with one element per new order, either the order placed
+                or `None` if its placement failed. If it raises an exception, all orders in the batch
+                are considered failed.
+            batch_size: Maximum number of orders placed in one call.
+        """
+        assert(callable(place_orders_batch_function))
+        assert(isinstance(batch_size, int))
+        assert(batch_size > 0)
+
+        self.place_orders_batch_function = place_orders_batch_function
+        self.place_orders_batch_size = batch_size
+
+    def cancel_orders_batch_with(self, cancel_orders_batch_function, batch_size: int):
+        """Configures the (optional) function used to cancel orders in batches, for exchanges with bulk endpoints.
+
+        If configured, it is used instead of the function configured with `cancel_orders_with()`.
+
+        Args:
+            cancel_orders_batch_function: The function which will be called with a list of up to `batch_size`
+                orders. It has to return a list with one element per order, `True` if the order has been
+                cancelled, `False` otherwise. If it raises an exception, cancellation of all orders
+                in the batch is considered failed.
+            batch_size: Maximum number of orders cancelled in one call.
+        """
+        assert(callable(cancel_orders_batch_function))
+        assert(isinstance(batch_size, int))
+        assert(batch_size > 0)
+
+        self.cancel_orders_batch_function = cancel_orders_batch_function
+        self.cancel_orders_batch_size = batch_size
+
+    def amend_orders_with(self, amend_order_function):
+        """Configures the (optional) function used to amend orders, for exchanges with amend (modify) endpoints.
+
+        If configured, `replace_orders()` amends orders instead of cancelling them and placing new ones
+        wherever an order and a new order for the band the order has been placed for can be paired up,
+        see `pair_amendments()`.
+
+        Args:
+            amend_order_function: The function which will be called with the order to amend and the new
+                order it should become. It has to return the amended order, or `None` if the amendment
+                failed, in which case the original order is considered to be still open. If the amended
+                order has a different id, the original one is considered cancelled.
+        """
+        assert(callable(amend_order_function))
+
+        self.amend_order_function = amend_order_function
+
+    def drop_stale_placements_with(self, is_placement_stale_function):
+        """Configures the (optional) function used to drop queued placements which became stale.
+
+        Args:
+            is_placement_stale_function: The function which will be called with each new order
+                right before it gets placed. If it returns `True`, the order will not be placed.
+                For orders created by bands, `NewOrder.is_stale()` can be used to drop orders which
+                would not fall into their band anymore at the current target price.
+        """
+        assert(callable(is_placement_stale_function))
+
+        self.is_placement_stale_function = is_placement_stale_function
+
+    def resolve_placements_with(self, client_order_id_function, max_refreshes: int = 1):
+        """Configures the (optional) resolution of placements which failed with an uncertain outcome.
+
+        By default a placement which raised an exception is considered failed. If configured, such placements
+        of new orders with a `client_order_id` (see `NewOrder`) are considered uncertain instead, and count as
+        orders being placed until resolved. As soon as an order with the same client order id shows up in the
+        order book, the placement is considered successful. If it does not show up within `max_refreshes`
+        order book refreshes, the placement is considered failed. This way keepers do not place orders again
+        while the original placement may have succeeded, which would leave them with duplicate orders.
+
+        Args:
+            client_order_id_function: The function which will be called with each order fetched from the exchange.
+                It has to return the client order id the order has been placed with, or `None` if unknown.
+            max_refreshes: Number of order book refreshes an uncertain placement is considered failed after.
+        """
+        assert(callable(client_order_id_function))
+        assert(isinstance(max_refreshes, int))
+        assert(max_refreshes > 0)
+
+        self.client_order_id_function = client_order_id_function
+        self.placement_resolution_refreshes = max_refreshes
+
+    def track_balances_with(self, buy_token: str, sell_token: str):
+        """Configures the (optional) tracking of balances changed by orders placed and cancelled.
+
+        If configured, amounts new orders pay with are reserved as soon as the orders get queued
+        for placement (and released again if the placement fails), and remaining amounts of orders
+        cancelled are released as soon as the cancellation succeeds. These adjustments are kept
+        until balances fetched (or pushed) after the placement or cancellation reflect them.
+        See `OrderBook.balance_adjustments`.
+
+        Args:
+            buy_token: Token buy orders pay with.
+            sell_token: Token sell orders pay with.
+        """
+        assert(isinstance(buy_token, str))
+        assert(isinstance(sell_token, str))
+
+        self.buy_token = buy_token
+        self.sell_token = sell_token
+
+    def stream_orders_with(self, order_stream, reconciliation_frequency: int):
+        """Configures the (optional) stream of order and balance changes pushed by the exchange.
+
+        Args:
+            order_stream: An `OrderStream` the changes will be received from. It gets started
+                together with the order book manager.
+            reconciliation_frequency: Frequency (in seconds) of the background order book (and balances)
+                refresh while the stream is connected. While it is not, `refresh_frequency` is used.
+        """
+        assert(isinstance(reconciliation_frequency, int))
+
+        self.order_stream = order_stream
+        self.reconciliation_frequency = reconciliation_frequency
+
+    def schedule_refresh_with(self, refresh_scheduler: AdaptiveRefreshScheduler):
+        """Configures the (optional) scheduler deciding when the order book gets refreshed.
+
+        If configured, the order book gets refreshed when the scheduler decides to instead of every
+        `refresh_frequency` seconds, and both order book and balances refreshes stay within its
+        request budget. Orders being placed or cancelled are reported to the scheduler as activity.
+        If requests are governed as well (see `govern_requests_with()`), the scheduler shares the
+        request budget of the governor.
+
+        Args:
+            refresh_scheduler: An `AdaptiveRefreshScheduler` instance, or `None` to keep refreshing
+                every `refresh_frequency` seconds.
+        """
+        assert(isinstance(refresh_scheduler, AdaptiveRefreshScheduler) or refresh_scheduler is None)
+
+        self.refresh_scheduler = refresh_scheduler
+
+    def govern_requests_with(self, rate_limit_governor: RateLimitGovernor):
+        """Configures the (optional) governor all requests made by the order book manager have to go through.
+
+        Args:
+            rate_limit_governor: A `RateLimitGovernor` instance, usually shared with the rest of the keeper.
+        """
+        assert(isinstance(rate_limit_governor, RateLimitGovernor))
+
+        self.rate_limit_governor = rate_limit_governor
+        self._executor.govern_requests_with(rate_limit_governor)
+
     def enable_history_reporting(self, order_history_reporter: OrderHistoryReporter, buy_filter_function, sell_filter_function):
         assert(isinstance(order_history_reporter, OrderHistoryReporter) or (order_history_reporter is None))
         assert(callable(buy_filter_function))
@@ -174,8 +545,77 @@ class OrderBookManager:
 
     def start(self):
         """Start the background refresh of active keeper orders."""
+        if self.refresh_scheduler is not None and self.rate_limit_governor is not None:
+            self.refresh_scheduler.govern_requests_with(self.rate_limit_governor)
+
         threading.Thread(target=self._thread_refresh_order_book, daemon=True).start()
 
+        if self.get_balances_function is not None:
+            threading.Thread(target=self._thread_refresh_balances, daemon=True).start()
+
+        if self.order_stream is not None:
+            self.order_stream.start(self.apply_order_events, self._on_order_stream_connection)
+
+    def refresh(self):
+        """Requests the background order book refresh to take place now, instead of waiting for its next turn."""
+        self._refresh_requested.set()
+
+    def refresh_balances(self):
+        """Requests the background balances refresh to take place now, instead of waiting for its next turn."""
+        self._balances_refresh_requested.set()
+
+    def apply_order_events(self, events: list):
+        """Applies changes of orders and balances, usually pushed by the exchange, to the order book.
+
+        Applied changes survive order book refreshes which started before they happened,
+        as these could still return the state from before the changes.
+
+        Args:
+            events: List of `OrderEvent`s.
+        """
+        assert(isinstance(events, list))
+
+        timestamp = time.time()
+
+        with self._lock:
+            for event in events:
+                if event.kind == OrderEvent.PLACED:
+                    self._orders_placed.append(event.order)
+
+                elif event.kind == OrderEvent.FILLED and event.order is not None:
+                    self._orders_updated[event.order_id] = event.order
+
+                elif event.kind in [OrderEvent.FILLED, OrderEvent.CANCELLED]:
+                    self._order_ids_cancelled.add(event.order_id)
+
+                if event.kind == OrderEvent.BALANCES:
+                    self._update_state(balances=event.balances, balances_timestamp=timestamp)
+                    self._balances_pushed += 1
+                    self._reconcile_balance_adjustments(self._balance_settlements)
+
+                elif 'orders' in self._components:
+                    self._update_state(orders_timestamp=timestamp)
+
+            self._order_book_changed()
+
+        self._report_order_book_updated()
+
+        # Balances pushed by the exchange are expected to follow fills, so we only query them if they are not pushed.
+        if any(event.kind == OrderEvent.FILLED for event in events) and \
+                not any(event.kind == OrderEvent.BALANCES for event in events):
+            self.refresh_balances()
+
+    def _on_order_stream_connection(self, connected: bool):
+        # Whenever the stream (re)connects or disconnects, we might have missed some changes.
+        self.logger.info(f"Order stream {'connected' if connected else 'disconnected'}, refreshing the order book")
+        self.refresh()
+
+    def order_band(self, order):
+        """Returns the band the order has been created for, or `None` if it has not been placed by the order book
+        manager from a new order created by bands. Can be passed to `Bands.reconcile()` to amend orders."""
+        return self._order_bands.get(order.order_id)
+
+    @timed_phase('order_book')
     def get_order_book(self) -> OrderBook:
         """Returns the current snapshot of the active keeper orders and balances.
 
@@ -184,56 +624,113 @@ class OrderBookManager:
         Returns:
             An `OrderBook` class instance.
         """
-        while self._state is None:
-            self.logger.info("Waiting for the order book to become available...")
-            time.sleep(0.5)
+        if self._state is None:
+            with self._lock:
+                while self._state is None:
+                    self.logger.info("Waiting for the order book to become available...")
+                    self._condition.wait(0.5)
+
+        # Snapshots are immutable and get replaced as a whole, so as long as nothing has changed
+        # since the last one was built we can return it without taking the lock.
+        snapshot = self._snapshot
+        if snapshot is not None:
+            return snapshot
 
         with self._lock:
-            self.logger.debug(f"Getting the order book")
-            self.logger.debug(f"Orders retrieved last time: {[order.order_id for order in self._state['orders']]}")
+            if self._snapshot is None:
+                self._snapshot = self._build_order_book()
+
+            return self._snapshot
+
+    def _build_order_book(self) -> OrderBook:
+        # Has to be called with `_lock` held.
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(f"Building the order book")
+            self.logger.debug(f"Orders retrieved last time: {list(self._state['index'])}")
             self.logger.debug(f"Orders placed since then: {[order.order_id for order in self._orders_placed]}")
-            self.logger.debug(f"Orders cancelled since then: {[order_id for order_id in self._order_ids_cancelled]}")
-            self.logger.debug(f"Orders being cancelled: {[order_id for order_id in self._order_ids_cancelling]}")
+            self.logger.debug(f"Orders cancelled since then: {list(self._order_ids_cancelled)}")
+            self.logger.debug(f"Orders being cancelled: {list(self._order_ids_cancelling)}")
             self.logger.debug(f"Orders being placed: {self._currently_placing_orders} order(s)")
 
-            # TODO: below we remove orders which are being or have been cancelled, and orders
-            # which have been placed, but we to not update the balances accordingly. it will
-            # work correctly as long as the market maker keeper has enough balance available.
-            # when it will get low on balance, order placement may fail or too tiny replacement
-            # orders may get created for a while.
+        # Below we remove orders which are being or have been cancelled, and add orders which have been
+        # placed. We do not update the balances accordingly, but if balance tracking has been configured
+        # the balance adjustments caused by these orders are included in the snapshot.
 
-            # Add orders which have been placed.
-            orders = list(self._state['orders'])
-            for order in self._orders_placed:
-                if order.order_id not in list(map(lambda order: order.order_id, orders)):
-                    orders.append(order)
+        # Add orders which have been placed.
+        orders = list(self._state['orders'])
+        order_ids = set(self._state['index'])
+        for order in self._orders_placed:
+            if order.order_id not in order_ids:
+                order_ids.add(order.order_id)
+                orders.append(order)
 
-            # Remove orders being cancelled and already cancelled.
-            orders = list(filter(lambda order: order.order_id not in self._order_ids_cancelling and
-                                               order.order_id not in self._order_ids_cancelled, orders))
+        # Replace orders which have been partially filled.
+        if len(self._orders_updated) > 0:
+            orders = [self._orders_updated.get(order.order_id, order) for order in orders]
 
+        # Remove orders being cancelled and already cancelled.
+        if len(self._order_ids_cancelling) > 0 or len(self._order_ids_cancelled) > 0:
+            orders = [order for order in orders if order.order_id not in self._order_ids_cancelling and
+                                                   order.order_id not in self._order_ids_cancelled]
+
+        balance_adjustments = dict()
+        for token, amount, _ in self._balance_adjustments.values():
+            balance_adjustments[token] = balance_adjustments.get(token, Wad(0)) + amount
+
+        if self.logger.isEnabledFor(logging.DEBUG):
             self.logger.debug(f"Returned orders: {[order.order_id for order in orders]}")
+            self.logger.debug(f"Balance adjustments: {balance_adjustments}")
 
         return OrderBook(orders=orders,
-                         balances=self._state['balances'],
+                         balances=self._state.get('balances'),
                          orders_being_placed=self._currently_placing_orders > 0,
-                         orders_being_cancelled=len(self._order_ids_cancelling) > 0)
-
-    def place_order(self, place_order_function):
+                         orders_being_cancelled=len(self._order_ids_cancelling) > 0,
+                         orders_timestamp=self._state.get('orders_timestamp'),
+                         balances_timestamp=self._state.get('balances_timestamp'),
+                         balance_adjustments=balance_adjustments)
+
+    def _update_state(self, **components):
+        # Has to be called with `_lock` held. Orders and balances get fetched independently, the state
+        # the order book is built from only becomes available once all of them have been fetched.
+        self._components.update(components)
+
+        if 'orders' in self._components and ('balances' in self._components or self.get_balances_function is None):
+            if self._state is None:
+                self.logger.info("Order book became available")
+
+            self._state = dict(self._components)
+            self._order_book_changed()
+
+    def _order_book_changed(self):
+        # Has to be called with `_lock` held, every time the state the order book is built from changes.
+        # Apart from dropping the snapshot it also wakes up all threads waiting for the state to change.
+        self._snapshot = None
+        self._condition.notify_all()
+
+    @timed_phase('dispatch')
+    def place_order(self, place_order_function, new_order=None):
         """Places new order. Order placement will happen in a background thread.
 
         Args:
             place_order_function: Function used to place the order.
+            new_order: The (optional) order being placed. If passed, the placement can get dropped
+                as stale, see `drop_stale_placements_with()`.
         """
         assert(callable(place_order_function))
 
         with self._lock:
+            if new_order is not None and len(self._register_placements([new_order])) == 0:
+                return
+
             self._currently_placing_orders += 1
+            reservation = self._reserve_balance(new_order)
+            self._order_book_changed()
 
         self._report_order_book_updated()
 
-        self._executor.submit(self._thread_place_order(place_order_function))
+        self._executor.submit(self._thread_place_order(place_order_function, new_order, reservation), self.PLACE_PRIORITY, RateLimitGovernor.PLACE)
 
+    @timed_phase('dispatch')
     def place_orders(self, new_orders: list):
         """Places new orders. Order placement will happen in a background thread.
 
@@ -241,16 +738,19 @@ class OrderBookManager:
             new_orders: List of new orders to place.
         """
         assert(isinstance(new_orders, list))
-        assert(callable(self.place_order_function))
+        assert(callable(self.place_order_function) or callable(self.place_orders_batch_function))
 
         with self._lock:
+            new_orders = self._register_placements(new_orders)
             self._currently_placing_orders += len(new_orders)
+            reservations = [self._reserve_balance(new_order) for new_order in new_orders]
+            self._order_book_changed()
 
         self._report_order_book_updated()
 
-        for new_order in new_orders:
-            self._executor.submit(self._thread_place_order(partial(self.place_order_function, new_order)))
+        self._submit_placements(new_orders, reservations)
 
+    @timed_phase('dispatch')
     def cancel_orders(self, orders: list):
         """Cancels existing orders. Order cancellation will happen in a background thread.
 
@@ -258,42 +758,107 @@ class OrderBookManager:
             orders: List of orders to cancel.
         """
         assert(isinstance(orders, list))
-        assert(callable(self.cancel_order_function))
+        assert(callable(self.cancel_order_function) or callable(self.cancel_orders_batch_function))
 
         with self._lock:
             for order in orders:
                 self._order_ids_cancelling.add(order.order_id)
 
+            self._order_book_changed()
+
         self._report_order_book_updated()
 
-        for order in orders:
-            self._executor.submit(self._thread_cancel_order(order.order_id, partial(self.cancel_order_function, order)))
+        self._submit_cancellations(orders)
+
+    @timed_phase('dispatch')
+    def amend_orders(self, amendments: list):
+        """Amends existing orders. Order amendment will happen in a background thread.
+
+        Orders being amended are not present in the order book until the amendment finishes,
+        and count as orders being both cancelled and placed.
 
+        Args:
+            amendments: List of `(order, new_order)` tuples, each order will be amended to become the new order.
+        """
+        assert(isinstance(amendments, list))
+        assert(callable(self.amend_order_function))
+
+        with self._lock:
+            for order, _ in amendments:
+                self._order_ids_cancelling.add(order.order_id)
+
+            self._currently_placing_orders += len(amendments)
+            reservations = [self._reserve_balance(new_order) for _, new_order in amendments]
+            self._order_book_changed()
+
+        self._report_order_book_updated()
+
+        for (order, new_order), reservation in zip(amendments, reservations):
+            self._executor.submit(self._thread_amend_order(order, new_order, reservation), self.AMEND_PRIORITY, RateLimitGovernor.PLACE)
+
+    @timed_phase('dispatch')
     def replace_orders(self, orders: list, new_orders: list):
         """Replaces existing orders with new ones.
 
+        If an amend function has been configured, orders get amended to become new orders for the band
+        they have been placed for, as long as there are any. Remaining orders get cancelled, remaining
+        new orders placed.
+
         Args:
             orders: List of orders to cancel.
             new_orders: List of new orders to place.
         """
         assert(isinstance(orders, list))
         assert(isinstance(new_orders, list))
-        assert(callable(self.place_order_function))
-        assert(callable(self.cancel_order_function))
+
+        if self.amend_order_function is not None:
+            amendments, orders, new_orders = pair_amendments(orders, new_orders, self.order_band)
+
+            if len(amendments) > 0:
+                self.amend_orders(amendments)
+
+            if len(orders) == 0 and len(new_orders) == 0:
+                return
+
+        assert(callable(self.place_order_function) or callable(self.place_orders_batch_function))
+        assert(callable(self.cancel_order_function) or callable(self.cancel_orders_batch_function))
 
         with self._lock:
             for order in orders:
                 self._order_ids_cancelling.add(order.order_id)
 
+            new_orders = self._register_placements(new_orders)
             self._currently_placing_orders += len(new_orders)
+            reservations = [self._reserve_balance(new_order) for new_order in new_orders]
+            self._order_book_changed()
 
         self._report_order_book_updated()
 
-        for order in orders:
-            self._executor.submit(self._thread_cancel_order(order.order_id, partial(self.cancel_order_function, order)))
+        self._submit_cancellations(orders)
+        self._submit_placements(new_orders, reservations)
 
-        for new_order in new_orders:
-            self._executor.submit(self._thread_place_order(partial(self.place_order_function, new_order)))
+    def _submit_placements(self, new_orders: list, reservations: list):
+        if self.place_orders_batch_function is not None:
+            for index in range(0, len(new_orders), self.place_orders_batch_size):
+                batch = new_orders[index:index + self.place_orders_batch_size]
+                batch_reservations = reservations[index:index + self.place_orders_batch_size]
+                self._executor.submit(self._thread_place_orders_batch(batch, batch_reservations), self.PLACE_PRIORITY, RateLimitGovernor.PLACE)
+
+        else:
+            for new_order, reservation in zip(new_orders, reservations):
+                self._executor.submit(self._thread_place_order(partial(self.place_order_function, new_order), new_order, reservation),
+                                      self.PLACE_PRIORITY, RateLimitGovernor.PLACE)
+
+    def _submit_cancellations(self, orders: list):
+        if self.cancel_orders_batch_function is not None:
+            for index in range(0, len(orders), self.cancel_orders_batch_size):
+                batch = orders[index:index + self.cancel_orders_batch_size]
+                self._executor.submit(self._thread_cancel_orders_batch(batch), self.CANCEL_PRIORITY, RateLimitGovernor.CANCEL)
+
+        else:
+            for order in orders:
+                self._executor.submit(self._thread_cancel_order(order.order_id, partial(self.cancel_order_function, order), order),
+                                      self.CANCEL_PRIORITY, RateLimitGovernor.CANCEL)
 
     def cancel_all_orders(self, final_wait_time: int = None):
         # Cancel all orders straight away, repeat until the internal order book state confirms
@@ -343,32 +908,198 @@ class OrderBookManager:
 
             self.logger.info("Still no open orders after the final check.")
 
-    def wait_for_order_cancellation(self):
-        """Wait until no background order cancellation takes place."""
-        while len(self._order_ids_cancelling) > 0:
-            time.sleep(0.1)
+    def wait_for_order_cancellation(self, timeout: float = None) -> bool:
+        """Wait until no background order cancellation takes place.
+
+        Args:
+            timeout: Maximum time (in seconds) to wait for. If `None`, waits indefinitely.
+
+        Returns:
+            `True` if no order cancellation takes place, `False` if the wait timed out.
+        """
+        with self._lock:
+            return self._condition.wait_for(lambda: len(self._order_ids_cancelling) == 0, timeout)
 
-    def wait_for_order_book_refresh(self):
-        """Wait until at least one background order book refresh happens since now."""
+    def wait_for_order_book_refresh(self, timeout: float = None) -> bool:
+        """Wait until at least one background order book refresh happens since now.
+
+        Args:
+            timeout: Maximum time (in seconds) to wait for. If `None`, waits indefinitely.
+
+        Returns:
+            `True` if the order book has been refreshed, `False` if the wait timed out.
+        """
         with self._lock:
             old_counter = self._refresh_count
+            return self._condition.wait_for(lambda: self._refresh_count > old_counter, timeout)
 
-        while True:
-            with self._lock:
-                new_counter = self._refresh_count
+    def wait_for_stable_order_book(self, timeout: float = None) -> bool:
+        """Wait until no background order placement nor cancellation takes place.
 
-            if new_counter > old_counter:
-                break
+        Args:
+            timeout: Maximum time (in seconds) to wait for. If `None`, waits indefinitely.
+
+        Returns:
+            `True` if the order book is stable, `False` if the wait timed out.
+        """
+        with self._lock:
+            return self._condition.wait_for(lambda: self._currently_placing_orders == 0 and
+                                                    len(self._order_ids_cancelling) == 0, timeout)
 
-            time.sleep(0.1)
+    def refresh_metrics(self) -> dict:
+        """Returns the effective refresh rate and the request budget usage, if refreshes are scheduled adaptively."""
+        if self.refresh_scheduler is None:
+            return {'interval': self.refresh_frequency,
+                    'refresh_rate': 1 / self.refresh_frequency if self.refresh_frequency > 0 else None}
 
-    def wait_for_stable_order_book(self):
-        """Wait until no background order placement nor cancellation takes place."""
-        while True:
-            order_book = self.get_order_book()
-            if not order_book.orders_being_cancelled and not order_book.orders_being_placed:
-                break
-            time.sleep(0.1)
+        return self.refresh_scheduler.metrics()
+
+    def executor_metrics(self) -> dict:
+        """Returns the number of cancellations, amendments and placements queued and running, placements dropped
+        as stale and placements with an uncertain outcome waiting to be resolved."""
+        metrics = self._executor.metrics()
+
+        with self._lock:
+            placements_dropped = self._placements_dropped
+            placements_uncertain = len(self._placements_uncertain)
+
+        return {'cancellations_queued': metrics['queued'].get(self.CANCEL_PRIORITY, 0),
+                'amendments_queued': metrics['queued'].get(self.AMEND_PRIORITY, 0),
+                'placements_queued': metrics['queued'].get(self.PLACE_PRIORITY, 0),
+                'running': metrics['running'],
+                'max_queued': metrics['max_queued'],
+                'workers': metrics['workers'],
+                'placements_dropped': placements_dropped,
+                'placements_uncertain': placements_uncertain}
+
+    def _is_placement_stale(self, new_order) -> bool:
+        if self.is_placement_stale_function is None:
+            return False
+
+        try:
+            if self.is_placement_stale_function(new_order):
+                self.logger.info(f"Not placing {new_order} as it became stale while queued")
+
+                with self._lock:
+                    self._placements_dropped += 1
+
+                return True
+        except Exception as exception:
+            self.logger.exception(f"Failed to check whether {new_order} is stale ({exception})")
+
+        return False
+
+    @staticmethod
+    def _client_order_id(new_order):
+        return getattr(new_order, 'client_order_id', None)
+
+    def _register_placements(self, new_orders: list) -> list:
+        # Has to be called with `_lock` held. Returns new orders which are not being placed already.
+        registered = []
+        for new_order in new_orders:
+            client_order_id = self._client_order_id(new_order)
+            if client_order_id is not None:
+                if client_order_id in self._placements_in_flight:
+                    self.logger.info(f"Not placing {client_order_id} again as it is being placed already")
+                    continue
+
+                self._placements_in_flight[client_order_id] = new_order
+
+            registered.append(new_order)
+
+        return registered
+
+    def _is_placement_uncertain(self, new_order) -> bool:
+        return self.client_order_id_function is not None and self._client_order_id(new_order) is not None
+
+    def _finish_placement(self, new_order, reservation, placed: bool, uncertain: bool = False):
+        # Has to be called with `_lock` held. Uncertain placements stay in flight until resolved.
+        client_order_id = self._client_order_id(new_order)
+
+        if uncertain:
+            self.logger.info(f"Placement of {client_order_id} may have succeeded, waiting for the order book to tell")
+            self._placements_uncertain[client_order_id] = [new_order, reservation, 0]
+            return
+
+        if not placed:
+            self._release_reservation(reservation)
+
+        self._placements_in_flight.pop(client_order_id, None)
+        self._currently_placing_orders -= 1
+
+    def _resolve_placements(self, client_order_ids: list, orders: list) -> bool:
+        # Has to be called with `_lock` held, with orders fetched after placements of `client_order_ids` failed.
+        # Returns `True` if any of these placements turned out to have succeeded.
+        if len(client_order_ids) == 0:
+            return False
+
+        placed_client_order_ids = set(self.client_order_id_function(order) for order in orders)
+        any_placed = False
+
+        for client_order_id in client_order_ids:
+            new_order, reservation, refreshes = self._placements_uncertain[client_order_id]
+
+            if client_order_id in placed_client_order_ids:
+                self.logger.info(f"Placement of {client_order_id} turned out to have succeeded")
+                self._settle_reservation(reservation)
+                any_placed = True
+
+            elif refreshes + 1 < self.placement_resolution_refreshes:
+                self._placements_uncertain[client_order_id][2] = refreshes + 1
+                continue
+
+            else:
+                self.logger.info(f"Placement of {client_order_id} turned out to have failed")
+
+            del self._placements_uncertain[client_order_id]
+            self._finish_placement(new_order, reservation, placed=client_order_id in placed_client_order_ids)
+
+        return any_placed
+
+    def _remember_band(self, placed_order, new_order):
+        # Has to be called with `_lock` held, once `placed_order` has been placed for `new_order`.
+        band = getattr(new_order, 'band', None)
+        if band is not None:
+            self._order_bands[placed_order.order_id] = band
+
+    def _reserve_balance(self, new_order):
+        # Has to be called with `_lock` held. Returns the key of the reservation, or `None` if there is none.
+        if self.buy_token is None or new_order is None:
+            return None
+
+        key = next(self._balance_keys)
+        token = self.sell_token if new_order.is_sell else self.buy_token
+        self._balance_adjustments[key] = [token, Wad(0) - new_order.pay_amount, None]
+
+        return key
+
+    def _settle_reservation(self, key):
+        # Has to be called with `_lock` held. Balances fetched from now on are expected to reflect the reservation.
+        if key in self._balance_adjustments:
+            self._balance_settlements += 1
+            self._balance_adjustments[key][2] = self._balance_settlements
+
+    def _release_reservation(self, key):
+        # Has to be called with `_lock` held, if the order the reservation has been made for did not get placed.
+        self._balance_adjustments.pop(key, None)
+
+    def _release_balance(self, order):
+        # Has to be called with `_lock` held, once the order has been cancelled.
+        if self.buy_token is None or order is None:
+            return
+
+        token = self.sell_token if order.is_sell else self.buy_token
+        self._balance_settlements += 1
+        self._balance_adjustments[next(self._balance_keys)] = [token, order.remaining_sell_amount, self._balance_settlements]
+
+    def _reconcile_balance_adjustments(self, balance_settlements: int):
+        # Has to be called with `_lock` held, once balances fetched after `balance_settlements` settlements arrived.
+        self._balance_adjustments = {key: adjustment for key, adjustment in self._balance_adjustments.items()
+                                     if adjustment[2] is None or adjustment[2] > balance_settlements}
+
+    def _acquire_request_budget(self, kind: str):
+        if self.rate_limit_governor is not None:
+            self.rate_limit_governor.acquire(kind)
 
     def _report_order_book_updated(self):
         if self.on_update_function is not None:
@@ -377,13 +1108,19 @@ class OrderBookManager:
     def _thread_refresh_order_book(self):
         while True:
             try:
+                self._acquire_request_budget(RateLimitGovernor.REFRESH)
+
                 with self._lock:
                     orders_already_cancelled_before = set(self._order_ids_cancelled)
                     orders_already_placed_before = set(self._orders_placed)
+                    orders_already_updated_before = dict(self._orders_updated)
+                    placements_uncertain_before = list(self._placements_uncertain)
+
+                if self.refresh_scheduler is not None:
+                    self.refresh_scheduler.record_request()
 
-                # get orders, get balances
                 orders = self.get_orders_function()
-                balances = self.get_balances_function() if self.get_balances_function is not None else None
+                timestamp = time.time()
 
                 if self.order_history_reporter:
                     orders_buy = self.buy_filter_function(orders)
@@ -391,47 +1128,155 @@ class OrderBookManager:
 
                     self.order_history_reporter.report_orders(orders_buy, orders_sell)
 
+                # Index orders by their ids, so placed orders can be merged with them in constant time.
+                index = {order.order_id: order for order in orders}
+
                 with self._lock:
+                    # Orders which disappeared without us cancelling them have most likely been filled.
+                    previous_index = self._components.get('index', {})
+                    orders_filled = any(order_id not in index and order_id not in orders_already_cancelled_before
+                                        for order_id in previous_index)
+
                     self._order_ids_cancelled = self._order_ids_cancelled - orders_already_cancelled_before
-                    for order in orders_already_placed_before:
-                        self._orders_placed.remove(order)
+                    self._orders_placed = [order for order in self._orders_placed if order not in orders_already_placed_before]
+                    self._orders_updated = {order_id: order for order_id, order in self._orders_updated.items()
+                                            if orders_already_updated_before.get(order_id) is not order}
+
+                    # Bands of orders which are gone are not needed anymore.
+                    if len(self._order_bands) > 0:
+                        placed_order_ids = set(order.order_id for order in self._orders_placed)
+                        self._order_bands = {order_id: band for order_id, band in self._order_bands.items()
+                                             if order_id in index or order_id in placed_order_ids}
 
-                    if self._state is None:
-                        self.logger.info("Order book became available")
+                    # Placements which failed before we started fetching the order book can be resolved now.
+                    orders_placed = self._resolve_placements(placements_uncertain_before, orders)
 
-                    self._state = {'orders': orders, 'balances': balances}
+                    self._update_state(orders=orders, index=index, orders_timestamp=timestamp)
                     self._refresh_count += 1
+                    self._order_book_changed()
+
+                    # Orders placed or cancelled since the previous refresh count as activity too.
+                    active = self._orders_in_flight() or len(orders_already_placed_before) > 0 \
+                             or len(orders_already_cancelled_before) > 0 or orders_filled
+
+                if self.refresh_scheduler is not None:
+                    self.refresh_scheduler.refreshed(active)
 
                 self._report_order_book_updated()
 
-                self.logger.debug(f"Fetched the order book"
-                                  f" (orders: {[order.order_id for order in orders]})")
+                if orders_filled or orders_placed:
+                    self.refresh_balances()
+
+                if self.logger.isEnabledFor(logging.DEBUG):
+                    self.logger.debug(f"Fetched the order book (orders: {list(index)})")
             except Exception as e:
                 self.logger.info(f"Failed to fetch the order book ({e})")
 
-            time.sleep(self.refresh_frequency)
+                if self.refresh_scheduler is not None:
+                    self.refresh_scheduler.refreshed(False)
+
+            self._wait_for_order_book_refresh_time()
+
+    def _thread_refresh_balances(self):
+        while True:
+            try:
+                self._acquire_request_budget(RateLimitGovernor.REFRESH)
 
-    def _thread_place_order(self, place_order_function):
+                with self._lock:
+                    balances_pushed_before = self._balances_pushed
+                    balance_settlements_before = self._balance_settlements
+
+                if self.refresh_scheduler is not None:
+                    self._wait_for_request_budget()
+                    self.refresh_scheduler.record_request()
+
+                balances = self.get_balances_function()
+                timestamp = time.time()
+
+                with self._lock:
+                    # Balances pushed while we were fetching them are more recent than the ones we got.
+                    if self._balances_pushed == balances_pushed_before:
+                        self._update_state(balances=balances, balances_timestamp=timestamp)
+                        self._reconcile_balance_adjustments(balance_settlements_before)
+
+                self._report_order_book_updated()
+            except Exception as e:
+                self.logger.info(f"Failed to fetch the balances ({e})")
+
+            self._balances_refresh_requested.wait(self._refresh_interval(self.balances_refresh_frequency or self.refresh_frequency))
+            self._balances_refresh_requested.clear()
+
+    def _wait_for_order_book_refresh_time(self):
+        if self.refresh_scheduler is None or (self.order_stream is not None and self.order_stream.connected):
+            self._refresh_requested.wait(self._refresh_interval(self.refresh_frequency))
+
+        else:
+            # Activity may start while we are waiting, so we never wait longer than `min_interval`
+            # before asking the scheduler again.
+            while True:
+                with self._lock:
+                    active = self._orders_in_flight()
+
+                remaining = self.refresh_scheduler.next_refresh_time(active) - self.refresh_scheduler.clock()
+                if remaining <= 0 or self._refresh_requested.wait(min(remaining, self.refresh_scheduler.min_interval)):
+                    break
+
+            self._wait_for_request_budget()
+
+        self._refresh_requested.clear()
+
+    def _wait_for_request_budget(self):
+        delay = self.refresh_scheduler.request_available_time() - self.refresh_scheduler.clock()
+        if delay > 0:
+            self.logger.debug(f"Request budget used up, waiting {delay:.1f}s")
+            time.sleep(delay)
+
+    def _orders_in_flight(self) -> bool:
+        # Has to be called with `_lock` held.
+        return self._currently_placing_orders > 0 or len(self._order_ids_cancelling) > 0
+
+    def _refresh_interval(self, refresh_frequency: int) -> int:
+        if self.order_stream is not None and self.order_stream.connected:
+            return max(refresh_frequency, self.reconciliation_frequency)
+        else:
+            return refresh_frequency
+
+    def _thread_place_order(self, place_order_function, new_order=None, reservation=None):
         assert(callable(place_order_function))
 
         def func():
+            placed_order = None
+            uncertain = False
+
             try:
-                new_order = place_order_function()
+                if new_order is not None and self._is_placement_stale(new_order):
+                    return
 
-                if new_order is not None:
+                try:
+                    placed_order = place_order_function()
+                except BaseException:
+                    uncertain = self._is_placement_uncertain(new_order)
+                    raise
+
+                if placed_order is not None:
                     with self._lock:
-                        self._orders_placed.append(new_order)
+                        self._orders_placed.append(placed_order)
+                        self._remember_band(placed_order, new_order)
+                        self._settle_reservation(reservation)
+
+                    self.refresh_balances()
             except BaseException as exception:
                 self.logger.exception(exception)
             finally:
                 with self._lock:
-                    self._currently_placing_orders -= 1
+                    self._finish_placement(new_order, reservation, placed=placed_order is not None, uncertain=uncertain)
+                    self._order_book_changed()
 
                 self._report_order_book_updated()
 
         return func
 
-    def _thread_cancel_order(self, order_id, cancel_order_function):
+    def _thread_cancel_order(self, order_id, cancel_order_function, order=None):
         assert(callable(cancel_order_function))
 
         def func():
@@ -440,6 +1285,7 @@ class OrderBookManager:
                     with self._lock:
                         self._order_ids_cancelled.add(order_id)
                         self._order_ids_cancelling.remove(order_id)
+                        self._release_balance(order)
             except BaseException as exception:
                 self.logger.exception(f"Failed to cancel {order_id}")
             finally:
@@ -449,6 +1295,119 @@ class OrderBookManager:
                     except KeyError:
                         pass
 
+                    self._order_book_changed()
+
+                self._report_order_book_updated()
+
+        return func
+
+    def _thread_amend_order(self, order, new_order, reservation=None):
+        def func():
+            amended_order = None
+
+            try:
+                if self._is_placement_stale(new_order):
+                    return
+
+                amended_order = self.amend_order_function(order, new_order)
+
+                if amended_order is not None:
+                    with self._lock:
+                        # As long as the id stays the same, the amended order takes the place of the original one.
+                        if amended_order.order_id == order.order_id:
+                            self._orders_updated[order.order_id] = amended_order
+                        else:
+                            self._order_ids_cancelled.add(order.order_id)
+                            self._orders_placed.append(amended_order)
+
+                        self._remember_band(amended_order, new_order)
+
+                        self._settle_reservation(reservation)
+                        self._release_balance(order)
+
+                    self.refresh_balances()
+            except BaseException as exception:
+                self.logger.exception(f"Failed to amend {order.order_id}")
+            finally:
+                with self._lock:
+                    if amended_order is None:
+                        self._release_reservation(reservation)
+
+                    self._order_ids_cancelling.discard(order.order_id)
+                    self._currently_placing_orders -= 1
+                    self._order_book_changed()
+
+                self._report_order_book_updated()
+
+        return func
+
+    def _thread_place_orders_batch(self, new_orders: list, reservations: list):
+        assert(isinstance(new_orders, list))
+        assert(isinstance(reservations, list))
+
+        def func():
+            # Indices of new orders which got placed, or whose placement has an uncertain outcome.
+            placed = set()
+            uncertain = set()
+
+            try:
+                fresh = [index for index, new_order in enumerate(new_orders) if not self._is_placement_stale(new_order)]
+                if len(fresh) == 0:
+                    return
+
+                try:
+                    placed_orders = self.place_orders_batch_function([new_orders[index] for index in fresh])
+                except BaseException:
+                    uncertain = set(index for index in fresh if self._is_placement_uncertain(new_orders[index]))
+                    raise
+
+                assert(len(placed_orders) == len(fresh))
+
+                with self._lock:
+                    for placed_order, index in zip(placed_orders, fresh):
+                        if placed_order is not None:
+                            self._orders_placed.append(placed_order)
+                            self._remember_band(placed_order, new_orders[index])
+                            self._settle_reservation(reservations[index])
+                            placed.add(index)
+
+                if len(placed) > 0:
+                    self.refresh_balances()
+            except BaseException as exception:
+                self.logger.exception(exception)
+            finally:
+                with self._lock:
+                    for index, (new_order, reservation) in enumerate(zip(new_orders, reservations)):
+                        self._finish_placement(new_order, reservation, placed=index in placed, uncertain=index in uncertain)
+
+                    self._order_book_changed()
+
+                self._report_order_book_updated()
+
+        return func
+
+    def _thread_cancel_orders_batch(self, orders: list):
+        assert(isinstance(orders, list))
+
+        def func():
+            try:
+                results = self.cancel_orders_batch_function(orders)
+                assert(len(results) == len(orders))
+
+                with self._lock:
+                    for order, result in zip(orders, results):
+                        if result:
+                            self._order_ids_cancelled.add(order.order_id)
+                            self._release_balance(order)
+            except BaseException as exception:
+                self.logger.exception(f"Failed to cancel {[order.order_id for order in orders]}")
+            finally:
+                with self._lock:
+                    for order in orders:
+                        self._order_ids_cancelling.discard(order.order_id)
+
+                    self._order_book_changed()
+
                 self._report_order_book_updated()
 
         return func
@@ -0,0 +1,173 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2020 MakerDAO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import logging
+
+from market_maker_keeper.feed_engine import FeedEngine, feed_engine
+from market_maker_keeper.util import sanitize_url
+
+
+class OrderEvent:
+    """Represents a single change of keeper orders or balances, pushed by the exchange.
+
+    Use one of the static methods to create events of each kind.
+
+    Attributes:
+        kind: One of `PLACED`, `FILLED`, `CANCELLED` or `BALANCES`.
+        order_id: Id of the order the event is about. `None` for `BALANCES` events.
+        order: The order placed, or the order remaining after a partial fill. `None` otherwise.
+        balances: Current keeper balances, for `BALANCES` events only.
+    """
+
+    PLACED = 'placed'
+    FILLED = 'filled'
+    CANCELLED = 'cancelled'
+    BALANCES = 'balances'
+
+    def __init__(self, kind: str, order_id=None, order=None, balances=None):
+        assert(kind in [self.PLACED, self.FILLED, self.CANCELLED, self.BALANCES])
+
+        self.kind = kind
+        self.order_id = order_id
+        self.order = order
+        self.balances = balances
+
+    @staticmethod
+    def placed(order):
+        """A new order appeared on the exchange."""
+        return OrderEvent(OrderEvent.PLACED, order_id=order.order_id, order=order)
+
+    @staticmethod
+    def filled(order_id, remaining_order=None):
+        """An order has been filled, fully if `remaining_order` is `None`, partially otherwise."""
+        return OrderEvent(OrderEvent.FILLED, order_id=order_id, order=remaining_order)
+
+    @staticmethod
+    def cancelled(order_id):
+        """An order has been cancelled."""
+        return OrderEvent(OrderEvent.CANCELLED, order_id=order_id)
+
+    @staticmethod
+    def balances_changed(balances):
+        """Keeper balances have changed."""
+        return OrderEvent(OrderEvent.BALANCES, balances=balances)
+
+    def __repr__(self):
+        return f"OrderEvent({self.kind}, {self.order_id})"
+
+
+class OrderStream:
+    """Push-based source of changes of keeper orders and balances.
+
+    Implementations call `on_events_function` with lists of `OrderEvent`s as they arrive and
+    `on_connection_function` every time they get connected or disconnected. The `connected`
+    attribute tells whether changes are being received at the moment.
+    """
+
+    def __init__(self):
+        self.connected = False
+        self._on_events_function = None
+        self._on_connection_function = None
+
+    def start(self, on_events_function, on_connection_function):
+        assert(callable(on_events_function))
+        assert(callable(on_connection_function))
+
+        self._on_events_function = on_events_function
+        self._on_connection_function = on_connection_function
+
+    def _events(self, events: list):
+        if len(events) > 0:
+            self._on_events_function(events)
+
+    def _connection(self, connected: bool):
+        self.connected = connected
+        self._on_connection_function(connected)
+
+
+class WebSocketOrderStream(OrderStream):
+    """Receives changes of keeper orders and balances from a user data WebSocket.
+
+    Attributes:
+        ws_url: WebSocket URL to connect to.
+        parse_message_function: The function which will be called with every JSON message received,
+            it has to return a list of `OrderEvent`s the message represents (possibly empty).
+        subscribe_messages_function: The (optional) function returning the list of JSON messages
+            to be sent right after connecting, i.e. to authenticate and subscribe.
+        headers_function: The (optional) function returning the list of HTTP headers sent with the connection
+            request, as `'Name: value'` strings, for exchanges authenticating the connection itself.
+        reconnect_delay: Time (in seconds) to wait before reconnecting.
+        engine: The `FeedEngine` hosting the connection. Defaults to the one shared by the whole process.
+    """
+
+    logger = logging.getLogger()
+
+    def __init__(self, ws_url: str, parse_message_function, subscribe_messages_function=None, headers_function=None,
+                 reconnect_delay: int = 5, engine: FeedEngine = None):
+        assert(isinstance(ws_url, str))
+        assert(callable(parse_message_function))
+        assert(callable(subscribe_messages_function) or subscribe_messages_function is None)
+        assert(callable(headers_function) or headers_function is None)
+        assert(isinstance(reconnect_delay, int))
+        assert(isinstance(engine, FeedEngine) or engine is None)
+
+        super().__init__()
+
+        self.ws_url = ws_url
+        self.parse_message_function = parse_message_function
+        self.subscribe_messages_function = subscribe_messages_function
+        self.headers_function = headers_function
+        self.reconnect_delay = reconnect_delay
+        self.engine = engine or feed_engine
+        self.connection = None
+
+        self._sanitized_url = sanitize_url(ws_url)
+
+    def start(self, on_events_function, on_connection_function):
+        super().start(on_events_function, on_connection_function)
+
+        self.connection = self.engine.connect(self.ws_url, self._on_message,
+                                              on_open=self._on_open,
+                                              on_close=self._on_close,
+                                              headers=self.headers_function,
+                                              reconnect_delay=self.reconnect_delay)
+
+    def _on_open(self, connection):
+        self.logger.info(f"Order stream WebSocket '{self._sanitized_url}' connected")
+
+        if self.subscribe_messages_function is not None:
+            for message in self.subscribe_messages_function():
+                connection.send(json.dumps(message))
+
+        self._connection(True)
+
+    def _on_close(self, connection):
+        self.logger.info(f"Order stream WebSocket '{self._sanitized_url}' disconnected")
+
+        if self.connected:
+            self._connection(False)
+
+    def _on_message(self, message):
+        try:
+            events = self.parse_message_function(json.loads(message))
+        except Exception as e:
+            self.logger.warning(f"Order stream WebSocket '{self._sanitized_url}' received invalid message: '{message}' ({e})")
+            return
+
+        self._events(events)
+
@@ -24,8 +24,9 @@ from typing import Optional, List
 import websocket
 
 from gdax_client.price import GdaxPriceClient, GDAX_WS_URL
-from market_maker_keeper.feed import ExpiringFeed, WebSocketFeed, Feed
+from market_maker_keeper.feed import CoalescingFeed, ExpiringFeed, Feed, feed_registry
 from market_maker_keeper.setzer import Setzer
+from market_maker_keeper.tick_timer import current_tick, timed_phase
 from pymaker.feed import DSValue
 from pymaker.numeric import Wad
 from pymaker.sai import Tub
@@ -44,6 +45,13 @@ class PriceFeed(object):
     def get_price(self) -> Price:
         raise NotImplementedError("Please implement this method")
 
+    def on_update(self, on_update_function):
+        """Registers the function to be called every time the price may have changed.
+
+        Price feeds which are polled, or which can not tell when the price changes, never call it.
+        """
+        assert(callable(on_update_function))
+
 
 class FixedPriceFeed(PriceFeed):
     logger = logging.getLogger()
@@ -83,6 +91,7 @@ class SetzerPriceFeed(PriceFeed):
         self._retries = 0
         self._timestamp = 0
         self._expired = True
+        self._on_update_function = None
         threading.Thread(target=self._background_run, daemon=True).start()
 
     def _fetch_price(self):
@@ -93,6 +102,9 @@ class SetzerPriceFeed(PriceFeed):
 
             self.logger.debug(f"Fetched price from {self.source}: {self._price}")
 
+            if self._on_update_function is not None:
+                self._on_update_function()
+
             if self._expired:
                 self.logger.info(f"Price feed from 'setzer' ({self.source}) became available")
                 self._expired = False
@@ -119,6 +131,11 @@ class SetzerPriceFeed(PriceFeed):
             value = self._price
             return Price(buy_price=value, sell_price=value)
 
+    def on_update(self, on_update_function):
+        assert(callable(on_update_function))
+
+        self._on_update_function = on_update_function
+
 
 class GdaxPriceFeed(PriceFeed):
     logger = logging.getLogger()
@@ -127,9 +144,11 @@ class GdaxPriceFeed(PriceFeed):
         assert(isinstance(product_id, str))
         assert(isinstance(expiry, int))
 
-        self.gdax_price_client = GdaxPriceClient(ws_url=GDAX_WS_URL,
-                                                 product_id=product_id,
-                                                 expiry=expiry)
+        # Price feeds of the same product (i.e. `eth_dai` and `dai_eth`) share one connection.
+        self.gdax_price_client = feed_registry.get(('gdax', product_id, expiry),
+                                                   lambda: GdaxPriceClient(ws_url=GDAX_WS_URL,
+                                                                           product_id=product_id,
+                                                                           expiry=expiry))
 
     def get_price(self) -> Price:
         gdax_price = self.gdax_price_client.get_price()
@@ -159,6 +178,12 @@ class WebSocketPriceFeed(PriceFeed):
 
         self.feed = feed
 
+    def on_update(self, on_update_function):
+        try:
+            self.feed.on_update(on_update_function)
+        except NotImplementedError:
+            pass
+
     def get_price(self) -> Price:
         data, timestamp = self.feed.get()
 
@@ -216,6 +241,10 @@ class AveragePriceFeed(PriceFeed):
 
         return Price(buy_price=buy_price, sell_price=sell_price)
 
+    def on_update(self, on_update_function):
+        for feed in self.feeds:
+            feed.on_update(on_update_function)
+
 
 class ReversePriceFeed(PriceFeed):
     def __init__(self, price_feed: PriceFeed):
@@ -229,6 +258,9 @@ class ReversePriceFeed(PriceFeed):
         sell_price = Wad.from_number(1) / parent_price.sell_price if parent_price.sell_price is not None else None
         return Price(buy_price=buy_price, sell_price=sell_price)
 
+    def on_update(self, on_update_function):
+        self.price_feed.on_update(on_update_function)
+
 
 class BackupPriceFeed(PriceFeed):
     logger = logging.getLogger()
@@ -237,6 +269,7 @@ class BackupPriceFeed(PriceFeed):
         assert(isinstance(feeds, list))
         self.feeds = feeds
 
+    @timed_phase('price')
     def get_price(self) -> Price:
         for feed in self.feeds:
             price = feed.get_price()
@@ -245,12 +278,289 @@ class BackupPriceFeed(PriceFeed):
 
         return Price(buy_price=None, sell_price=None)
 
+    def on_update(self, on_update_function):
+        for feed in self.feeds:
+            feed.on_update(on_update_function)
+
+
+class AggregatePriceFeed(PriceFeed):
+    """Price feed reading all its feeds concurrently in the background and aggregating their prices.
+
+    Every `interval` seconds, and as soon as any of the feeds signals a change, all feeds get read in
+    parallel, each one by its own long-lived reader thread. A feed which does not return its price
+    within `deadline` seconds gets left out of the aggregate until it does, so a slow feed (e.g. `TubPriceFeed`
+    waiting for the node) never holds back the others. A feed still busy with a previous read does not get
+    read again until that read returns.
+
+    Buy and sell prices get aggregated separately, using one of:
+     - `FIRST`: the price of the first feed (in order) which has one, like `BackupPriceFeed` does,
+     - `MEAN`: the average price, like `AveragePriceFeed` does,
+     - `MEDIAN`: the median price,
+     - `TRIMMED_MEAN`: the average price, leaving out the `trim` fraction of the lowest and of the highest prices.
+
+    If `max_deviation` is set, prices deviating from the median by more than this fraction of it get rejected
+    as outliers before aggregating, leaving no price at all if all of them do.
+
+    The aggregate gets recomputed every time a read returns (or misses its deadline), so `get_price()`
+    just returns the last one.
+    """
+
+    FIRST = 'first'
+    MEAN = 'mean'
+    MEDIAN = 'median'
+    TRIMMED_MEAN = 'trimmed-mean'
+    AGGREGATIONS = [FIRST, MEAN, MEDIAN, TRIMMED_MEAN]
+
+    logger = logging.getLogger()
+
+    def __init__(self, feeds: List[PriceFeed], aggregation: str = MEDIAN, deadline: float = 1.0,
+                 interval: float = 1.0, trim: float = 0.25, max_deviation: Optional[float] = None):
+        assert(isinstance(feeds, list))
+        assert(len(feeds) > 0)
+        assert(aggregation in self.AGGREGATIONS)
+        assert(isinstance(deadline, (int, float)))
+        assert(isinstance(interval, (int, float)))
+        assert(isinstance(trim, (int, float)))
+        assert(0 <= trim < 0.5)
+        assert(isinstance(max_deviation, (int, float)) or max_deviation is None)
+
+        self.feeds = feeds
+        self.aggregation = aggregation
+        self.deadline = deadline
+        self.interval = interval
+        self.trim = trim
+        self.max_deviation = max_deviation
+
+        self._condition = threading.Condition()
+        self._wakeup = threading.Event()
+        self._ready = threading.Event()
+
+        # Latest price of each feed (`None` if its read failed or missed the deadline),
+        # and the time the read of each feed in progress (if any) started at.
+        self._prices = [None] * len(feeds)
+        self._started = [None] * len(feeds)
+        self._price = Price(buy_price=None, sell_price=None)
+        self._on_update_functions = ()
+
+        self._reads = 0
+        self._late = 0
+
+        # Every feed has at most one read in progress, made by its own reader thread,
+        # so a slow feed never delays reads of the other ones.
+        self._read_requests = [threading.Event() for _ in feeds]
+
+        for feed in feeds:
+            feed.on_update(self._wakeup.set)
+
+        for index in range(len(feeds)):
+            threading.Thread(target=self._background_read, args=(index,), name='aggregate-price-feed-reader', daemon=True).start()
+
+        threading.Thread(target=self._background_run, daemon=True).start()
+
+    @timed_phase('price')
+    def get_price(self) -> Price:
+        # Only blocks until the first round of reads completes.
+        self._ready.wait(self.deadline)
+
+        return self._price
+
+    def on_update(self, on_update_function):
+        assert(callable(on_update_function))
+
+        # Subscribers get replaced rather than modified, so they can be iterated over without locking.
+        with self._condition:
+            self._on_update_functions = self._on_update_functions + (on_update_function,)
+
+    def metrics(self) -> dict:
+        """Returns the number of reads, and of reads which missed the deadline."""
+        with self._condition:
+            return {'reads': self._reads, 'late': self._late}
+
+    def _background_run(self):
+        while True:
+            self._wakeup.clear()
+            self._read_all()
+            self._ready.set()
+
+            self._wakeup.wait(self.interval)
+
+    def _read_all(self):
+        changed = False
+
+        with self._condition:
+            for index in range(len(self.feeds)):
+                if self._started[index] is None:
+                    self._started[index] = time.time()
+                    self._read_requests[index].set()
+
+            # Wait until all reads either return or miss their deadlines.
+            while True:
+                now = time.time()
+                remaining = [started + self.deadline - now for started in self._started if started is not None]
+
+                expired = [index for index, started in enumerate(self._started)
+                           if started is not None and now - started >= self.deadline and self._prices[index] is not None]
+                for index in expired:
+                    self._prices[index] = None
+
+                if len(expired) > 0:
+                    changed = self._update() or changed
+
+                if not any(time_left > 0 for time_left in remaining):
+                    break
+
+                self._condition.wait(min(time_left for time_left in remaining if time_left > 0))
+
+        if changed:
+            self._notify()
+
+    def _background_read(self, index: int):
+        while True:
+            self._read_requests[index].wait()
+            self._read_requests[index].clear()
+            self._read(index)
+
+    def _read(self, index: int):
+        try:
+            price = self.feeds[index].get_price()
+        except Exception as e:
+            self.logger.warning(f"Failed to read price from {type(self.feeds[index]).__name__} ({e})")
+            price = None
+
+        with self._condition:
+            self._reads += 1
+            if time.time() - self._started[index] > self.deadline:
+                self._late += 1
+
+            self._started[index] = None
+            self._prices[index] = price
+            changed = self._update()
+
+            self._condition.notify_all()
+
+        if changed:
+            self._notify()
+
+    def _update(self) -> bool:
+        buy_price = self._aggregate([price.buy_price for price in self._prices if price is not None])
+        sell_price = self._aggregate([price.sell_price for price in self._prices if price is not None])
+
+        if self._same(buy_price, self._price.buy_price) and self._same(sell_price, self._price.sell_price):
+            return False
+
+        self._price = Price(buy_price=buy_price, sell_price=sell_price)
+        return True
+
+    def _notify(self):
+        # Nobody can have seen the price before the first round of reads completes.
+        if not self._ready.is_set():
+            return
+
+        for on_update_function in self._on_update_functions:
+            try:
+                on_update_function()
+            except Exception as e:
+                self.logger.exception(f"Price update subscriber failed ({e})")
+
+    def _aggregate(self, prices: List[Optional[Wad]]) -> Optional[Wad]:
+        if self.aggregation == self.FIRST:
+            return next((price for price in prices if price is not None), None)
+
+        prices = sorted(price for price in prices if price is not None)
+        if len(prices) == 0:
+            return None
+
+        if self.max_deviation is not None:
+            median = self._median(prices)
+            max_difference = median * Wad.from_number(self.max_deviation)
+            prices = [price for price in prices if abs(price - median) <= max_difference]
+
+            # No two prices are close enough to each other to tell which one is right.
+            if len(prices) == 0:
+                return None
+
+        if self.aggregation == self.MEDIAN:
+            return self._median(prices)
+
+        if self.aggregation == self.TRIMMED_MEAN:
+            trimmed = int(len(prices) * self.trim)
+            prices = prices[trimmed:len(prices) - trimmed]
+
+        return sum(prices, Wad.from_number(0)) / Wad.from_number(len(prices))
+
+    @staticmethod
+    def _same(price: Optional[Wad], other_price: Optional[Wad]) -> bool:
+        if price is None or other_price is None:
+            return price is other_price
+
+        return price == other_price
+
+    @staticmethod
+    def _median(sorted_prices: List[Wad]) -> Wad:
+        middle = len(sorted_prices) // 2
+
+        if len(sorted_prices) % 2 == 1:
+            return sorted_prices[middle]
+        else:
+            return (sorted_prices[middle - 1] + sorted_prices[middle]) / Wad.from_number(2)
+
+
+class SnapshotPriceFeed(PriceFeed):
+    """Price feed reading its parent feed only once per order synchronization tick, see `TickTimer.tick()`.
+
+    All reads within one tick return the very same `Price`, so repeated reads cost nothing and all decisions
+    made within the tick (e.g. about both buy and sell orders) are based on one consistent price. Reads from
+    outside of a tick (e.g. by the order book manager checking for stale placements) always go to the parent feed.
+    """
+
+    def __init__(self, price_feed: PriceFeed):
+        assert(isinstance(price_feed, PriceFeed))
+
+        self.price_feed = price_feed
+        self._snapshot = None, None
+
+    def get_price(self) -> Price:
+        tick = current_tick()
+        if tick is None:
+            return self.price_feed.get_price()
+
+        snapshot_tick, price = self._snapshot
+        if snapshot_tick is not tick:
+            price = self.price_feed.get_price()
+            self._snapshot = tick, price
+
+        return price
+
+    def on_update(self, on_update_function):
+        self.price_feed.on_update(on_update_function)
+
+
+def add_price_feed_aggregation_arguments(parser):
+    """Adds the arguments telling `PriceFeedFactory` how to combine multiple price feeds to a keeper argument parser."""
+    parser.add_argument("--price-feed-aggregation", type=str, default="backup",
+                        choices=["backup", "first", "mean", "median", "trimmed-mean"],
+                        help="How to combine comma-separated price feeds: 'backup' uses the first one available"
+                             " (default), the other ones read all of them concurrently")
+
+    parser.add_argument("--price-feed-max-deviation", type=float,
+                        help="Reject prices deviating from the median of all price feeds by more than this fraction"
+                             " of it, e.g. 0.05 (default: no limit). Not used by the 'backup' and 'first' aggregations")
+
 
 class PriceFeedFactory:
     @staticmethod
     def create_price_feed(arguments, tub: Tub = None) -> PriceFeed:
-        return BackupPriceFeed([PriceFeedFactory._create_price_feed(price_feed, arguments.price_feed_expiry, tub)
-                                for price_feed in arguments.price_feed.split(",")])
+        price_feeds = [PriceFeedFactory._create_price_feed(price_feed, arguments.price_feed_expiry, tub)
+                       for price_feed in arguments.price_feed.split(",")]
+
+        # Keepers which do not call `add_price_feed_aggregation_arguments()` use the feeds as backups of each other.
+        aggregation = getattr(arguments, 'price_feed_aggregation', 'backup')
+        max_deviation = getattr(arguments, 'price_feed_max_deviation', None)
+
+        if aggregation == 'backup':
+            return SnapshotPriceFeed(BackupPriceFeed(price_feeds))
+        else:
+            return SnapshotPriceFeed(AggregatePriceFeed(price_feeds, aggregation=aggregation, max_deviation=max_deviation))
 
     @staticmethod
     def _create_price_feed(price_feed_argument: str, price_feed_expiry_argument: int, tub: Optional[Tub]):
@@ -319,7 +629,8 @@ class PriceFeedFactory:
             price_feed = FixedPriceFeed(Wad.from_number(price_feed_argument[6:]))
 
         elif price_feed_argument.startswith("ws://") or price_feed_argument.startswith("wss://"):
-            socket_feed = WebSocketFeed(price_feed_argument, 5)
+            # Only the latest price matters, so intermediate updates of the price feed can be skipped.
+            socket_feed = CoalescingFeed(feed_registry.web_socket_feed(price_feed_argument, 5))
             socket_feed = ExpiringFeed(socket_feed, price_feed_expiry_argument)
 
             price_feed = WebSocketPriceFeed(socket_feed)
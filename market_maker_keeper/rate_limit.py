@@ -0,0 +1,231 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2020 MakerDAO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import threading
+import time
+
+
+class RateLimitGovernor:
+    """Token bucket keeping all exchange API requests made by a keeper within the exchange rate limit.
+
+    The bucket holds up to `burst` tokens and gets refilled with `rate` tokens per second, each request
+    takes `cost` tokens out of it. One governor is meant to be shared by all call sites in a keeper
+    process, i.e. by the order book manager (see `OrderBookManager.govern_requests_with()`) and by
+    the keeper itself for any other requests it makes.
+
+    Requests are of one of three kinds, in the order of priority: `CANCEL`, `PLACE` and `REFRESH`.
+    Requests only go ahead if no requests of a higher priority are waiting, so refreshes get deferred
+    while placements are waiting for the budget and so on. On top of that, `cancel_reserve` tokens
+    can only be used by cancellations, so orders can be cancelled even if the budget is used up.
+
+    Attributes:
+        rate: Number of requests per second allowed by the exchange, or `None` for unlimited.
+        burst: Maximum number of requests which can be made at once. Defaults to one second worth of requests.
+        cancel_reserve: Number of tokens reserved for cancellations. Defaults to a fifth of `burst`.
+    """
+
+    CANCEL = 'cancel'
+    PLACE = 'place'
+    REFRESH = 'refresh'
+
+    KINDS = [CANCEL, PLACE, REFRESH]
+
+    logger = logging.getLogger()
+
+    def __init__(self, rate: float = None, burst: float = None, cancel_reserve: float = None, clock=time.time):
+        assert(isinstance(rate, (int, float)) or rate is None)
+        assert(isinstance(burst, (int, float)) or burst is None)
+        assert(isinstance(cancel_reserve, (int, float)) or cancel_reserve is None)
+        assert(callable(clock))
+
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate or 0, 1)
+        self.cancel_reserve = cancel_reserve if cancel_reserve is not None else self.burst / 5
+        self.clock = clock
+
+        assert(rate is None or rate > 0)
+        assert(0 <= self.cancel_reserve < self.burst)
+
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        self._tokens = self.burst
+        self._updated = clock()
+        self._waiting = {kind: 0 for kind in self.KINDS}
+        self._acquired = {kind: 0 for kind in self.KINDS}
+        self._throttled = {kind: 0 for kind in self.KINDS}
+
+    def try_acquire(self, kind: str, cost: float = 1) -> bool:
+        """Takes `cost` tokens for a request of the given kind if they are available right now.
+
+        Returns:
+            `True` if the request can be made, `False` otherwise.
+        """
+        assert(kind in self.KINDS)
+
+        with self._lock:
+            self._refill()
+
+            if self._can_acquire(kind, cost):
+                self._take(kind, cost)
+                return True
+
+            return False
+
+    def acquire(self, kind: str, cost: float = 1, timeout: float = None, abandon=None) -> bool:
+        """Waits until `cost` tokens are available for a request of the given kind, then takes them.
+
+        Args:
+            kind: One of `CANCEL`, `PLACE` or `REFRESH`.
+            cost: Number of tokens the request takes.
+            timeout: Maximum time (in seconds) to wait for. If `None`, waits indefinitely.
+            abandon: Optional function telling whether to give up waiting. It gets called before each wait,
+                and waiting requests can be woken up to call it again with `notify()`.
+
+        Returns:
+            `True` if the request can be made, `False` if the wait timed out or got abandoned.
+        """
+        assert(kind in self.KINDS)
+        assert(callable(abandon) or abandon is None)
+
+        deadline = self.clock() + timeout if timeout is not None else None
+
+        with self._lock:
+            self._waiting[kind] += 1
+
+            try:
+                throttled = False
+
+                while True:
+                    self._refill()
+
+                    if self._can_acquire(kind, cost):
+                        self._take(kind, cost)
+                        return True
+
+                    if abandon is not None and abandon():
+                        return False
+
+                    if not throttled:
+                        throttled = True
+                        self._throttled[kind] += 1
+                        self.logger.debug(f"Rate limit reached, deferring {kind} request")
+
+                    # If only blocked by requests of a higher priority, we get notified once they go ahead.
+                    delay = self._available_time(kind, cost) - self.clock()
+                    wait = delay if delay > 0 else None
+
+                    if deadline is not None:
+                        remaining = deadline - self.clock()
+                        if remaining <= 0:
+                            return False
+
+                        wait = min(wait, remaining) if wait is not None else remaining
+
+                    self._condition.wait(wait)
+            finally:
+                self._waiting[kind] -= 1
+                self._condition.notify_all()
+
+    def notify(self):
+        """Wakes up all requests waiting for the budget, so they check again whether to abandon the wait."""
+        with self._lock:
+            self._condition.notify_all()
+
+    def call(self, kind: str, function, *args, **kwargs):
+        """Waits for the budget for a request of the given kind, then makes it by calling `function`."""
+        assert(callable(function))
+
+        self.acquire(kind)
+        return function(*args, **kwargs)
+
+    def available_time(self, kind: str, cost: float = 1) -> float:
+        """Returns the earliest time a request of the given kind can be made at, ignoring other requests waiting."""
+        assert(kind in self.KINDS)
+
+        with self._lock:
+            self._refill()
+            return self._available_time(kind, cost)
+
+    def metrics(self) -> dict:
+        """Returns the remaining budget, and the number of requests made, waiting and throttled of each kind."""
+        with self._lock:
+            self._refill()
+
+            return {'tokens': self._tokens if self.rate is not None else None,
+                    'budget_usage': 1 - self._tokens / self.burst if self.rate is not None else None,
+                    'acquired': dict(self._acquired),
+                    'waiting': dict(self._waiting),
+                    'throttled': dict(self._throttled)}
+
+    def _refill(self):
+        # Has to be called with `_lock` held.
+        now = self.clock()
+
+        if self.rate is not None and now > self._updated:
+            self._tokens = min(self._tokens + (now - self._updated) * self.rate, self.burst)
+
+        self._updated = max(now, self._updated)
+
+    def _can_acquire(self, kind: str, cost: float) -> bool:
+        # Has to be called with `_lock` held.
+        if self.rate is None:
+            return True
+
+        # Requests of a higher priority which are waiting go first.
+        if any(self._waiting[other_kind] > 0 for other_kind in self.KINDS[:self.KINDS.index(kind)]):
+            return False
+
+        return self._tokens - cost >= self._reserve(kind)
+
+    def _available_time(self, kind: str, cost: float) -> float:
+        # Has to be called with `_lock` held.
+        missing = cost + self._reserve(kind) - self._tokens
+
+        if self.rate is None or missing <= 0:
+            return self._updated
+
+        return self._updated + missing / self.rate
+
+    def _reserve(self, kind: str) -> float:
+        return 0 if kind == self.CANCEL else self.cancel_reserve
+
+    def _take(self, kind: str, cost: float):
+        # Has to be called with `_lock` held.
+        if self.rate is not None:
+            self._tokens -= cost
+
+        self._acquired[kind] += 1
+
+
+def add_rate_limit_arguments(parser):
+    """Adds the arguments `create_rate_limit_governor()` reads to a keeper argument parser."""
+    parser.add_argument("--rate-limit", type=float,
+                        help="Maximum number of exchange API requests per second (default: unlimited)")
+
+    parser.add_argument("--rate-limit-burst", type=float,
+                        help="Maximum number of exchange API requests made at once (default: one second worth of requests)")
+
+    parser.add_argument("--rate-limit-cancel-reserve", type=float,
+                        help="Number of exchange API requests reserved for order cancellations (default: a fifth of the burst)")
+
+
+def create_rate_limit_governor(arguments) -> RateLimitGovernor:
+    # Keepers which do not call `add_rate_limit_arguments()` get a governor which does not limit anything.
+    return RateLimitGovernor(rate=getattr(arguments, 'rate_limit', None),
+                             burst=getattr(arguments, 'rate_limit_burst', None),
+                             cancel_reserve=getattr(arguments, 'rate_limit_cancel_reserve', None))
@@ -0,0 +1,235 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2020 MakerDAO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import threading
+import time
+from collections import deque
+
+from market_maker_keeper.rate_limit import RateLimitGovernor
+
+
+class AdaptiveRefreshScheduler:
+    """Decides when the order book should be refreshed next, adapting to what is going on.
+
+    While orders are being placed or cancelled, or the price keeps moving, refreshes happen every
+    `min_interval` seconds. Once nothing happens, the interval grows `backoff` times after each
+    refresh, up to `max_interval`. Independently of that, no more than `request_budget` requests
+    are made within any `budget_period` seconds. If the keeper keeps all its requests within the
+    exchange rate limit, refreshes also wait for the budget left by all other requests, see
+    `govern_requests_with()`.
+
+    Attributes:
+        min_interval: Interval (in seconds) between refreshes while there is some activity.
+        max_interval: Maximum interval (in seconds) between refreshes.
+        backoff: Factor the interval grows by after each refresh without activity.
+        request_budget: Maximum number of requests within `budget_period`, or `None` for unlimited.
+        budget_period: Period (in seconds) `request_budget` applies to.
+        price_function: The (optional) function returning the current `Price`, used to detect price moves.
+        price_tolerance: Relative price change which is not considered a price move.
+    """
+
+    logger = logging.getLogger()
+
+    def __init__(self,
+                 min_interval: float,
+                 max_interval: float,
+                 backoff: float = 2.0,
+                 request_budget: int = None,
+                 budget_period: float = 60.0,
+                 price_function=None,
+                 price_tolerance: float = 0.0,
+                 clock=time.time):
+        assert(isinstance(min_interval, (int, float)))
+        assert(isinstance(max_interval, (int, float)))
+        assert(0 < min_interval <= max_interval)
+        assert(isinstance(backoff, (int, float)))
+        assert(backoff >= 1)
+        assert(isinstance(request_budget, int) or request_budget is None)
+        assert(isinstance(budget_period, (int, float)))
+        assert(callable(price_function) or price_function is None)
+        assert(isinstance(price_tolerance, (int, float)))
+        assert(callable(clock))
+
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.request_budget = request_budget
+        self.budget_period = budget_period
+        self.price_function = price_function
+        self.price_tolerance = price_tolerance
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._interval = min_interval
+        self._last_refresh = None
+        self._last_price = None
+        self._requests = deque()
+        self.rate_limit_governor = None
+
+    def govern_requests_with(self, rate_limit_governor: RateLimitGovernor):
+        """Makes refreshes share the request budget of the governor all keeper requests go through.
+
+        Refreshes then only get scheduled once the governor would let a refresh request go ahead,
+        so they never compete with placements and cancellations for the same budget.
+
+        Args:
+            rate_limit_governor: A `RateLimitGovernor` instance, usually shared with the rest of the keeper.
+        """
+        assert(isinstance(rate_limit_governor, RateLimitGovernor))
+
+        self.rate_limit_governor = rate_limit_governor
+
+    def next_refresh_time(self, active: bool) -> float:
+        """Returns the time the next refresh should happen at.
+
+        Args:
+            active: `True` if orders are being placed or cancelled at the moment.
+        """
+        active = self._price_moved() or active
+
+        with self._lock:
+            if self._last_refresh is None:
+                refresh_time = self.clock()
+            else:
+                refresh_time = self._last_refresh + (self.min_interval if active else self._interval)
+
+            return max(refresh_time, self._budget_available_time())
+
+    def refreshed(self, active: bool):
+        """Records that the refresh has just taken place, adjusting the interval till the next one.
+
+        Args:
+            active: `True` if orders were being placed or cancelled, or got placed or cancelled
+                since the previous refresh.
+        """
+        active = self._price_moved(remember=True) or active
+
+        with self._lock:
+            self._last_refresh = self.clock()
+            self._interval = self.min_interval if active else min(self._interval * self.backoff, self.max_interval)
+
+    def request_available_time(self) -> float:
+        """Returns the earliest time a request can be made at without exceeding the budget."""
+        with self._lock:
+            return self._budget_available_time()
+
+    def record_request(self):
+        """Records that an exchange API request has been made, so it counts towards the budget."""
+        with self._lock:
+            self._requests.append(self.clock())
+            self._expire_requests()
+
+    def metrics(self) -> dict:
+        """Returns the current interval between refreshes, the request rate and the budget usage.
+
+        If refreshes share the budget of a `RateLimitGovernor`, the budget usage is the one of the governor.
+        """
+        with self._lock:
+            self._expire_requests()
+
+            if self.rate_limit_governor is not None and self.request_budget is None:
+                budget_usage = self.rate_limit_governor.metrics()['budget_usage']
+            else:
+                budget_usage = len(self._requests) / self.request_budget if self.request_budget else None
+
+            return {'interval': self._interval,
+                    'refresh_rate': 1 / self._interval,
+                    'requests': len(self._requests),
+                    'request_rate': len(self._requests) / self.budget_period,
+                    'request_budget': self.request_budget,
+                    'budget_usage': budget_usage}
+
+    def _budget_available_time(self) -> float:
+        # Has to be called with `_lock` held.
+        self._expire_requests()
+
+        if self.request_budget is None or len(self._requests) < self.request_budget:
+            available_time = self.clock()
+        else:
+            available_time = self._requests[len(self._requests) - self.request_budget] + self.budget_period
+
+        if self.rate_limit_governor is not None:
+            # The governor tells the time on its own clock, so we only take the delay from it.
+            delay = self.rate_limit_governor.available_time(RateLimitGovernor.REFRESH) - self.rate_limit_governor.clock()
+            available_time = max(available_time, self.clock() + delay)
+
+        return available_time
+
+    def _expire_requests(self):
+        # Has to be called with `_lock` held.
+        since = self.clock() - self.budget_period
+        while len(self._requests) > 0 and self._requests[0] <= since:
+            self._requests.popleft()
+
+    def _price_moved(self, remember: bool = False) -> bool:
+        if self.price_function is None:
+            return False
+
+        try:
+            price = self.price_function()
+            prices = (price.buy_price, price.sell_price)
+        except Exception as e:
+            self.logger.debug(f"Failed to get the price ({e})")
+            return False
+
+        with self._lock:
+            last_prices = self._last_price
+            if remember:
+                self._last_price = prices
+
+        if last_prices is None:
+            return False
+
+        return any(self._moved(last, current) for last, current in zip(last_prices, prices))
+
+    def _moved(self, last, current) -> bool:
+        if last is None or current is None:
+            return last is not current
+
+        return abs(float(current) - float(last)) > float(last) * self.price_tolerance
+
+
+def add_refresh_scheduler_arguments(parser):
+    """Adds the arguments configuring adaptive order book refreshes, see `create_refresh_scheduler()`."""
+    parser.add_argument("--refresh-max-interval", type=float,
+                        help="Maximum interval between order book refreshes while nothing happens (in seconds). If set,"
+                             " the order book gets refreshed every --refresh-frequency seconds while orders are being"
+                             " placed or cancelled or the price moves, and less and less often otherwise"
+                             " (default: always every --refresh-frequency seconds)")
+
+    parser.add_argument("--refresh-backoff", type=float, default=2.0,
+                        help="Factor the interval between order book refreshes grows by after each refresh"
+                             " without activity (default: 2.0)")
+
+    parser.add_argument("--refresh-price-tolerance", type=float, default=0.0,
+                        help="Relative price change which is not considered a price move by adaptive order book"
+                             " refreshes (default: 0.0)")
+
+
+def create_refresh_scheduler(arguments, price_feed=None):
+    """Returns the `AdaptiveRefreshScheduler` configured with `--refresh-max-interval`, or `None` if not configured."""
+    refresh_max_interval = getattr(arguments, 'refresh_max_interval', None)
+
+    if refresh_max_interval is None:
+        return None
+
+    return AdaptiveRefreshScheduler(min_interval=arguments.refresh_frequency,
+                                    max_interval=max(refresh_max_interval, arguments.refresh_frequency),
+                                    backoff=arguments.refresh_backoff,
+                                    price_function=price_feed.get_price if price_feed is not None else None,
+                                    price_tolerance=arguments.refresh_price_tolerance)
@@ -47,6 +47,7 @@ class ReloadableConfig(BaseReloadableConfig):
         super().__init__(filename)
 
         self._token_config_checksum = None
+        self._checksum_config = None
         self._imported_paths_to_mtimes = {}
         self._spread_feed = None
 
@@ -120,6 +121,14 @@ class ReloadableConfig(BaseReloadableConfig):
 
             return result
 
+    def config_checksum(self) -> Optional[int]:
+        """Returns the checksum of the configuration returned by the most recent `get_config()` call.
+
+        Returns:
+            Checksum of the evaluated configuration, or `None` if it has not been read yet.
+        """
+        return self._checksum_config
+
     def get_token_config(self):
         """Reads the JSON config file from disk and returns it as a Python object.
         Returns:
@@ -0,0 +1,163 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2020 MakerDAO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import threading
+import time
+
+from market_maker_keeper.tick_timer import TickTimer
+
+
+class SyncScheduler:
+    """Runs the keeper order synchronization as soon as anything it depends on changes.
+
+    Instead of synchronizing orders every second, the synchronization runs as soon as one of the sources
+    passed to `watch()` (price feed, spread feed, control feed, order book manager) signals a change.
+    Bursts of changes get coalesced: only one synchronization runs at a time, and all changes signalled
+    while it is running result in a single rerun once it finishes. Two synchronizations never start less
+    than `min_interval` seconds apart.
+
+    Sources which do not signal changes (i.e. polled price feeds) are covered by the heartbeat, which is
+    expected to be called periodically (usually by `Lifecycle.every()`) and requests a synchronization
+    each time. No synchronization runs before the first heartbeat, so nothing happens before the keeper
+    has started up. Heartbeats arriving while a synchronization is still running are overdue, and get
+    coalesced into the rerun like any other change.
+
+    Each synchronization is measured by `tick_timer`, which keeps rolling histograms of how long
+    synchronizations and their phases take, and warns if they take longer than `heartbeat_interval`.
+
+    Attributes:
+        sync_function: The function synchronizing orders, usually `synchronize_orders()` of the keeper.
+        min_interval: Minimum interval (in seconds) between two synchronizations.
+        heartbeat_interval: Interval (in seconds) `heartbeat()` gets called at.
+    """
+
+    logger = logging.getLogger()
+
+    def __init__(self, sync_function, min_interval: float = 0.1, heartbeat_interval: float = 1.0, clock=time.time):
+        assert(callable(sync_function))
+        assert(isinstance(min_interval, (int, float)))
+        assert(min_interval >= 0)
+        assert(isinstance(heartbeat_interval, (int, float)))
+        assert(callable(clock))
+
+        self.sync_function = sync_function
+        self.min_interval = min_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.tick_timer = TickTimer(interval=heartbeat_interval)
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        self._thread = None
+        self._pending = False
+        self._running = False
+        self._stopped = False
+        self._last_sync = None
+        self._triggers = 0
+        self._heartbeats = 0
+        self._overdue = 0
+        self._syncs = 0
+
+    def watch(self, *sources):
+        """Makes all changes signalled by `sources` trigger a synchronization.
+
+        Args:
+            sources: Objects with an `on_update()` method, like feeds, price feeds or the order book manager.
+        """
+        for source in sources:
+            try:
+                source.on_update(self.trigger)
+            except NotImplementedError:
+                self.logger.debug(f"{source} does not signal changes, relying on the heartbeat")
+
+    def trigger(self):
+        """Signals a change, requesting a synchronization. Can be called from any thread."""
+        with self._lock:
+            self._triggers += 1
+            self._pending = True
+            self._condition.notify_all()
+
+    def heartbeat(self):
+        """Requests a synchronization regardless of changes, starting the background thread the first time."""
+        with self._lock:
+            if self._stopped:
+                return
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._background_run, daemon=True)
+                self._thread.start()
+
+            self._heartbeats += 1
+            if self._running:
+                self._overdue += 1
+
+            self._pending = True
+            self._condition.notify_all()
+
+    def stop(self, timeout: float = None):
+        """Stops running synchronizations, waiting for the one currently running (if any) to finish.
+
+        Args:
+            timeout: Maximum time (in seconds) to wait for. If `None`, waits indefinitely.
+
+        Returns:
+            `True` if no synchronization is running anymore, `False` if the wait timed out.
+        """
+        with self._lock:
+            self._stopped = True
+            self._condition.notify_all()
+            return self._condition.wait_for(lambda: not self._running, timeout)
+
+    def metrics(self) -> dict:
+        """Returns the number of synchronizations run, of triggers and heartbeats coalesced into them,
+        of overdue heartbeats, and how long synchronizations take (see `TickTimer.metrics()`)."""
+        with self._lock:
+            return {'syncs': self._syncs,
+                    'triggers': self._triggers,
+                    'heartbeats': self._heartbeats,
+                    'overdue': self._overdue,
+                    'coalesced': max(self._triggers + self._heartbeats - self._syncs, 0),
+                    'ticks': self.tick_timer.metrics()}
+
+    def _background_run(self):
+        while True:
+            with self._lock:
+                self._condition.wait_for(lambda: self._pending or self._stopped)
+                if self._stopped:
+                    return
+
+                delay = self._last_sync + self.min_interval - self.clock() if self._last_sync is not None else 0
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+
+                # Changes signalled from now on will result in a rerun.
+                self._pending = False
+                self._running = True
+                self._last_sync = self.clock()
+
+            try:
+                with self.tick_timer.tick():
+                    self.sync_function()
+            except Exception as exception:
+                self.logger.exception(f"Failed to synchronize orders ({exception})")
+            finally:
+                with self._lock:
+                    self._running = False
+                    self._syncs += 1
+                    self._condition.notify_all()
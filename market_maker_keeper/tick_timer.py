@@ -0,0 +1,198 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2020 MakerDAO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+
+_current = threading.local()
+
+
+@contextmanager
+def sync_phase(name: str):
+    """Measures the duration of one phase of the order synchronization running in the current thread.
+
+    Does nothing unless called from within `TickTimer.tick()`, so it is safe to use in code which also
+    runs outside of the order synchronization. Nested phases of the same name only get measured once.
+    """
+    assert(isinstance(name, str))
+
+    durations = getattr(_current, 'durations', None)
+    if durations is None or name in _current.active:
+        yield
+        return
+
+    _current.active.add(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        durations[name] = durations.get(name, 0.0) + time.perf_counter() - start
+        _current.active.discard(name)
+
+
+def current_tick():
+    """Returns the object identifying the tick running in the current thread, or `None` outside of `TickTimer.tick()`."""
+    return getattr(_current, 'tick', None)
+
+
+def timed_phase(name: str):
+    """Decorator measuring every call of the decorated function as the given phase, see `sync_phase()`."""
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with sync_phase(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class RollingHistogram:
+    """Keeps the last `size` samples, so percentiles reflect recent behaviour only."""
+
+    def __init__(self, size: int):
+        assert(isinstance(size, int))
+        assert(size > 0)
+
+        self._samples = deque(maxlen=size)
+
+    def add(self, value: float):
+        self._samples.append(value)
+
+    def count(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, percentile: float):
+        """Returns the given percentile (between 0 and 100) of the samples, or `None` if there are none."""
+        assert(0 <= percentile <= 100)
+
+        if len(self._samples) == 0:
+            return None
+
+        return self._percentile(sorted(self._samples), percentile)
+
+    def metrics(self) -> dict:
+        if len(self._samples) == 0:
+            return {'count': 0}
+
+        samples = sorted(self._samples)
+        return {'count': len(samples),
+                'mean': sum(samples) / len(samples),
+                'p50': self._percentile(samples, 50),
+                'p90': self._percentile(samples, 90),
+                'p99': self._percentile(samples, 99),
+                'max': samples[-1]}
+
+    @staticmethod
+    def _percentile(sorted_samples: list, percentile: float) -> float:
+        return sorted_samples[min(int(len(sorted_samples) * percentile / 100), len(sorted_samples) - 1)]
+
+
+class TickTimer:
+    """Measures how long order synchronization ticks, and each of their phases, take.
+
+    Durations of the last `window` ticks are kept as rolling histograms, one for the whole tick (`TOTAL`)
+    and one for each phase measured with `sync_phase()`. Once the 99th percentile of the tick duration
+    exceeds `interval`, i.e. ticks regularly take longer than the keeper intends to run them at, a warning
+    gets logged, at most once every `warning_frequency` seconds.
+
+    Attributes:
+        interval: Interval (in seconds) ticks are expected to run at.
+        window: Number of most recent ticks the histograms are kept for.
+        warning_frequency: Minimum interval (in seconds) between two warnings.
+    """
+
+    TOTAL = 'total'
+    PHASES = ['bands', 'order_book', 'price', 'cancellable', 'new_orders', 'dispatch']
+
+    # Percentiles are not meaningful until there are enough samples.
+    MIN_SAMPLES = 20
+
+    logger = logging.getLogger()
+
+    def __init__(self, interval: float, window: int = 1000, warning_frequency: float = 60.0):
+        assert(isinstance(interval, (int, float)))
+        assert(interval > 0)
+        assert(isinstance(window, int))
+        assert(isinstance(warning_frequency, (int, float)))
+
+        self.interval = interval
+        self.window = window
+        self.warning_frequency = warning_frequency
+
+        self._lock = threading.Lock()
+        self._histograms = {name: RollingHistogram(window) for name in [self.TOTAL] + self.PHASES}
+        self._ticks = 0
+        self._overruns = 0
+        self._last_warning = None
+
+    @contextmanager
+    def tick(self):
+        """Measures the tick running within the context, and all phases measured within it."""
+        _current.durations = dict()
+        _current.active = set()
+        _current.tick = object()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            durations = _current.durations
+            _current.durations = None
+            _current.tick = None
+
+            self._record(duration, durations)
+
+    def metrics(self) -> dict:
+        """Returns the number of ticks and overruns, and duration percentiles of ticks and their phases."""
+        with self._lock:
+            return {'ticks': self._ticks,
+                    'overruns': self._overruns,
+                    'durations': {name: histogram.metrics() for name, histogram in self._histograms.items()}}
+
+    def _record(self, duration: float, durations: dict):
+        with self._lock:
+            self._ticks += 1
+            if duration > self.interval:
+                self._overruns += 1
+
+            self._histograms[self.TOTAL].add(duration)
+            for name, phase_duration in durations.items():
+                if name not in self._histograms:
+                    self._histograms[name] = RollingHistogram(self.window)
+
+                self._histograms[name].add(phase_duration)
+
+            histogram = self._histograms[self.TOTAL]
+            if histogram.count() < self.MIN_SAMPLES:
+                return
+
+            now = time.time()
+            if self._last_warning is not None and now - self._last_warning < self.warning_frequency:
+                return
+
+            p99 = histogram.percentile(99)
+            if p99 > self.interval:
+                self._last_warning = now
+                slowest = max(self.PHASES, key=lambda name: self._histograms[name].percentile(99) or 0.0)
+                self.logger.warning(f"Order synchronization takes too long (p99 {p99:.3f}s, interval {self.interval}s),"
+                                    f" the slowest phase being '{slowest}'")
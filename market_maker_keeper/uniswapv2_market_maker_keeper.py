@@ -27,11 +27,12 @@ from pymaker.model import Token, TokenConfig
 from pymaker import Address, get_pending_transactions, Wad, Receipt, web3_via_http
 from market_maker_keeper.control_feed import create_control_feed
 from market_maker_keeper.gas import add_gas_arguments, GasPriceFactory
-from market_maker_keeper.price_feed import PriceFeedFactory
+from market_maker_keeper.price_feed import PriceFeedFactory, add_price_feed_aggregation_arguments
 from market_maker_keeper.reloadable_config import ReloadableConfig
 from market_maker_keeper.spread_feed import create_spread_feed
 from market_maker_keeper.util import setup_logging
 from market_maker_keeper.staking_rewards_factory import StakingRewardsFactory, StakingRewardsName
+from market_maker_keeper.tick_timer import TickTimer
 
 
 class UniswapV2MarketMakerKeeper:
@@ -44,6 +45,9 @@ class UniswapV2MarketMakerKeeper:
 
     logger = logging.getLogger()
 
+    # Interval (in seconds) liquidity gets synchronized at.
+    LIQUIDITY_INTERVAL = 10
+
     def __init__(self, args: list, **kwargs):
         parser = argparse.ArgumentParser(prog='uniswap-market-maker-keeper')
 
@@ -74,6 +78,8 @@ class UniswapV2MarketMakerKeeper:
         parser.add_argument("--price-feed-expiry", type=int, default=86400,
                             help="Maximum age of the price feed (in seconds, default: 86400)")
 
+        add_price_feed_aggregation_arguments(parser)
+
         parser.add_argument("--max-add-liquidity-slippage", type=int, default=2,
                             help="Maximum percentage off the desired amount of liquidity to add in add_liquidity()")
 
@@ -177,11 +183,13 @@ class UniswapV2MarketMakerKeeper:
         self.accepted_price_slippage_down = Wad.from_number(self.arguments.accepted_price_slippage_down / 100)
         self.max_add_liquidity_slippage = Wad.from_number(self.arguments.max_add_liquidity_slippage / 100)
 
+        self.tick_timer = TickTimer(interval=self.LIQUIDITY_INTERVAL)
+
     def main(self):
         with Lifecycle(self.web3) as lifecycle:
             lifecycle.initial_delay(self.arguments.initial_delay)
             lifecycle.on_startup(self.startup)
-            lifecycle.every(10, self.place_liquidity)
+            lifecycle.every(self.LIQUIDITY_INTERVAL, self.synchronize_liquidity)
             lifecycle.on_shutdown(self.shutdown)
 
     def startup(self):
@@ -538,7 +546,8 @@ class UniswapV2MarketMakerKeeper:
         """
 
         if self.testing_feed_price is False:
-            feed_price = (self.price_feed.get_price().buy_price + self.price_feed.get_price().sell_price) / Wad.from_number(2)
+            price = self.price_feed.get_price()
+            feed_price = (price.buy_price + price.sell_price) / Wad.from_number(2)
         else:
             feed_price = self.test_price
 
@@ -604,6 +613,11 @@ class UniswapV2MarketMakerKeeper:
         else:
             return False, False
 
+    def synchronize_liquidity(self):
+        # Run as one tick, so the price feed gets read only once however many times the price is needed.
+        with self.tick_timer.tick():
+            self.place_liquidity()
+
     def place_liquidity(self) -> Optional[Wad]:
         """
         Main control function of Uniswap Keeper lifecycle.
@@ -26,10 +26,10 @@ from web3 import Web3, HTTPProvider
 from market_maker_keeper.band import Bands, NewOrder, BuyBand
 from market_maker_keeper.control_feed import create_control_feed
 from market_maker_keeper.gas import GasPriceFactory
-from market_maker_keeper.limit import History
+from market_maker_keeper.limit import create_history
 from market_maker_keeper.order_book import OrderBookManager
 from market_maker_keeper.order_history_reporter import create_order_history_reporter
-from market_maker_keeper.price_feed import PriceFeedFactory, Price
+from market_maker_keeper.price_feed import PriceFeedFactory, Price, add_price_feed_aggregation_arguments
 from market_maker_keeper.reloadable_config import ReloadableConfig
 from market_maker_keeper.spread_feed import create_spread_feed
 from market_maker_keeper.util import setup_logging
@@ -97,6 +97,8 @@ class ZrxMarketMakerKeeper:
         parser.add_argument("--price-feed-expiry", type=int, default=120,
                             help="Maximum age of the price feed (in seconds, default: 120)")
 
+        add_price_feed_aggregation_arguments(parser)
+
         parser.add_argument("--spread-feed", type=str,
                             help="Source of spread feed")
 
@@ -115,6 +117,9 @@ class ZrxMarketMakerKeeper:
         parser.add_argument("--order-history-every", type=int, default=30,
                             help="Frequency of reporting active orders (in seconds, default: 30)")
 
+        parser.add_argument("--trade-limit-journal", type=str,
+                            help="File to persist trade limit usage in, so limits survive keeper restarts")
+
         parser.add_argument("--order-expiry", type=int, required=True,
                             help="Expiration time of created orders (in seconds)")
 
@@ -164,7 +169,7 @@ class ZrxMarketMakerKeeper:
         self.control_feed = create_control_feed(self.arguments)
         self.order_history_reporter = create_order_history_reporter(self.arguments)
 
-        self.history = History()
+        self.history = create_history(self.arguments)
 
         # Delegate 0x specific init to a function to permit overload for 0xv2
         self.zrx_exchange = None
@@ -207,6 +212,7 @@ class ZrxMarketMakerKeeper:
 
     def shutdown(self):
         self.order_book_manager.cancel_all_orders(final_wait_time=60)
+        self.history.flush()
 
     def approve(self):
         token_buy = ERC20Token(web3=self.web3, address=Address(self.pair.buy_token_address))
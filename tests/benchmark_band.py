@@ -0,0 +1,90 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2020 MakerDAO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Microbenchmark of the band arithmetic, comparing `Wad` based calculations with the raw
+# fixed-point ones used by `market_maker_keeper.band`. Run with `python -m tests.benchmark_band`.
+
+import operator
+import timeit
+from functools import reduce
+
+from market_maker_keeper.band import Bands, BuyBand
+from pymaker.numeric import Wad
+from tests.test_band import FakeOrder
+
+
+class WadCounter:
+    """Counts `Wad` instances created while active."""
+
+    def __init__(self):
+        self.count = 0
+        self._original_init = Wad.__init__
+
+    def __enter__(self):
+        original_init = self._original_init
+
+        def counting_init(wad, value):
+            self.count += 1
+            original_init(wad, value)
+
+        Wad.__init__ = counting_init
+        return self
+
+    def __exit__(self, *args):
+        Wad.__init__ = self._original_init
+
+
+def legacy_apply_margin(price: Wad, margin: float) -> Wad:
+    return price * Wad.from_number(1 - margin)
+
+
+def legacy_includes(band: BuyBand, order, target_price: Wad) -> bool:
+    price = band.order_price(order)
+    price_min = legacy_apply_margin(target_price, band.min_margin)
+    price_max = legacy_apply_margin(target_price, band.max_margin)
+    return (price > price_max) and (price <= price_min)
+
+
+def legacy_total_amount(orders) -> Wad:
+    return reduce(operator.add, map(lambda order: order.remaining_sell_amount, orders), Wad(0))
+
+
+def measure(name: str, function, repeat: int):
+    with WadCounter() as counter:
+        function()
+
+    seconds = min(timeit.repeat(function, number=repeat, repeat=3)) / repeat
+    print(f"{name:<36} {seconds * 1000000:>10.1f} us/op {counter.count:>8} Wad(s)/op")
+
+
+def main():
+    band = BuyBand({"minMargin": 0.0123, "avgMargin": 0.0456, "maxMargin": 0.0789,
+                    "minAmount": 1.0, "avgAmount": 2.0, "maxAmount": 3.0, "dustCutoff": 0.0})
+    target_price = Wad.from_number(187.123456789)
+    orders = [FakeOrder(Wad.from_number(0.01 * (index + 1)), Wad.from_number(170 + index * 0.05), index)
+              for index in range(300)]
+
+    measure("avg price (Wad)", lambda: legacy_apply_margin(target_price, band.avg_margin), 10000)
+    measure("avg price (fixed-point)", lambda: band.avg_price(target_price), 10000)
+    measure("includes x300 (Wad)", lambda: [legacy_includes(band, order, target_price) for order in orders], 20)
+    measure("includes x300 (fixed-point)", lambda: [band.includes(order, target_price) for order in orders], 20)
+    measure("total amount x300 (Wad)", lambda: legacy_total_amount(orders), 200)
+    measure("total amount x300 (fixed-point)", lambda: Bands.total_amount(orders), 200)
+
+
+if __name__ == '__main__':
+    main()
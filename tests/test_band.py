@@ -15,7 +15,9 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from market_maker_keeper.band import Bands
+import os
+
+from market_maker_keeper.band import Bands, BuyBand
 from market_maker_keeper.feed import EmptyFeed, FixedFeed
 from market_maker_keeper.limit import History
 from market_maker_keeper.price_feed import Price
@@ -25,9 +27,10 @@ from pymaker.numeric import Wad
 
 
 class FakeOrder:
-    def __init__(self, amount: Wad, price: Wad):
+    def __init__(self, amount: Wad, price: Wad, order_id: int = 0):
         self.amount = amount
         self.price = price
+        self.order_id = order_id
 
     @property
     def sell_to_buy_price(self) -> Wad:
@@ -103,6 +106,36 @@ class TestBands:
         assert(new_orders[1].price == Wad.from_number(208))
         assert(new_orders[1].amount == Wad.from_number(7.5))
 
+    def test_new_orders_should_become_stale_once_outside_their_bands(self, tmpdir):
+        # given
+        config = BandConfig.sample_config(tmpdir)
+        bands = self.create_bands(config)
+        price = Price(buy_price=Wad.from_number(100), sell_price=Wad.from_number(200))
+        buy_order, sell_order = bands.new_orders([], [], Wad.from_number(1000000), Wad.from_number(1000000), price)[0]
+
+        # expect
+        assert(not buy_order.is_stale(price))
+        assert(not sell_order.is_stale(price))
+        assert(not buy_order.is_stale(Price(buy_price=Wad.from_number(101), sell_price=None)))
+        assert(buy_order.is_stale(Price(buy_price=Wad.from_number(103), sell_price=Wad.from_number(200))))
+        assert(buy_order.is_stale(Price(buy_price=None, sell_price=Wad.from_number(200))))
+        assert(sell_order.is_stale(Price(buy_price=Wad.from_number(100), sell_price=Wad.from_number(190))))
+        assert(sell_order.is_stale(Price(buy_price=Wad.from_number(100), sell_price=None)))
+
+    def test_new_orders_should_have_unique_client_order_ids(self, tmpdir):
+        # given
+        config = BandConfig.sample_config(tmpdir)
+        bands = self.create_bands(config)
+        price = Price(buy_price=Wad.from_number(100), sell_price=Wad.from_number(200))
+
+        # when
+        first_orders, _, _ = bands.new_orders([], [], Wad.from_number(1000000), Wad.from_number(1000000), price)
+        second_orders, _, _ = bands.new_orders([], [], Wad.from_number(1000000), Wad.from_number(1000000), price)
+
+        # then
+        client_order_ids = set(new_order.client_order_id for new_order in first_orders + second_orders)
+        assert(len(client_order_ids) == 4)
+
     def test_should_not_cancel_anything_if_no_orders_to_cancel_regardless_of_price_availability(self, tmpdir):
         # given
         config = BandConfig.sample_config(tmpdir)
@@ -165,6 +198,241 @@ class TestBands:
         # then
         assert(orders_to_cancel == [buy_order, sell_order])
 
+    def test_should_assign_orders_to_the_same_bands_as_band_includes(self, tmpdir):
+        # given
+        config = BandConfig.two_adjacent_buy_bands_config(tmpdir)
+        bands = self.create_bands(config)
+
+        # and
+        prices = [85, 90, 90.000001, 93.99, 94, 94.01, 97.5, 98, 98.000001, 99, 101, 102, 104, 106, 107, 108]
+        orders = [FakeOrder(Wad.from_number(1), Wad.from_number(price), index) for index, price in enumerate(prices)]
+        target_price = Wad.from_number(100)
+
+        for side_bands in [bands.buy_bands, bands.sell_bands]:
+            # when
+            membership = bands.band_membership(side_bands, orders, target_price)
+
+            # then
+            for index, band in enumerate(side_bands):
+                assert(membership.orders_in_band[index] == [order for order in orders if band.includes(order, target_price)])
+
+            assert(membership.orders_outside_bands == [order for order in orders
+                                                       if not any(band.includes(order, target_price) for band in side_bands)])
+
+    def test_should_reuse_band_membership_for_the_same_orders_and_price(self, tmpdir):
+        # given
+        config = BandConfig.two_adjacent_buy_bands_config(tmpdir)
+        bands = self.create_bands(config)
+
+        # and
+        orders = [FakeOrder(Wad.from_number(1), Wad.from_number(96), 1)]
+
+        # when
+        membership = bands.band_membership(bands.buy_bands, orders, Wad.from_number(100))
+
+        # then
+        assert(bands.band_membership(bands.buy_bands, list(orders), Wad.from_number(100)) is membership)
+        assert(bands.band_membership(bands.buy_bands, orders, Wad.from_number(101)) is not membership)
+        assert(bands.band_membership(bands.buy_bands, orders + [FakeOrder(Wad.from_number(1), Wad.from_number(92), 2)],
+                                     Wad.from_number(101)) is not membership)
+
+    def test_should_cancel_excessive_orders_and_orders_outside_bands(self, tmpdir):
+        # given
+        config = BandConfig.two_adjacent_buy_bands_config(tmpdir)
+        bands = self.create_bands(config)
+
+        # and
+        outside_order = FakeOrder(Wad.from_number(1), Wad.from_number(99), 1)
+        first_band_order_1 = FakeOrder(Wad.from_number(5), Wad.from_number(97), 2)
+        first_band_order_2 = FakeOrder(Wad.from_number(5), Wad.from_number(95), 3)
+        second_band_order = FakeOrder(Wad.from_number(9), Wad.from_number(92), 4)
+
+        # when
+        price = Price(buy_price=Wad.from_number(100), sell_price=Wad.from_number(100))
+        orders_to_cancel = bands.cancellable_orders([outside_order, first_band_order_1, first_band_order_2, second_band_order], [], price)
+
+        # then
+        assert(orders_to_cancel == [first_band_order_1, outside_order])
+
+    def test_should_only_top_up_bands_below_min_amount(self, tmpdir):
+        # given
+        config = BandConfig.two_adjacent_buy_bands_config(tmpdir)
+        bands = self.create_bands(config)
+
+        # and
+        first_band_order = FakeOrder(Wad.from_number(6), Wad.from_number(97), 1)
+
+        # when
+        price = Price(buy_price=Wad.from_number(100), sell_price=None)
+        new_orders, _, _ = bands.new_orders([first_band_order], [], Wad.from_number(1000000), Wad.from_number(1000000), price)
+
+        # then
+        assert(len(new_orders) == 1)
+        assert(new_orders[0].band == bands.buy_bands[1])
+        assert(new_orders[0].price == Wad.from_number(92))
+        assert(new_orders[0].pay_amount == Wad.from_number(9.5))
+
+    def test_should_reconcile_cancellations_and_placements_in_one_go(self, tmpdir):
+        # given
+        config = BandConfig.two_adjacent_buy_bands_config(tmpdir)
+        bands = self.create_bands(config)
+
+        # and
+        outside_order = FakeOrder(Wad.from_number(7), Wad.from_number(99), 1)
+        second_band_order = FakeOrder(Wad.from_number(9), Wad.from_number(92), 2)
+
+        # when
+        price = Price(buy_price=Wad.from_number(100), sell_price=None)
+        reconciliation = bands.reconcile([outside_order, second_band_order], [], Wad.from_number(1000000), Wad.from_number(1000000), price)
+
+        # then
+        assert(reconciliation.orders_to_cancel == [outside_order])
+        assert(len(reconciliation.orders_to_place) == 1)
+        assert(reconciliation.orders_to_place[0].band == bands.buy_bands[0])
+        assert(reconciliation.orders_to_place[0].price == Wad.from_number(96))
+        assert(reconciliation.orders_to_place[0].pay_amount == Wad.from_number(7.5))
+
+    def test_should_not_reconcile_placements_with_balance_freed_by_cancellations(self, tmpdir):
+        # given
+        config = BandConfig.two_adjacent_buy_bands_config(tmpdir)
+        bands = self.create_bands(config)
+
+        # and
+        outside_order = FakeOrder(Wad.from_number(7), Wad.from_number(99), 1)
+
+        # when
+        price = Price(buy_price=Wad.from_number(100), sell_price=None)
+        reconciliation = bands.reconcile([outside_order], [], Wad.from_number(8), Wad.from_number(0), price)
+
+        # then
+        assert(reconciliation.orders_to_cancel == [outside_order])
+        assert([new_order.pay_amount for new_order in reconciliation.orders_to_place] == [Wad.from_number(7.5), Wad.from_number(0.5)])
+        assert(reconciliation.missing_buy_amount == Wad.from_number(9))
+
+    def test_should_reconcile_with_amendments_if_asked_for(self, tmpdir):
+        # given
+        config = BandConfig.two_adjacent_buy_bands_config(tmpdir)
+        bands = self.create_bands(config)
+
+        # and
+        first_band_order = FakeOrder(Wad.from_number(6), Wad.from_number(97), 1)
+        outside_order_1 = FakeOrder(Wad.from_number(7), Wad.from_number(99), 2)
+        outside_order_2 = FakeOrder(Wad.from_number(7), Wad.from_number(88), 3)
+        order_bands = {2: bands.buy_bands[0], 3: bands.buy_bands[1]}
+
+        # when
+        price = Price(buy_price=Wad.from_number(100), sell_price=None)
+        reconciliation = bands.reconcile([first_band_order, outside_order_1, outside_order_2], [],
+                                         Wad.from_number(1000000), Wad.from_number(1000000), price,
+                                         order_band_function=lambda order: order_bands.get(order.order_id))
+
+        # then
+        assert(reconciliation.orders_to_cancel == [outside_order_1])
+        assert(reconciliation.orders_to_place == [])
+        assert(len(reconciliation.orders_to_amend) == 1)
+        assert(reconciliation.orders_to_amend[0][0] is outside_order_2)
+        assert(reconciliation.orders_to_amend[0][1].band == bands.buy_bands[1])
+
+    def test_should_not_amend_orders_into_a_different_band(self, tmpdir):
+        # given
+        config = BandConfig.two_adjacent_buy_bands_config(tmpdir)
+        bands = self.create_bands(config)
+
+        # and
+        first_band_order = FakeOrder(Wad.from_number(6), Wad.from_number(97), 1)
+        outside_order = FakeOrder(Wad.from_number(7), Wad.from_number(88), 2)
+        order_bands = {2: bands.buy_bands[0]}
+
+        # when
+        price = Price(buy_price=Wad.from_number(100), sell_price=None)
+        reconciliation = bands.reconcile([first_band_order, outside_order], [],
+                                         Wad.from_number(1000000), Wad.from_number(1000000), price,
+                                         order_band_function=lambda order: order_bands.get(order.order_id))
+
+        # then
+        assert(reconciliation.orders_to_cancel == [outside_order])
+        assert(reconciliation.orders_to_amend == [])
+        assert(len(reconciliation.orders_to_place) == 1)
+        assert(reconciliation.orders_to_place[0].band == bands.buy_bands[1])
+
+    def test_should_cancel_smallest_orders_in_the_middle_band_above_max_amount(self):
+        # given
+        band = BuyBand({"minMargin": 0.02, "avgMargin": 0.04, "maxMargin": 0.06,
+                        "minAmount": 5.0, "avgAmount": 7.5, "maxAmount": 10.0, "dustCutoff": 0.0})
+
+        # and
+        orders = [FakeOrder(Wad.from_number(0.01 * index), Wad.from_number(96), index) for index in range(1, 101)]
+
+        # when
+        orders_to_cancel = band.excessive_orders(orders, Wad.from_number(100), False, False)
+
+        # then
+        assert(orders_to_cancel == set(orders[:90]))
+
+    def test_should_not_cancel_anything_if_band_is_exactly_at_max_amount(self):
+        # given
+        band = BuyBand({"minMargin": 0.02, "avgMargin": 0.04, "maxMargin": 0.06,
+                        "minAmount": 5.0, "avgAmount": 7.5, "maxAmount": 10.0, "dustCutoff": 0.0})
+
+        # and
+        orders = [FakeOrder(Wad.from_number(2.5), Wad.from_number(96 + index * 0.1), index) for index in range(4)]
+
+        # expect
+        assert(band.excessive_orders(orders, Wad.from_number(100), True, False) == set())
+        assert(band.excessive_orders(orders + [FakeOrder(Wad.from_number(0.1), Wad.from_number(95), 4)],
+                                     Wad.from_number(100), True, False) == {orders[3]})
+
+    def test_should_reuse_compiled_bands_if_nothing_changed(self, tmpdir):
+        # given
+        config = ReloadableConfig(str(BandConfig.sample_config(tmpdir)))
+        control_feed = FixedFeed({'canBuy': True, 'canSell': True})
+        history = History()
+
+        # when
+        bands = Bands.read(config, EmptyFeed(), control_feed, history)
+
+        # then
+        assert(Bands.read(config, EmptyFeed(), control_feed, history) is bands)
+        assert(Bands.read(config, EmptyFeed(), control_feed, History()) is not bands)
+
+    def test_should_recompile_bands_if_control_feed_changes(self, tmpdir):
+        # given
+        config = ReloadableConfig(str(BandConfig.sample_config(tmpdir)))
+        history = History()
+        bands = Bands.read(config, EmptyFeed(), FixedFeed({'canBuy': True, 'canSell': True}), history)
+
+        # when
+        bands_no_buy = Bands.read(config, EmptyFeed(), FixedFeed({'canBuy': False, 'canSell': True}), history)
+
+        # then
+        assert(bands_no_buy is not bands)
+        assert(bands_no_buy.buy_bands == [])
+        assert(len(bands_no_buy.sell_bands) == 1)
+
+        # when
+        bands_expired = Bands.read(config, EmptyFeed(), FixedFeed({}), history)
+
+        # then
+        assert(bands_expired.buy_bands == [])
+        assert(bands_expired.sell_bands == [])
+
+    def test_should_recompile_bands_if_config_file_changes(self, tmpdir):
+        # given
+        config_file = BandConfig.sample_config(tmpdir)
+        config = ReloadableConfig(str(config_file))
+        control_feed = FixedFeed({'canBuy': True, 'canSell': True})
+        history = History()
+        bands = Bands.read(config, EmptyFeed(), control_feed, history)
+
+        # when
+        config_file.write(config_file.read().replace('"maxAmount": 100.0', '"maxAmount": 200.0'))
+        os.utime(str(config_file), (os.path.getmtime(str(config_file)) + 1, os.path.getmtime(str(config_file)) + 1))
+        new_bands = Bands.read(config, EmptyFeed(), control_feed, history)
+
+        # then
+        assert(new_bands is not bands)
+        assert(new_bands.buy_bands[0].max_amount == Wad.from_number(200))
+
     @staticmethod
     def create_bands(config_file):
         config = ReloadableConfig(str(config_file))
@@ -15,10 +15,165 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from market_maker_keeper.feed import EmptyFeed
+import threading
+import time
+
+import pytest
+
+from market_maker_keeper.feed import CoalescingFeed, EmptyFeed, FeedRegistry, WebSocketFeed
+from tests.test_order_book import wait_until
+from tests.websocket_server import FakeWebSocketServer
+
+
+@pytest.fixture
+def server():
+    server = FakeWebSocketServer()
+    yield server
+    server.stop()
 
 
 class TestEmptyFeed:
     def test_is_always_empty(self):
         # expect
         assert EmptyFeed().get() == ({}, 0.0)
+
+
+class TestWebSocketFeed:
+    def connected_feed(self, server: FakeWebSocketServer, **kwargs) -> WebSocketFeed:
+        feed = WebSocketFeed(f"ws://user:pass@localhost:{server.port}/", 1, **kwargs)
+        wait_until(lambda: feed.connection.connected)
+        return feed
+
+    def test_should_parse_every_message_if_subscribed_to_all_updates(self, server):
+        # given
+        feed = self.connected_feed(server)
+        feed.on_update(lambda: None)
+
+        # when
+        server.send({'data': {'price': '125.5'}, 'timestamp': 1000})
+        server.send({'invalid': True})
+
+        # then
+        wait_until(lambda: feed.metrics()['received'] == 2)
+        assert feed.get() == ({'price': '125.5'}, 1000.0)
+        assert feed.metrics() == {'received': 2, 'invalid': 1, 'dropped': 0, 'coalesced': 0}
+
+    def test_should_only_parse_newest_message_when_coalescing(self, server):
+        # given
+        feed = self.connected_feed(server, notify_interval=0.5)
+        feed.on_update(lambda: None, coalesce=True)
+
+        # when
+        server.send({'invalid': True})
+        for sequence in range(100):
+            server.send({'data': {'sequence': sequence}, 'timestamp': 1000 + sequence})
+
+        # then
+        wait_until(lambda: feed.get() == ({'sequence': 99}, 1099.0))
+        assert feed.metrics()['received'] == 101
+        assert feed.metrics()['invalid'] == 0
+        assert feed.metrics()['dropped'] == 100
+
+    def test_should_parse_newest_message_without_subscribers(self, server):
+        # given
+        feed = self.connected_feed(server)
+
+        # when
+        server.send({'data': {'price': '125.5'}, 'timestamp': 1000})
+
+        # then
+        wait_until(lambda: feed.get() == ({'price': '125.5'}, 1000.0))
+        assert feed.metrics() == {'received': 1, 'invalid': 0, 'dropped': 0, 'coalesced': 0}
+
+    def test_should_coalesce_notifications_of_bursts(self, server):
+        # given
+        feed = self.connected_feed(server, notify_interval=0.2)
+        notifications = []
+        feed.on_update(lambda: notifications.append(feed.get()), coalesce=True)
+
+        # when
+        for sequence in range(50):
+            server.send({'data': {'sequence': sequence}, 'timestamp': 1000})
+
+        # then
+        wait_until(lambda: feed.metrics()['received'] == 50)
+        wait_until(lambda: len(notifications) > 0 and notifications[-1][0] == {'sequence': 49})
+        assert len(notifications) + feed.metrics()['coalesced'] == 50
+        assert len(notifications) < 5
+
+
+class TestFeedRegistry:
+    def test_should_normalize_urls(self):
+        assert FeedRegistry.normalize_url("WS://user:pass@LocalHost:80/api/feed/") == "ws://user:pass@localhost/api/feed"
+        assert FeedRegistry.normalize_url("wss://host:443/feed?x=1") == "wss://host/feed?x=1"
+        assert FeedRegistry.normalize_url("ws://host:9595/feed") == "ws://host:9595/feed"
+        assert FeedRegistry.normalize_url("ws://user:pass@host/") != FeedRegistry.normalize_url("ws://other:pass@host/")
+
+    def test_should_create_each_feed_once(self):
+        # given
+        registry = FeedRegistry()
+        created = []
+
+        # when
+        feeds = [registry.get(('gdax', 'ETH-USD'), lambda: created.append(1) or object()) for _ in range(3)]
+
+        # then
+        assert len(created) == 1
+        assert feeds[0] is feeds[1] is feeds[2]
+        assert registry.size() == 1
+
+    def test_should_share_web_socket_connections(self, server):
+        # given
+        registry = FeedRegistry()
+        url = f"ws://user:pass@localhost:{server.port}"
+
+        # when
+        first_feed = registry.web_socket_feed(url, 1)
+        second_feed = registry.web_socket_feed(url.replace("localhost", "LOCALHOST") + "/", 1)
+
+        # then
+        assert first_feed is second_feed
+        wait_until(lambda: server.client_count() == 1)
+        time.sleep(0.1)
+        assert server.connections == 1
+
+    def test_should_notify_all_subscribers(self, server):
+        # given
+        feed = FeedRegistry().web_socket_feed(f"ws://user:pass@localhost:{server.port}/", 1)
+        first_updates = threading.Event()
+        second_updates = threading.Event()
+        feed.on_update(first_updates.set)
+        feed.on_update(second_updates.set)
+        wait_until(lambda: server.client_count() == 1)
+
+        # when
+        server.send({'data': {'price': '125.5'}, 'timestamp': 1000})
+
+        # then
+        assert first_updates.wait(5)
+        assert second_updates.wait(5)
+        assert feed.get() == ({'price': '125.5'}, 1000.0)
+
+    def test_should_share_web_socket_connection_between_coalescing_and_other_subscribers(self, server):
+        # given
+        registry = FeedRegistry()
+        url = f"ws://user:pass@localhost:{server.port}/"
+        all_updates = []
+        coalesced_updates = []
+
+        # when
+        feed = registry.web_socket_feed(url, 1)
+        feed.on_update(lambda: all_updates.append(feed.get()))
+        CoalescingFeed(registry.web_socket_feed(url, 1)).on_update(lambda: coalesced_updates.append(feed.get()))
+        wait_until(lambda: server.client_count() == 1)
+
+        for sequence in range(20):
+            server.send({'data': {'sequence': sequence}, 'timestamp': 1000})
+
+        # then
+        wait_until(lambda: len(all_updates) == 20)
+        wait_until(lambda: len(coalesced_updates) > 0 and coalesced_updates[-1][0] == {'sequence': 19})
+        assert len(coalesced_updates) < 20
+        assert feed.metrics()['dropped'] == 0
+        assert registry.size() == 1
+        assert server.connections == 1
@@ -0,0 +1,115 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2020 MakerDAO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import threading
+import time
+
+import pytest
+
+from market_maker_keeper.feed import WebSocketFeed
+from market_maker_keeper.feed_engine import FeedEngine
+from tests.test_order_book import wait_until
+from tests.websocket_server import FakeWebSocketServer
+
+
+def measure_visible_latency(server: FakeWebSocketServer, feed, count: int) -> list:
+    """Returns how long (in seconds) each of `count` messages sent by `server` took to become visible in `feed`."""
+    latencies = []
+    for sequence in range(count):
+        start = time.perf_counter()
+        server.send({'data': {'sequence': sequence}, 'timestamp': time.time()})
+        wait_until(lambda: feed.get()[0].get('sequence') == sequence, timeout=5)
+        latencies.append(time.perf_counter() - start)
+
+    return latencies
+
+
+class TestFeedEngine:
+    @pytest.fixture
+    def server(self):
+        server = FakeWebSocketServer()
+        yield server
+        server.stop()
+
+    @pytest.fixture
+    def engine(self):
+        return FeedEngine()
+
+    def url(self, server: FakeWebSocketServer) -> str:
+        return f"ws://user:pass@localhost:{server.port}/"
+
+    def test_should_host_all_connections_on_one_thread(self, server, engine):
+        # given
+        threads_before = set(threading.enumerate())
+
+        # when
+        feeds = [WebSocketFeed(self.url(server), 1, engine=engine) for _ in range(3)]
+
+        # then
+        wait_until(lambda: server.client_count() == 3)
+        wait_until(lambda: all(feed.connection.connected for feed in feeds))
+
+        # and
+        # (threads named `feed-engine-resolver_*` resolve host names, shared by all connections)
+        threads_started = [thread for thread in threading.enumerate() if thread not in threads_before]
+        assert [thread.name for thread in threads_started if not thread.name.startswith('feed-engine-resolver')] == ['feed-engine']
+
+    def test_should_send_messages_after_connecting(self, server, engine):
+        # when
+        engine.connect(self.url(server), lambda message: None,
+                       on_open=lambda connection: connection.send(json.dumps({'subscribe': 'prices'})))
+
+        # then
+        wait_until(lambda: server.received == [{'subscribe': 'prices'}])
+
+    def test_should_reconnect(self, server, engine):
+        # given
+        feed = WebSocketFeed(self.url(server), 1, engine=engine)
+        wait_until(lambda: feed.connection.connected)
+
+        # when
+        server.disconnect_all()
+
+        # then
+        wait_until(lambda: not feed.connection.connected)
+        wait_until(lambda: feed.connection.connected and feed.connection.connections == 2)
+
+    def test_should_stop_reconnecting_once_closed(self, server, engine):
+        # given
+        connection = engine.connect(self.url(server), lambda message: None, reconnect_delay=0.1)
+        wait_until(lambda: connection.connected)
+
+        # when
+        connection.close()
+
+        # then
+        wait_until(lambda: not connection.connected)
+        time.sleep(0.3)
+        assert server.connections == 1
+
+    def test_should_make_messages_visible_quickly(self, server, engine):
+        # given
+        feed = WebSocketFeed(self.url(server), 1, engine=engine)
+        wait_until(lambda: feed.connection.connected)
+
+        # when
+        latencies = sorted(measure_visible_latency(server, feed, 100))
+
+        # then
+        assert latencies[len(latencies) // 2] < 0.05
+        assert latencies[-1] < 0.5
@@ -0,0 +1,91 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2020 MakerDAO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import random
+
+from market_maker_keeper.band import BuyBand, SellBand
+from market_maker_keeper.fixed_point import wad_mul, wad_sum, raw
+from pymaker.numeric import Wad
+
+
+class TestFixedPoint:
+    def test_wad_mul_should_match_wad_multiplication(self):
+        # given
+        generator = random.Random(1518440700)
+
+        for _ in range(10000):
+            x = generator.randint(-10**generator.randint(0, 30), 10**generator.randint(0, 30))
+            y = generator.randint(-10**generator.randint(0, 30), 10**generator.randint(0, 30))
+
+            # expect
+            assert wad_mul(x, y) == (Wad(x) * Wad(y)).value
+
+    def test_wad_mul_should_match_wad_multiplication_for_prices_and_margins(self):
+        # given
+        generator = random.Random(1518440700)
+
+        for _ in range(10000):
+            price = Wad.from_number(round(generator.uniform(0.0001, 100000), generator.randint(0, 12)))
+            margin = Wad.from_number(1 - round(generator.uniform(-0.5, 0.5), generator.randint(1, 8)))
+
+            # expect
+            assert wad_mul(price.value, margin.value) == (price * margin).value
+
+    def test_wad_sum_should_match_wad_addition(self):
+        # given
+        amounts = [Wad.from_number(0.1), Wad.from_number(7.25), Wad(1), Wad.from_number(-3)]
+
+        # expect
+        assert Wad(wad_sum(amount.value for amount in amounts)) == amounts[0] + amounts[1] + amounts[2] + amounts[3]
+        assert wad_sum([]) == 0
+
+    def test_raw_should_match_wad_from_number(self):
+        # expect
+        assert raw(0.98) == Wad.from_number(0.98).value
+        assert raw(1 + 0.04) == Wad.from_number(1 + 0.04).value
+        assert raw(100) == Wad.from_number(100).value
+
+
+class TestBandArithmetic:
+    band = {"minMargin": 0.0123, "avgMargin": 0.0456, "maxMargin": 0.0789,
+            "minAmount": 1.0, "avgAmount": 2.0, "maxAmount": 3.0, "dustCutoff": 0.0}
+
+    def test_buy_band_prices_should_match_apply_margin(self):
+        # given
+        band = BuyBand(self.band)
+        generator = random.Random(1518440700)
+
+        for _ in range(1000):
+            target_price = Wad.from_number(round(generator.uniform(0.0001, 100000), generator.randint(0, 12)))
+
+            # expect
+            assert band.avg_price(target_price) == band._apply_margin(target_price, band.avg_margin)
+            assert band.price_range(target_price) == (band._apply_margin(target_price, band.max_margin),
+                                                      band._apply_margin(target_price, band.min_margin))
+
+    def test_sell_band_prices_should_match_apply_margin(self):
+        # given
+        band = SellBand(self.band)
+        generator = random.Random(1518440700)
+
+        for _ in range(1000):
+            target_price = Wad.from_number(round(generator.uniform(0.0001, 100000), generator.randint(0, 12)))
+
+            # expect
+            assert band.avg_price(target_price) == band._apply_margin(target_price, band.avg_margin)
+            assert band.price_range(target_price) == (band._apply_margin(target_price, band.min_margin),
+                                                      band._apply_margin(target_price, band.max_margin))
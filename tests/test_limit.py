@@ -15,9 +15,12 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import threading
+import time
+
 import pytest
 
-from market_maker_keeper.limit import SideLimits, SideHistory
+from market_maker_keeper.limit import SideLimits, SideHistory, History, LimitJournal
 from pymaker.numeric import Wad
 
 
@@ -113,3 +116,130 @@ class TestLimits:
         assert sample_limits.available_limit(self.time_zero + 60*60*7) == Wad.from_number(0)
         assert sample_limits.available_limit(self.time_zero + 60*60*8) == Wad.from_number(0)
         assert sample_limits.available_limit(self.time_zero + 60*60*9) == Wad.from_number(0)
+
+    def test_limit_handles_items_added_out_of_order(self, sample_limits):
+        # when
+        sample_limits.use_limit(self.time_zero + 10, Wad.from_number(10))
+        sample_limits.use_limit(self.time_zero, Wad.from_number(5))
+        # then
+        assert sample_limits.available_limit(self.time_zero) == Wad.from_number(95)
+        assert sample_limits.available_limit(self.time_zero + 10) == Wad.from_number(85)
+        assert sample_limits.available_limit(self.time_zero + 60*60) == Wad.from_number(90)
+        assert sample_limits.available_limit(self.time_zero + 60*60 + 10) == Wad.from_number(100)
+
+    def test_history_only_keeps_items_within_the_longest_period(self, sample_limits):
+        # when
+        for hour in range(24 * 30):
+            sample_limits.use_limit(self.time_zero + hour * 60*60, Wad.from_number(1))
+            sample_limits.available_limit(self.time_zero + hour * 60*60)
+
+        # then
+        assert len(sample_limits.side_history.get_items()) <= 2 * 24
+        assert sample_limits.available_limit(self.time_zero + (24 * 30 - 1) * 60*60) == Wad.from_number(99)
+        assert sample_limits.available_limit(self.time_zero + 24 * 30 * 60*60) == Wad.from_number(100)
+
+    def test_history_without_limits_only_keeps_items_within_default_retention(self, no_limits):
+        # when
+        for hour in range(24 * 30):
+            no_limits.use_limit(self.time_zero + hour * 60*60, Wad.from_number(1))
+
+        # then
+        assert len(no_limits.side_history.get_items()) <= 2 * SideHistory.DEFAULT_RETENTION // (60*60)
+        assert no_limits.side_history.get_items()[-1] == {'timestamp': self.time_zero + (24 * 30 - 1) * 60*60,
+                                                           'amount': Wad.from_number(1)}
+
+    def test_limit_can_be_used_from_multiple_threads(self, sample_limits):
+        # given
+        def use_limit():
+            for _ in range(100):
+                sample_limits.use_limit(self.time_zero, Wad.from_number(0.01))
+
+        threads = [threading.Thread(target=use_limit) for _ in range(5)]
+
+        # when
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # then
+        assert sample_limits.available_limit(self.time_zero) == Wad.from_number(95)
+
+
+class TestLimitJournal:
+    @staticmethod
+    def limits(history: SideHistory):
+        return SideLimits([{'amount': 100, 'period': '1h'},
+                           {'amount': 500, 'period': '1d'}], history)
+
+    def test_limits_survive_restart(self, tmpdir):
+        # given
+        journal_file = str(tmpdir.join('journal'))
+        now = int(time.time())
+        history = History(journal_file)
+        self.limits(history.buy_history).use_limit(now - 2*60*60, Wad.from_number(7))
+        self.limits(history.buy_history).use_limit(now - 10, Wad.from_number(10))
+        self.limits(history.sell_history).use_limit(now - 10, Wad.from_number(3))
+        history.flush()
+
+        # when
+        restarted = History(journal_file)
+        buy_limits = self.limits(restarted.buy_history)
+        sell_limits = self.limits(restarted.sell_history)
+
+        # then
+        assert buy_limits.available_limit(now) == Wad.from_number(90)
+        assert sell_limits.available_limit(now) == Wad.from_number(97)
+        assert [item['amount'] for item in restarted.buy_history.get_items()] == [Wad.from_number(7), Wad.from_number(10)]
+
+    def test_replay_skips_records_older_than_the_longest_period(self, tmpdir):
+        # given
+        journal_file = str(tmpdir.join('journal'))
+        now = int(time.time())
+        history = History(journal_file)
+        for days in [3, 2, 1]:
+            history.buy_history.add_item({'timestamp': now - days*24*60*60 - 60, 'amount': Wad.from_number(1)})
+        history.buy_history.add_item({'timestamp': now - 60, 'amount': Wad.from_number(2)})
+        history.journal.flush()
+
+        # when
+        restarted = History(journal_file)
+        self.limits(restarted.buy_history)
+
+        # then
+        assert restarted.buy_history.get_items() == [{'timestamp': now - 60, 'amount': Wad.from_number(2)}]
+
+    def test_replay_merges_with_items_added_after_restart(self, tmpdir):
+        # given
+        journal_file = str(tmpdir.join('journal'))
+        now = int(time.time())
+        history = History(journal_file)
+        history.buy_history.add_item({'timestamp': now - 30, 'amount': Wad.from_number(5)})
+        history.journal.flush()
+
+        # when
+        restarted = History(journal_file)
+        restarted.buy_history.add_item({'timestamp': now - 20, 'amount': Wad.from_number(6)})
+        limits = self.limits(restarted.buy_history)
+
+        # then
+        assert limits.available_limit(now) == Wad.from_number(89)
+
+    def test_incomplete_record_is_discarded(self, tmpdir):
+        # given
+        journal_file = str(tmpdir.join('journal'))
+        now = int(time.time())
+        history = History(journal_file)
+        history.sell_history.add_item({'timestamp': now - 10, 'amount': Wad.from_number(4)})
+        history.journal.flush()
+
+        with open(journal_file, 'ab') as file:
+            file.write(b'\x01\x02\x03')
+
+        # when
+        journal = LimitJournal(journal_file)
+
+        # then
+        assert tmpdir.join('journal').size() == 41
+        assert journal.replay(LimitJournal.SELL, now - 60) == [(now - 10, Wad.from_number(4).value)]
+        assert journal.replay(LimitJournal.BUY, now - 60) == []
@@ -0,0 +1,714 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2020 MakerDAO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+
+import pytest
+
+from market_maker_keeper.order_book import OrderBookManager
+from market_maker_keeper.order_stream import OrderEvent
+from pymaker.numeric import Wad
+
+
+class FakeOrder:
+    def __init__(self, order_id):
+        self.order_id = order_id
+
+    def __repr__(self):
+        return f"FakeOrder({self.order_id})"
+
+
+class FakeNewOrder(FakeOrder):
+    def __init__(self, order_id, is_sell: bool, amount: int, band=None):
+        super().__init__(order_id)
+        self.is_sell = is_sell
+        self.pay_amount = Wad.from_number(amount)
+        self.remaining_sell_amount = Wad.from_number(amount)
+        self.band = band
+
+
+class FakeExchange:
+    def __init__(self, orders: list):
+        self.orders = list(orders)
+        self.operations = []
+        self.cancel_event = threading.Event()
+        self.cancel_event.set()
+
+    def get_orders(self):
+        return list(self.orders)
+
+    def place_order(self, order):
+        self.operations.append(('place', order.order_id))
+        self.orders.append(order)
+        return order
+
+    def cancel_order(self, order):
+        self.cancel_event.wait()
+        self.operations.append(('cancel', order.order_id))
+        self.orders.remove(order)
+        return True
+
+
+class FakeBatchExchange(FakeExchange):
+    def __init__(self, orders: list):
+        super().__init__(orders)
+        self.batches = []
+
+    def place_orders(self, new_orders: list):
+        self.batches.append(('place', [order.order_id for order in new_orders]))
+        # odd order ids get rejected
+        placed_orders = [order if order.order_id % 2 == 0 else None for order in new_orders]
+        self.orders.extend(order for order in placed_orders if order is not None)
+        return placed_orders
+
+    def cancel_orders(self, orders: list):
+        self.batches.append(('cancel', [order.order_id for order in orders]))
+        if any(order.order_id == 13 for order in orders):
+            raise Exception("Batch rejected")
+
+        # order 2 can not be cancelled
+        results = [order.order_id != 2 for order in orders]
+        for order, result in zip(orders, results):
+            if result:
+                self.orders.remove(order)
+        return results
+
+
+class FakeAmendExchange(FakeExchange):
+    def __init__(self, orders: list):
+        super().__init__(orders)
+        self.next_order_id = 10
+
+    def amend_order(self, order, new_order):
+        self.operations.append(('amend', order.order_id))
+        # orders 2 can only be amended by replacing them, orders 3 can not be amended at all
+        if order.order_id == 3:
+            return None
+
+        amended_order = FakeNewOrder(order.order_id if order.order_id != 2 else self.next_order_id,
+                                     new_order.is_sell, int(new_order.pay_amount))
+        self.orders[self.orders.index(order)] = amended_order
+        return amended_order
+
+
+class FakeClientOrder(FakeOrder):
+    def __init__(self, order_id, client_order_id: str):
+        super().__init__(order_id)
+        self.client_order_id = client_order_id
+
+
+class FakeTimeoutExchange(FakeExchange):
+    def place_order(self, order):
+        self.operations.append(('place', order.order_id))
+        # placements of orders with odd ids time out after succeeding, all other placements time out before
+        if order.order_id % 2 == 1:
+            self.orders.append(order)
+
+        raise TimeoutError("Request timed out")
+
+
+def wait_until(condition, timeout: float = 5.0):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+class TestOrderBookManager:
+    @pytest.fixture
+    def exchange(self):
+        return FakeExchange([FakeOrder(1), FakeOrder(2)])
+
+    @pytest.fixture
+    def manager(self, exchange):
+        manager = OrderBookManager(refresh_frequency=1)
+        manager.get_orders_with(exchange.get_orders)
+        manager.place_orders_with(exchange.place_order)
+        manager.cancel_orders_with(exchange.cancel_order)
+        manager.start()
+        manager.get_order_book()
+        return manager
+
+    @staticmethod
+    def order_ids(manager: OrderBookManager) -> list:
+        return [order.order_id for order in manager.get_order_book().orders]
+
+    def test_should_return_orders_fetched(self, manager):
+        assert self.order_ids(manager) == [1, 2]
+
+    def test_should_return_the_same_snapshot_until_state_changes(self, manager):
+        # when
+        order_book = manager.get_order_book()
+
+        # then
+        assert manager.get_order_book() is order_book
+
+        # when
+        manager.place_orders([FakeOrder(3)])
+        manager.wait_for_stable_order_book()
+
+        # then
+        assert manager.get_order_book() is not order_book
+        assert self.order_ids(manager) == [1, 2, 3]
+
+    def test_should_not_modify_previous_snapshots(self, manager):
+        # given
+        order_book = manager.get_order_book()
+
+        # when
+        manager.place_orders([FakeOrder(3)])
+        manager.wait_for_stable_order_book()
+
+        # then
+        assert [order.order_id for order in order_book.orders] == [1, 2]
+
+    def test_should_remove_orders_being_cancelled(self, manager, exchange):
+        # given
+        exchange.cancel_event.clear()
+
+        # when
+        manager.cancel_orders([exchange.orders[0]])
+
+        # then
+        order_book = manager.get_order_book()
+        assert [order.order_id for order in order_book.orders] == [2]
+        assert order_book.orders_being_cancelled
+
+        # when
+        exchange.cancel_event.set()
+        manager.wait_for_stable_order_book()
+
+        # then
+        assert self.order_ids(manager) == [2]
+        assert not manager.get_order_book().orders_being_cancelled
+
+    def test_should_not_duplicate_placed_orders_after_refresh(self, manager, exchange):
+        # given
+        manager.place_orders([FakeOrder(3), FakeOrder(4)])
+        manager.wait_for_stable_order_book()
+
+        # when
+        manager.wait_for_order_book_refresh()
+
+        # then
+        assert self.order_ids(manager) == [1, 2, 3, 4]
+
+    def test_should_rebuild_snapshot_after_refresh(self, manager, exchange):
+        # given
+        order_book = manager.get_order_book()
+
+        # when
+        exchange.orders.append(FakeOrder(5))
+        wait_until(lambda: manager.get_order_book() is not order_book)
+
+        # then
+        assert self.order_ids(manager) == [1, 2, 5]
+
+    def test_should_wait_for_cancellation_without_polling(self, manager, exchange):
+        # given
+        exchange.cancel_event.clear()
+        manager.cancel_orders([exchange.orders[0]])
+
+        # expect
+        assert not manager.wait_for_order_cancellation(timeout=0.05)
+        assert not manager.wait_for_stable_order_book(timeout=0.05)
+
+        # when
+        threading.Timer(0.05, exchange.cancel_event.set).start()
+
+        # then
+        assert manager.wait_for_order_cancellation(timeout=5)
+        assert manager.wait_for_stable_order_book(timeout=5)
+        assert self.order_ids(manager) == [2]
+
+    def test_should_time_out_waiting_for_refresh(self, manager):
+        # expect
+        assert not manager.wait_for_order_book_refresh(timeout=0.05)
+        assert manager.wait_for_order_book_refresh(timeout=5)
+
+    def test_should_return_immediately_if_order_book_is_stable(self, manager):
+        # given
+        started = time.time()
+
+        # expect
+        assert manager.wait_for_stable_order_book()
+        assert manager.wait_for_order_cancellation()
+        assert time.time() - started < 0.5
+
+    def test_should_keep_order_events_applied_during_refresh(self, manager, exchange):
+        # given
+        fetching, fetched = threading.Event(), threading.Event()
+
+        def slow_get_orders():
+            orders = exchange.get_orders()
+            fetching.set()
+            fetched.wait()
+            return orders
+
+        manager.get_orders_with(slow_get_orders)
+        manager.refresh()
+        assert fetching.wait(5)
+
+        # the refresh in progress can not complete until `fetched` is set
+        refresh_waiter = threading.Thread(target=manager.wait_for_order_book_refresh)
+        refresh_waiter.start()
+        time.sleep(0.1)
+
+        # when
+        manager.apply_order_events([OrderEvent.cancelled(1), OrderEvent.placed(FakeOrder(3))])
+        fetched.set()
+        refresh_waiter.join()
+
+        # then
+        assert self.order_ids(manager) == [2, 3]
+
+        # when
+        manager.wait_for_order_book_refresh()
+
+        # then
+        assert self.order_ids(manager) == [1, 2]
+
+
+class FakeBalances:
+    def __init__(self):
+        self.count = 0
+        self.event = threading.Event()
+        self.event.set()
+
+    def get_balances(self):
+        self.event.wait()
+        self.count += 1
+        return {'DAI': self.count}
+
+
+class TestOrderBookManagerBalances:
+    @pytest.fixture
+    def exchange(self):
+        return FakeExchange([FakeOrder(1), FakeOrder(2)])
+
+    @pytest.fixture
+    def balances(self):
+        return FakeBalances()
+
+    @pytest.fixture
+    def manager(self, exchange, balances):
+        manager = OrderBookManager(refresh_frequency=1)
+        manager.get_orders_with(exchange.get_orders)
+        manager.get_balances_with(balances.get_balances, refresh_frequency=60)
+        manager.place_orders_with(exchange.place_order)
+        manager.cancel_orders_with(exchange.cancel_order)
+        manager.start()
+        manager.get_order_book()
+        return manager
+
+    def test_should_include_balances_and_timestamps(self, manager):
+        # when
+        order_book = manager.get_order_book()
+
+        # then
+        assert order_book.balances == {'DAI': 1}
+        assert time.time() - order_book.orders_timestamp < 5
+        assert time.time() - order_book.balances_timestamp < 5
+
+    def test_should_refresh_orders_while_balances_are_being_fetched(self, manager, balances):
+        # given
+        balances.event.clear()
+        manager.refresh_balances()
+        orders_timestamp = manager.get_order_book().orders_timestamp
+
+        # when
+        manager.wait_for_order_book_refresh()
+
+        # then
+        assert manager.get_order_book().orders_timestamp > orders_timestamp
+        assert manager.get_order_book().balances == {'DAI': 1}
+
+        # when
+        balances.event.set()
+
+        # then
+        wait_until(lambda: manager.get_order_book().balances == {'DAI': 2})
+
+    def test_should_refresh_balances_less_frequently(self, manager, balances):
+        # when
+        manager.wait_for_order_book_refresh()
+        manager.wait_for_order_book_refresh()
+
+        # then
+        assert balances.count == 1
+
+    def test_should_refresh_balances_after_placement(self, manager, balances):
+        # when
+        manager.place_orders([FakeOrder(3)])
+
+        # then
+        wait_until(lambda: manager.get_order_book().balances == {'DAI': 2})
+
+    def test_should_refresh_balances_after_order_disappears(self, manager, exchange, balances):
+        # when
+        exchange.orders.pop(0)
+
+        # then
+        wait_until(lambda: manager.get_order_book().balances == {'DAI': 2})
+
+    def test_should_not_refresh_balances_after_cancellation(self, manager, exchange, balances):
+        # when
+        manager.cancel_orders([exchange.orders[0]])
+        manager.wait_for_stable_order_book()
+        manager.wait_for_order_book_refresh()
+        manager.wait_for_order_book_refresh()
+
+        # then
+        assert balances.count == 1
+
+
+class TestOrderBookManagerBalanceTracking:
+    @pytest.fixture
+    def exchange(self):
+        return FakeExchange([FakeNewOrder(1, is_sell=False, amount=5), FakeNewOrder(2, is_sell=True, amount=1)])
+
+    @pytest.fixture
+    def balances(self):
+        return FakeBalances()
+
+    @pytest.fixture
+    def manager(self, exchange, balances):
+        manager = OrderBookManager(refresh_frequency=1)
+        manager.get_orders_with(exchange.get_orders)
+        manager.get_balances_with(balances.get_balances, refresh_frequency=60)
+        manager.place_orders_with(exchange.place_order)
+        manager.cancel_orders_with(exchange.cancel_order)
+        manager.track_balances_with('DAI', 'ETH')
+        manager.start()
+        manager.get_order_book()
+        return manager
+
+    def test_should_reserve_balance_until_balances_refreshed(self, manager, balances):
+        # given
+        balances.event.clear()
+
+        # when
+        manager.place_orders([FakeNewOrder(3, is_sell=True, amount=2), FakeNewOrder(4, is_sell=False, amount=10)])
+        manager.wait_for_stable_order_book()
+
+        # then
+        assert manager.get_order_book().balance_adjustment('ETH') == Wad.from_number(-2)
+        assert manager.get_order_book().balance_adjustment('DAI') == Wad.from_number(-10)
+        assert manager.get_order_book().balance_adjustment('MKR') == Wad(0)
+
+        # when
+        balances.event.set()
+
+        # then
+        wait_until(lambda: manager.get_order_book().balances == {'DAI': 2})
+        assert manager.get_order_book().balance_adjustments == {}
+
+    def test_should_release_reservation_if_placement_fails(self, manager):
+        # when
+        manager.place_order(lambda: None, FakeNewOrder(3, is_sell=True, amount=2))
+        manager.wait_for_stable_order_book()
+
+        # then
+        assert manager.get_order_book().balance_adjustments == {}
+
+    def test_should_release_balance_of_cancelled_orders(self, manager, exchange, balances):
+        # when
+        manager.cancel_orders(list(exchange.orders))
+        manager.wait_for_stable_order_book()
+
+        # then
+        assert manager.get_order_book().balance_adjustment('DAI') == Wad.from_number(5)
+        assert manager.get_order_book().balance_adjustment('ETH') == Wad.from_number(1)
+
+        # when
+        manager.refresh_balances()
+
+        # then
+        wait_until(lambda: manager.get_order_book().balances == {'DAI': 2})
+        assert manager.get_order_book().balance_adjustments == {}
+
+    def test_should_reconcile_with_pushed_balances(self, manager, exchange):
+        # given
+        manager.cancel_orders([exchange.orders[0]])
+        manager.wait_for_stable_order_book()
+
+        # when
+        manager.apply_order_events([OrderEvent.balances_changed({'DAI': 10})])
+
+        # then
+        assert manager.get_order_book().balances == {'DAI': 10}
+        assert manager.get_order_book().balance_adjustments == {}
+
+
+class TestOrderBookManagerAmendments:
+    @pytest.fixture
+    def exchange(self):
+        return FakeAmendExchange([FakeNewOrder(1, is_sell=False, amount=5),
+                                  FakeNewOrder(2, is_sell=False, amount=5),
+                                  FakeNewOrder(3, is_sell=True, amount=1)])
+
+    @pytest.fixture
+    def manager(self, exchange):
+        manager = OrderBookManager(refresh_frequency=1)
+        manager.get_orders_with(exchange.get_orders)
+        manager.place_orders_with(exchange.place_order)
+        manager.cancel_orders_with(exchange.cancel_order)
+        manager.amend_orders_with(exchange.amend_order)
+        manager.start()
+        manager.get_order_book()
+        return manager
+
+    @staticmethod
+    def order_ids(manager: OrderBookManager) -> list:
+        return [order.order_id for order in manager.get_order_book().orders]
+
+    def test_should_keep_amended_orders_in_place(self, manager, exchange):
+        # given
+        order = manager.get_order_book().orders[0]
+
+        # when
+        manager.amend_orders([(order, FakeNewOrder(None, is_sell=False, amount=7))])
+        manager.wait_for_stable_order_book()
+
+        # then
+        assert exchange.operations == [('amend', 1)]
+        assert self.order_ids(manager) == [1, 2, 3]
+        assert manager.get_order_book().orders[0].pay_amount == Wad.from_number(7)
+
+    def test_should_replace_orders_amended_with_a_new_id(self, manager, exchange):
+        # when
+        manager.amend_orders([(manager.get_order_book().orders[1], FakeNewOrder(None, is_sell=False, amount=7))])
+        manager.wait_for_stable_order_book()
+
+        # then
+        assert self.order_ids(manager) == [1, 3, 10]
+
+        # when
+        manager.wait_for_order_book_refresh()
+
+        # then
+        assert self.order_ids(manager) == [1, 10, 3]
+
+    def test_should_keep_orders_if_amendment_fails(self, manager, exchange):
+        # when
+        manager.amend_orders([(manager.get_order_book().orders[2], FakeNewOrder(None, is_sell=True, amount=7))])
+        manager.wait_for_stable_order_book()
+
+        # then
+        assert exchange.operations == [('amend', 3)]
+        assert self.order_ids(manager) == [1, 2, 3]
+
+    def test_should_amend_orders_in_the_same_band_when_replacing(self, manager, exchange):
+        # given
+        band, other_band = object(), object()
+        manager.place_orders([FakeNewOrder(4, is_sell=False, amount=5, band=band),
+                              FakeNewOrder(5, is_sell=False, amount=5, band=other_band)])
+        manager.wait_for_stable_order_book()
+        orders = manager.get_order_book().orders
+        exchange.operations = []
+
+        # expect
+        assert manager.order_band(orders[3]) is band
+        assert manager.order_band(orders[0]) is None
+
+        # when
+        manager.replace_orders([orders[0], orders[3], orders[4]], [FakeNewOrder(6, is_sell=False, amount=7, band=band)])
+        manager.wait_for_stable_order_book()
+
+        # then
+        assert sorted(exchange.operations) == [('amend', 4), ('cancel', 1), ('cancel', 5)]
+        assert self.order_ids(manager) == [2, 3, 4]
+
+
+class TestOrderBookManagerUncertainPlacements:
+    @pytest.fixture
+    def exchange(self):
+        return FakeTimeoutExchange([FakeClientOrder(1, 'one')])
+
+    @pytest.fixture
+    def manager(self, exchange):
+        manager = OrderBookManager(refresh_frequency=1)
+        manager.get_orders_with(exchange.get_orders)
+        manager.place_orders_with(exchange.place_order)
+        manager.cancel_orders_with(exchange.cancel_order)
+        manager.resolve_placements_with(lambda order: order.client_order_id, max_refreshes=2)
+        manager.start()
+        manager.get_order_book()
+        return manager
+
+    @staticmethod
+    def order_ids(manager: OrderBookManager) -> list:
+        return [order.order_id for order in manager.get_order_book().orders]
+
+    def test_should_keep_uncertain_placements_in_flight(self, manager, exchange):
+        # when
+        manager.place_orders([FakeClientOrder(2, 'two')])
+
+        # then
+        wait_until(lambda: manager.executor_metrics()['placements_uncertain'] == 1)
+        assert manager.get_order_book().orders_being_placed
+
+    def test_should_resolve_placements_which_succeeded(self, manager, exchange):
+        # when
+        manager.place_orders([FakeClientOrder(3, 'three')])
+        manager.wait_for_stable_order_book()
+
+        # then
+        assert self.order_ids(manager) == [1, 3]
+        assert manager.executor_metrics()['placements_uncertain'] == 0
+
+    def test_should_resolve_placements_which_failed(self, manager, exchange):
+        # when
+        manager.place_orders([FakeClientOrder(2, 'two')])
+        manager.wait_for_stable_order_book()
+
+        # then
+        assert self.order_ids(manager) == [1]
+        assert manager.executor_metrics()['placements_uncertain'] == 0
+
+    def test_should_not_place_orders_being_placed_again(self, manager, exchange):
+        # given
+        new_order = FakeClientOrder(3, 'three')
+        manager.place_orders([new_order])
+        wait_until(lambda: manager.executor_metrics()['placements_uncertain'] == 1)
+
+        # when
+        manager.place_orders([new_order])
+        manager.wait_for_stable_order_book()
+
+        # then
+        assert exchange.operations == [('place', 3)]
+        assert self.order_ids(manager) == [1, 3]
+
+
+class TestOrderBookManagerPriorities:
+    @pytest.fixture
+    def exchange(self):
+        return FakeExchange([FakeOrder(1), FakeOrder(2)])
+
+    @pytest.fixture
+    def manager(self, exchange):
+        manager = OrderBookManager(refresh_frequency=1, max_workers=1)
+        manager.get_orders_with(exchange.get_orders)
+        manager.place_orders_with(exchange.place_order)
+        manager.cancel_orders_with(exchange.cancel_order)
+        manager.start()
+        manager.get_order_book()
+        return manager
+
+    def test_should_run_cancellations_before_queued_placements(self, manager, exchange):
+        # given
+        exchange.cancel_event.clear()
+        manager.cancel_orders([exchange.orders[0]])
+        wait_until(lambda: manager.executor_metrics()['running'] == 1)
+
+        # when
+        manager.place_orders([FakeOrder(3), FakeOrder(4)])
+        manager.cancel_orders([exchange.orders[1]])
+
+        # then
+        metrics = manager.executor_metrics()
+        assert metrics['cancellations_queued'] == 1
+        assert metrics['placements_queued'] == 2
+        assert metrics['max_queued'] == 3
+        assert metrics['workers'] == 1
+
+        # when
+        exchange.cancel_event.set()
+        manager.wait_for_stable_order_book()
+
+        # then
+        assert exchange.operations == [('cancel', 1), ('cancel', 2), ('place', 3), ('place', 4)]
+        assert manager.executor_metrics()['placements_queued'] == 0
+
+    def test_should_drop_stale_placements(self, manager, exchange):
+        # given
+        manager.drop_stale_placements_with(lambda new_order: new_order.order_id == 4)
+
+        # when
+        manager.place_orders([FakeOrder(3), FakeOrder(4)])
+        manager.place_order(lambda: exchange.place_order(FakeOrder(5)), FakeOrder(5))
+        manager.wait_for_stable_order_book()
+
+        # then
+        assert exchange.operations == [('place', 3), ('place', 5)]
+        assert [order.order_id for order in manager.get_order_book().orders] == [1, 2, 3, 5]
+        assert manager.executor_metrics()['placements_dropped'] == 1
+        assert not manager.get_order_book().orders_being_placed
+
+
+class TestOrderBookManagerBatches:
+    @pytest.fixture
+    def exchange(self):
+        return FakeBatchExchange([FakeOrder(order_id) for order_id in range(1, 6)])
+
+    @pytest.fixture
+    def manager(self, exchange):
+        manager = OrderBookManager(refresh_frequency=1)
+        manager.get_orders_with(exchange.get_orders)
+        manager.place_orders_batch_with(exchange.place_orders, 2)
+        manager.cancel_orders_batch_with(exchange.cancel_orders, 3)
+        manager.start()
+        manager.get_order_book()
+        return manager
+
+    @staticmethod
+    def order_ids(manager: OrderBookManager) -> list:
+        return sorted(order.order_id for order in manager.get_order_book().orders)
+
+    def test_should_place_orders_in_batches(self, manager, exchange):
+        # when
+        manager.place_orders([FakeOrder(order_id) for order_id in range(6, 11)])
+        manager.wait_for_stable_order_book()
+
+        # then
+        assert sorted(exchange.batches) == [('place', [6, 7]), ('place', [8, 9]), ('place', [10])]
+        assert self.order_ids(manager) == [1, 2, 3, 4, 5, 6, 8, 10]
+        assert not manager.get_order_book().orders_being_placed
+
+    def test_should_cancel_orders_in_batches(self, manager, exchange):
+        # when
+        manager.cancel_orders(list(manager.get_order_book().orders))
+        manager.wait_for_stable_order_book()
+
+        # then
+        assert sorted(exchange.batches) == [('cancel', [1, 2, 3]), ('cancel', [4, 5])]
+        assert self.order_ids(manager) == [2]
+
+    def test_should_keep_orders_if_batch_fails(self, manager, exchange):
+        # given
+        exchange.orders.append(FakeOrder(13))
+        manager.wait_for_order_book_refresh()
+
+        # when
+        manager.cancel_orders([order for order in manager.get_order_book().orders if order.order_id in [5, 13]])
+
+        manager.wait_for_stable_order_book()
+
+        # then
+        assert exchange.batches == [('cancel', [5, 13])]
+        assert self.order_ids(manager) == [1, 2, 3, 4, 5, 13]
+
+    def test_should_replace_orders_in_batches(self, manager, exchange):
+        # when
+        manager.replace_orders([manager.get_order_book().orders[0]], [FakeOrder(6)])
+        manager.wait_for_stable_order_book()
+
+        # then
+        assert sorted(exchange.batches) == [('cancel', [1]), ('place', [6])]
+        assert self.order_ids(manager) == [2, 3, 4, 5, 6]
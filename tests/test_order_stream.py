@@ -0,0 +1,142 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2020 MakerDAO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+
+import pytest
+
+from market_maker_keeper.order_book import OrderBookManager
+from market_maker_keeper.order_stream import OrderEvent, WebSocketOrderStream
+from tests.test_order_book import FakeExchange, FakeOrder, wait_until
+from tests.websocket_server import FakeWebSocketServer
+
+
+class FakeFilledOrder(FakeOrder):
+    def __init__(self, order_id, remaining_amount):
+        super().__init__(order_id)
+        self.remaining_amount = remaining_amount
+
+
+def parse_message(message: dict) -> list:
+    if message['type'] == 'placed':
+        return [OrderEvent.placed(FakeOrder(message['id']))]
+    elif message['type'] == 'filled':
+        remaining_order = FakeFilledOrder(message['id'], message['remaining']) if message['remaining'] > 0 else None
+        return [OrderEvent.filled(message['id'], remaining_order)]
+    elif message['type'] == 'cancelled':
+        return [OrderEvent.cancelled(message['id'])]
+    elif message['type'] == 'balances':
+        return [OrderEvent.balances_changed(message['balances'])]
+    else:
+        return []
+
+
+class CountingExchange(FakeExchange):
+    def __init__(self, orders: list):
+        super().__init__(orders)
+        self.balances = {'DAI': 0}
+        self.get_orders_count = 0
+
+    def get_orders(self):
+        self.get_orders_count += 1
+        return super().get_orders()
+
+
+class TestWebSocketOrderStream:
+    @pytest.fixture
+    def server(self):
+        server = FakeWebSocketServer()
+        yield server
+        server.stop()
+
+    @pytest.fixture
+    def exchange(self):
+        return CountingExchange([FakeOrder(1), FakeOrder(2)])
+
+    @pytest.fixture
+    def stream(self, server):
+        return WebSocketOrderStream(server.url, parse_message,
+                                    subscribe_messages_function=lambda: [{'subscribe': 'orders'}],
+                                    reconnect_delay=1)
+
+    @pytest.fixture
+    def manager(self, exchange, stream, server):
+        manager = OrderBookManager(refresh_frequency=1)
+        manager.get_orders_with(exchange.get_orders)
+        manager.get_balances_with(lambda: dict(exchange.balances))
+        manager.stream_orders_with(stream, reconciliation_frequency=60)
+        manager.start()
+        manager.get_order_book()
+        wait_until(lambda: stream.connected and exchange.get_orders_count == 2)
+        return manager
+
+    @staticmethod
+    def order_ids(manager: OrderBookManager) -> list:
+        return [order.order_id for order in manager.get_order_book().orders]
+
+    def test_should_subscribe_after_connecting(self, manager, server):
+        wait_until(lambda: server.received == [{'subscribe': 'orders'}])
+
+    def test_should_apply_pushed_changes(self, manager, exchange, server):
+        # when
+        exchange.balances = {'DAI': 15}
+        server.send({'type': 'placed', 'id': 3})
+        server.send({'type': 'filled', 'id': 2, 'remaining': 0.5})
+        server.send({'type': 'cancelled', 'id': 1})
+        server.send({'type': 'balances', 'balances': {'DAI': 15}})
+
+        # then
+        wait_until(lambda: manager.get_order_book().balances == {'DAI': 15})
+        assert self.order_ids(manager) == [2, 3]
+        assert manager.get_order_book().orders[0].remaining_amount == 0.5
+
+        # when
+        server.send({'type': 'filled', 'id': 3, 'remaining': 0})
+
+        # then
+        wait_until(lambda: self.order_ids(manager) == [2])
+
+    def test_should_ignore_invalid_messages(self, manager, server):
+        # when
+        server.send({'unknown': 'message'})
+        server.send({'type': 'cancelled', 'id': 1})
+
+        # then
+        wait_until(lambda: self.order_ids(manager) == [2])
+
+    def test_should_only_reconcile_while_connected(self, manager, exchange):
+        # given
+        count = exchange.get_orders_count
+
+        # when
+        time.sleep(1.5)
+
+        # then
+        assert exchange.get_orders_count == count
+
+    def test_should_fall_back_to_polling_when_disconnected(self, manager, exchange, server, stream):
+        # given
+        count = exchange.get_orders_count
+
+        # when
+        server.disconnect_all()
+
+        # then
+        wait_until(lambda: exchange.get_orders_count > count)
+
+        # and
+        wait_until(lambda: server.connections == 2 and stream.connected)
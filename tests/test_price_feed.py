@@ -15,14 +15,18 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import argparse
+import threading
 import time
 from typing import Optional
 from typing import Tuple
 
 from market_maker_keeper.feed import Feed
 from market_maker_keeper.price_feed import PriceFeed, BackupPriceFeed, AveragePriceFeed, Price, WebSocketPriceFeed, \
-    ReversePriceFeed
+    ReversePriceFeed, AggregatePriceFeed, SnapshotPriceFeed, PriceFeedFactory, add_price_feed_aggregation_arguments
+from market_maker_keeper.tick_timer import TickTimer
 from pymaker.numeric import Wad
+from tests.test_order_book import wait_until
 
 
 class FakeFeed(Feed):
@@ -45,6 +49,35 @@ class FakePriceFeed(PriceFeed):
         self.price = price
 
 
+class CountingPriceFeed(FakePriceFeed):
+    def __init__(self):
+        super().__init__()
+        self.reads = 0
+
+    def get_price(self) -> Price:
+        self.reads += 1
+        return super().get_price()
+
+
+class SlowPriceFeed(FakePriceFeed):
+    def __init__(self, price: Wad, delay: float):
+        super().__init__()
+        self.price = price
+        self.delay = delay
+
+    def get_price(self) -> Price:
+        time.sleep(self.delay)
+        return super().get_price()
+
+
+def fake_price_feeds(*prices) -> list:
+    price_feeds = [FakePriceFeed() for _ in prices]
+    for price_feed, price in zip(price_feeds, prices):
+        price_feed.set_price(Wad.from_number(price) if price is not None else None)
+
+    return price_feeds
+
+
 class TestWebSocketPriceFeed:
     def test_should_handle_no_price(self):
         # when
@@ -223,3 +256,131 @@ class TestBackupPriceFeed:
         # then
         assert backup_price_feed.get_price().buy_price is None
         assert backup_price_feed.get_price().sell_price is None
+
+
+class TestAggregatePriceFeed:
+    def test_should_aggregate_prices(self):
+        # given
+        price_feeds = fake_price_feeds(10, 12, None, 11, 100)
+
+        # expect
+        assert AggregatePriceFeed(price_feeds, aggregation='first').get_price().buy_price == Wad.from_number(10)
+        assert AggregatePriceFeed(price_feeds, aggregation='mean').get_price().buy_price == Wad.from_number(33.25)
+        assert AggregatePriceFeed(price_feeds, aggregation='median').get_price().buy_price == Wad.from_number(11.5)
+        assert AggregatePriceFeed(price_feeds, aggregation='trimmed-mean').get_price().sell_price == Wad.from_number(11.5)
+
+    def test_should_reject_outliers(self):
+        # given
+        price_feeds = fake_price_feeds(10, 11, 12, 100)
+
+        # expect
+        assert AggregatePriceFeed(price_feeds, aggregation='mean', max_deviation=0.2).get_price().buy_price == Wad.from_number(11)
+        assert AggregatePriceFeed(price_feeds[2:], aggregation='mean', max_deviation=0.2).get_price().buy_price is None
+
+    def test_should_handle_no_values(self):
+        # given
+        price_feed = AggregatePriceFeed(fake_price_feeds(None, None))
+
+        # expect
+        assert price_feed.get_price().buy_price is None
+        assert price_feed.get_price().sell_price is None
+
+    def test_should_not_wait_for_slow_feeds(self):
+        # given
+        price_feeds = [SlowPriceFeed(Wad.from_number(10), 1.0)] + fake_price_feeds(20)
+
+        # when
+        start = time.time()
+        price_feed = AggregatePriceFeed(price_feeds, aggregation='first', deadline=0.1)
+
+        # then
+        assert price_feed.get_price().buy_price == Wad.from_number(20)
+        assert time.time() - start < 0.5
+
+        # and
+        wait_until(lambda: price_feed.get_price().buy_price == Wad.from_number(10))
+        assert price_feed.metrics()['late'] == 1
+
+    def test_should_follow_price_changes(self):
+        # given
+        price_feeds = fake_price_feeds(10, 20)
+        price_feed = AggregatePriceFeed(price_feeds, aggregation='mean', interval=0.05)
+        updates = []
+        price_feed.on_update(lambda: updates.append(price_feed.get_price().buy_price))
+        assert price_feed.get_price().buy_price == Wad.from_number(15)
+
+        # when
+        price_feeds[1].set_price(Wad.from_number(30))
+
+        # then
+        wait_until(lambda: price_feed.get_price().buy_price == Wad.from_number(20))
+        assert updates[-1] == Wad.from_number(20)
+
+    def test_should_reuse_reader_threads(self):
+        # given
+        threads_before = set(threading.enumerate())
+        price_feed = AggregatePriceFeed(fake_price_feeds(10, 20, 30), aggregation='mean', interval=0.01)
+
+        # when
+        wait_until(lambda: price_feed.metrics()['reads'] >= 30)
+
+        # then
+        threads_started = [thread for thread in threading.enumerate() if thread not in threads_before]
+        assert sorted(thread.name for thread in threads_started if thread.name.startswith('aggregate-price-feed')) \
+               == ['aggregate-price-feed-reader'] * 3
+
+    def test_should_be_created_with_max_deviation(self):
+        # given
+        parser = argparse.ArgumentParser()
+        parser.add_argument("--price-feed", type=str)
+        parser.add_argument("--price-feed-expiry", type=int, default=120)
+        add_price_feed_aggregation_arguments(parser)
+
+        # when
+        arguments = parser.parse_args(['--price-feed', 'fixed:10,fixed:11,fixed:100',
+                                       '--price-feed-aggregation', 'mean', '--price-feed-max-deviation', '0.2'])
+        price_feed = PriceFeedFactory().create_price_feed(arguments)
+
+        # then
+        assert price_feed.get_price().buy_price == Wad.from_number(10.5)
+
+
+class TestSnapshotPriceFeed:
+    def test_should_read_parent_feed_once_per_tick(self):
+        # given
+        parent_feed = CountingPriceFeed()
+        parent_feed.set_price(Wad.from_number(10))
+        price_feed = SnapshotPriceFeed(parent_feed)
+        timer = TickTimer(interval=1)
+
+        # when
+        with timer.tick():
+            first_price = price_feed.get_price()
+            parent_feed.set_price(Wad.from_number(20))
+            second_price = price_feed.get_price()
+
+        # then
+        assert first_price is second_price
+        assert second_price.buy_price == Wad.from_number(10)
+        assert parent_feed.reads == 1
+
+        # when
+        with timer.tick():
+            price = price_feed.get_price()
+
+        # then
+        assert price.buy_price == Wad.from_number(20)
+        assert parent_feed.reads == 2
+
+    def test_should_always_read_parent_feed_outside_of_ticks(self):
+        # given
+        parent_feed = CountingPriceFeed()
+        price_feed = SnapshotPriceFeed(parent_feed)
+
+        # when
+        price_feed.get_price()
+        parent_feed.set_price(Wad.from_number(20))
+
+        # then
+        assert price_feed.get_price().buy_price == Wad.from_number(20)
+        assert parent_feed.reads == 2
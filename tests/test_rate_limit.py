@@ -0,0 +1,206 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2020 MakerDAO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+from argparse import ArgumentParser, Namespace
+
+import pytest
+
+from market_maker_keeper.order_book import OrderBookManager, PriorityExecutor
+from market_maker_keeper.rate_limit import RateLimitGovernor, add_rate_limit_arguments, create_rate_limit_governor
+from tests.test_order_book import FakeExchange, FakeOrder, wait_until
+from tests.test_refresh_scheduler import FakeClock
+
+
+class TestRateLimitGovernor:
+    @pytest.fixture
+    def clock(self):
+        return FakeClock()
+
+    @pytest.fixture
+    def governor(self, clock):
+        return RateLimitGovernor(rate=2, burst=5, cancel_reserve=2, clock=clock)
+
+    def test_should_not_limit_anything_if_no_rate_configured(self):
+        # given
+        governor = RateLimitGovernor()
+
+        # expect
+        assert all(governor.try_acquire(RateLimitGovernor.REFRESH) for _ in range(100))
+        assert governor.metrics()['tokens'] is None
+        assert governor.metrics()['acquired'][RateLimitGovernor.REFRESH] == 100
+
+    def test_should_refill_tokens_over_time(self, governor, clock):
+        # given
+        assert all(governor.try_acquire(RateLimitGovernor.REFRESH) for _ in range(3))
+
+        # expect
+        assert not governor.try_acquire(RateLimitGovernor.REFRESH)
+        assert governor.available_time(RateLimitGovernor.REFRESH) == 1000.5
+
+        # when
+        clock.now += 0.5
+
+        # then
+        assert governor.try_acquire(RateLimitGovernor.REFRESH)
+        assert not governor.try_acquire(RateLimitGovernor.REFRESH)
+
+    def test_should_reserve_budget_for_cancellations(self, governor):
+        # given
+        assert all(governor.try_acquire(RateLimitGovernor.PLACE) for _ in range(3))
+
+        # expect
+        assert not governor.try_acquire(RateLimitGovernor.PLACE)
+        assert governor.try_acquire(RateLimitGovernor.CANCEL)
+        assert governor.try_acquire(RateLimitGovernor.CANCEL)
+        assert not governor.try_acquire(RateLimitGovernor.CANCEL)
+
+        # and
+        assert governor.metrics()['tokens'] == 0
+        assert governor.metrics()['budget_usage'] == 1.0
+        assert governor.metrics()['acquired'] == {'cancel': 2, 'place': 3, 'refresh': 0}
+
+    def test_should_not_exceed_burst(self, governor, clock):
+        # when
+        clock.now += 60
+
+        # then
+        assert governor.metrics()['tokens'] == 5
+
+    def test_should_defer_refreshes_while_placements_are_waiting(self, governor, clock):
+        # given
+        assert all(governor.try_acquire(RateLimitGovernor.PLACE) for _ in range(3))
+
+        # when
+        placed = threading.Event()
+        threading.Thread(target=lambda: governor.acquire(RateLimitGovernor.PLACE) and placed.set(), daemon=True).start()
+        wait_until(lambda: governor.metrics()['waiting'][RateLimitGovernor.PLACE] == 1)
+        clock.now += 1
+
+        # then
+        assert not governor.try_acquire(RateLimitGovernor.REFRESH)
+
+        # and
+        assert placed.wait(5)
+        assert governor.try_acquire(RateLimitGovernor.REFRESH)
+        assert governor.metrics()['throttled'][RateLimitGovernor.PLACE] == 1
+
+    def test_should_time_out_waiting_for_budget(self, governor, clock):
+        # given
+        assert all(governor.try_acquire(RateLimitGovernor.CANCEL) for _ in range(5))
+
+        # when
+        results = []
+        thread = threading.Thread(target=lambda: results.append(governor.acquire(RateLimitGovernor.CANCEL, timeout=0.1)), daemon=True)
+        thread.start()
+        wait_until(lambda: governor.metrics()['waiting'][RateLimitGovernor.CANCEL] == 1)
+        clock.now += 0.2
+
+        # then
+        thread.join(5)
+        assert results == [False]
+        assert governor.metrics()['waiting'][RateLimitGovernor.CANCEL] == 0
+
+    def test_should_abandon_waiting_for_budget_when_notified(self, governor):
+        # given
+        assert all(governor.try_acquire(RateLimitGovernor.PLACE) for _ in range(3))
+
+        # when
+        abandoned = threading.Event()
+        results = []
+        thread = threading.Thread(target=lambda: results.append(governor.acquire(RateLimitGovernor.PLACE, abandon=abandoned.is_set)), daemon=True)
+        thread.start()
+        wait_until(lambda: governor.metrics()['waiting'][RateLimitGovernor.PLACE] == 1)
+        abandoned.set()
+        governor.notify()
+
+        # then
+        thread.join(5)
+        assert results == [False]
+        assert governor.metrics()['acquired'][RateLimitGovernor.PLACE] == 3
+
+
+class TestPriorityExecutorRateLimit:
+    def test_should_not_occupy_workers_while_waiting_for_budget(self):
+        # given
+        clock = FakeClock()
+        governor = RateLimitGovernor(rate=1, burst=2, cancel_reserve=1, clock=clock)
+        assert governor.try_acquire(RateLimitGovernor.PLACE)
+
+        executor = PriorityExecutor(max_workers=1)
+        executor.govern_requests_with(governor)
+
+        # when
+        calls = []
+        executor.submit(lambda: calls.append('place'), 1, RateLimitGovernor.PLACE)
+        wait_until(lambda: governor.metrics()['waiting'][RateLimitGovernor.PLACE] == 1)
+        executor.submit(lambda: calls.append('cancel'), 0, RateLimitGovernor.CANCEL)
+
+        # then
+        wait_until(lambda: calls == ['cancel'])
+
+        # when
+        clock.now += 2
+        governor.notify()
+
+        # then
+        wait_until(lambda: calls == ['cancel', 'place'])
+        assert executor.metrics()['queued'] == {0: 0, 1: 0}
+
+
+class TestCreateRateLimitGovernor:
+    def test_should_create_governor_from_arguments(self):
+        # given
+        parser = ArgumentParser()
+        add_rate_limit_arguments(parser)
+
+        # when
+        governor = create_rate_limit_governor(parser.parse_args(['--rate-limit', '10', '--rate-limit-burst', '20']))
+
+        # then
+        assert governor.rate == 10
+        assert governor.burst == 20
+        assert governor.cancel_reserve == 4
+
+    def test_should_not_limit_anything_if_arguments_not_defined(self):
+        # when
+        governor = create_rate_limit_governor(Namespace())
+
+        # then
+        assert governor.rate is None
+
+
+class TestOrderBookManagerRateLimit:
+    def test_should_make_all_requests_through_the_governor(self):
+        # given
+        exchange = FakeExchange([FakeOrder(1), FakeOrder(2)])
+        governor = RateLimitGovernor(rate=100, burst=100)
+
+        manager = OrderBookManager(refresh_frequency=60)
+        manager.get_orders_with(exchange.get_orders)
+        manager.place_orders_with(exchange.place_order)
+        manager.cancel_orders_with(exchange.cancel_order)
+        manager.govern_requests_with(governor)
+        manager.start()
+        manager.get_order_book()
+
+        # when
+        manager.replace_orders([exchange.orders[0]], [FakeOrder(3), FakeOrder(4)])
+        manager.wait_for_stable_order_book()
+
+        # then
+        wait_until(lambda: governor.metrics()['acquired'] == {'cancel': 1, 'place': 2, 'refresh': 1})
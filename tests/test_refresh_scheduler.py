@@ -0,0 +1,192 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2020 MakerDAO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+from argparse import Namespace
+
+import pytest
+
+from market_maker_keeper.order_book import OrderBookManager
+from market_maker_keeper.price_feed import Price
+from market_maker_keeper.rate_limit import RateLimitGovernor
+from market_maker_keeper.refresh_scheduler import AdaptiveRefreshScheduler, create_refresh_scheduler
+from pymaker.numeric import Wad
+from tests.test_order_book import FakeExchange, FakeOrder, wait_until
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestAdaptiveRefreshScheduler:
+    @pytest.fixture
+    def clock(self):
+        return FakeClock()
+
+    @pytest.fixture
+    def scheduler(self, clock):
+        return AdaptiveRefreshScheduler(min_interval=1, max_interval=10, clock=clock)
+
+    def refresh(self, scheduler: AdaptiveRefreshScheduler, clock: FakeClock, active: bool = False) -> float:
+        clock.now = scheduler.next_refresh_time(active)
+        scheduler.refreshed(active)
+        return clock.now
+
+    def test_should_refresh_immediately_the_first_time(self, scheduler, clock):
+        assert scheduler.next_refresh_time(False) == 1000.0
+
+    def test_should_back_off_exponentially_up_to_max_interval(self, scheduler, clock):
+        # when
+        times = [self.refresh(scheduler, clock) for _ in range(7)]
+
+        # then
+        assert [later - earlier for earlier, later in zip(times, times[1:])] == [2, 4, 8, 10, 10, 10]
+        assert scheduler.metrics()['interval'] == 10
+        assert scheduler.metrics()['refresh_rate'] == 0.1
+
+    def test_should_refresh_fast_while_active(self, scheduler, clock):
+        # given
+        for _ in range(5):
+            self.refresh(scheduler, clock)
+
+        # expect
+        assert scheduler.next_refresh_time(True) == clock.now + 1
+        assert scheduler.next_refresh_time(False) == clock.now + 10
+
+        # when
+        self.refresh(scheduler, clock, active=True)
+
+        # then
+        assert scheduler.next_refresh_time(False) == clock.now + 1
+
+    def test_should_refresh_fast_while_price_moves(self, clock):
+        # given
+        price = Price(buy_price=Wad.from_number(100), sell_price=Wad.from_number(101))
+        scheduler = AdaptiveRefreshScheduler(min_interval=1, max_interval=10, price_function=lambda: price,
+                                             price_tolerance=0.01, clock=clock)
+        for _ in range(5):
+            self.refresh(scheduler, clock)
+
+        # when
+        price = Price(buy_price=Wad.from_number(100.5), sell_price=Wad.from_number(101))
+
+        # then
+        assert scheduler.next_refresh_time(False) == clock.now + 10
+
+        # when
+        price = Price(buy_price=Wad.from_number(102), sell_price=Wad.from_number(101))
+
+        # then
+        assert scheduler.next_refresh_time(False) == clock.now + 1
+
+    def test_should_stay_within_request_budget(self, clock):
+        # given
+        scheduler = AdaptiveRefreshScheduler(min_interval=1, max_interval=10, request_budget=3, budget_period=60,
+                                             clock=clock)
+
+        # when
+        for _ in range(3):
+            scheduler.record_request()
+            clock.now += 5
+
+        # then
+        assert scheduler.request_available_time() == 1060.0
+        assert scheduler.next_refresh_time(True) == 1060.0
+        assert scheduler.metrics()['requests'] == 3
+        assert scheduler.metrics()['budget_usage'] == 1.0
+
+        # when
+        clock.now = 1060.0
+
+        # then
+        assert scheduler.request_available_time() == 1060.0
+        assert scheduler.metrics()['requests'] == 2
+
+    def test_should_share_budget_of_rate_limit_governor(self, scheduler, clock):
+        # given
+        governor = RateLimitGovernor(rate=1, burst=2, cancel_reserve=1, clock=clock)
+        scheduler.govern_requests_with(governor)
+
+        # when
+        governor.acquire(RateLimitGovernor.PLACE)
+
+        # then
+        assert scheduler.request_available_time() == 1001.0
+        assert scheduler.next_refresh_time(True) == 1001.0
+        assert scheduler.metrics()['budget_usage'] == 0.5
+
+    def test_should_only_be_created_if_configured(self):
+        # given
+        arguments = Namespace(refresh_frequency=3, refresh_max_interval=None, refresh_backoff=2.0,
+                              refresh_price_tolerance=0.0)
+
+        # expect
+        assert create_refresh_scheduler(arguments) is None
+        assert create_refresh_scheduler(Namespace(refresh_frequency=3)) is None
+
+        # when
+        arguments.refresh_max_interval = 30.0
+        scheduler = create_refresh_scheduler(arguments)
+
+        # then
+        assert scheduler.min_interval == 3
+        assert scheduler.max_interval == 30.0
+
+
+class TestOrderBookManagerAdaptiveRefresh:
+    @pytest.fixture
+    def exchange(self):
+        return FakeExchange([FakeOrder(1), FakeOrder(2)])
+
+    def manager(self, exchange, scheduler: AdaptiveRefreshScheduler) -> OrderBookManager:
+        manager = OrderBookManager(refresh_frequency=60)
+        manager.get_orders_with(exchange.get_orders)
+        manager.place_orders_with(exchange.place_order)
+        manager.cancel_orders_with(exchange.cancel_order)
+        manager.schedule_refresh_with(scheduler)
+        manager.start()
+        manager.get_order_book()
+        return manager
+
+    def test_should_refresh_soon_after_placing_orders(self, exchange):
+        # given
+        manager = self.manager(exchange, AdaptiveRefreshScheduler(min_interval=0.05, max_interval=60))
+        manager.wait_for_order_book_refresh(timeout=1)
+
+        # when
+        manager.place_orders([FakeOrder(3)])
+
+        # then
+        assert manager.wait_for_order_book_refresh(timeout=1)
+        assert manager.refresh_metrics()['interval'] == 0.05
+
+    def test_should_not_exceed_request_budget(self, exchange):
+        # given
+        scheduler = AdaptiveRefreshScheduler(min_interval=0.05, max_interval=0.05, request_budget=3)
+        manager = self.manager(exchange, scheduler)
+
+        # when
+        wait_until(lambda: scheduler.metrics()['requests'] == 3)
+        time.sleep(0.3)
+
+        # then
+        assert scheduler.metrics()['requests'] == 3
+        assert manager.refresh_metrics()['budget_usage'] == 1.0
@@ -0,0 +1,137 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2020 MakerDAO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+
+from market_maker_keeper.feed import EmptyFeed, FixedFeed
+from market_maker_keeper.price_feed import AveragePriceFeed, FixedPriceFeed, WebSocketPriceFeed
+from market_maker_keeper.sync_scheduler import SyncScheduler
+from pymaker.numeric import Wad
+from tests.test_order_book import wait_until
+from tests.test_price_feed import FakeFeed
+
+
+class FakeUpdatingFeed(FakeFeed):
+    def __init__(self):
+        super().__init__({})
+        self.on_update_function = None
+
+    def on_update(self, on_update_function):
+        self.on_update_function = on_update_function
+
+
+class FakeKeeper:
+    def __init__(self):
+        self.sync_times = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def synchronize_orders(self):
+        self.sync_times.append(time.time())
+        self.release.wait()
+
+
+class TestSyncScheduler:
+    def test_should_not_sync_before_first_heartbeat(self):
+        # given
+        keeper = FakeKeeper()
+        scheduler = SyncScheduler(keeper.synchronize_orders)
+
+        # when
+        scheduler.trigger()
+        time.sleep(0.1)
+
+        # then
+        assert keeper.sync_times == []
+
+        # when
+        scheduler.heartbeat()
+
+        # then
+        wait_until(lambda: len(keeper.sync_times) == 1)
+
+    def test_should_sync_as_soon_as_feed_signals_a_change(self):
+        # given
+        keeper = FakeKeeper()
+        feed = FakeUpdatingFeed()
+        scheduler = SyncScheduler(keeper.synchronize_orders, min_interval=0)
+        scheduler.watch(AveragePriceFeed([WebSocketPriceFeed(feed), FixedPriceFeed(Wad.from_number(1))]),
+                        EmptyFeed(), FixedFeed({}))
+        scheduler.heartbeat()
+        wait_until(lambda: len(keeper.sync_times) == 1)
+
+        # when
+        feed.on_update_function()
+
+        # then
+        wait_until(lambda: len(keeper.sync_times) == 2)
+        assert scheduler.metrics()['triggers'] == 1
+
+    def test_should_coalesce_changes_signalled_during_sync(self):
+        # given
+        keeper = FakeKeeper()
+        keeper.release.clear()
+        scheduler = SyncScheduler(keeper.synchronize_orders, min_interval=0)
+        scheduler.heartbeat()
+        wait_until(lambda: len(keeper.sync_times) == 1)
+
+        # when
+        for _ in range(10):
+            scheduler.trigger()
+        keeper.release.set()
+
+        # then
+        wait_until(lambda: scheduler.metrics()['syncs'] == 2)
+        time.sleep(0.1)
+        assert len(keeper.sync_times) == 2
+        assert scheduler.metrics()['coalesced'] == 9
+
+    def test_should_respect_min_interval(self):
+        # given
+        keeper = FakeKeeper()
+        scheduler = SyncScheduler(keeper.synchronize_orders, min_interval=0.3)
+        scheduler.heartbeat()
+        wait_until(lambda: len(keeper.sync_times) == 1)
+
+        # when
+        scheduler.trigger()
+
+        # then
+        wait_until(lambda: len(keeper.sync_times) == 2)
+        assert keeper.sync_times[1] - keeper.sync_times[0] > 0.25
+
+    def test_should_wait_for_running_sync_when_stopped(self):
+        # given
+        keeper = FakeKeeper()
+        keeper.release.clear()
+        scheduler = SyncScheduler(keeper.synchronize_orders)
+        scheduler.heartbeat()
+        wait_until(lambda: len(keeper.sync_times) == 1)
+
+        # expect
+        assert not scheduler.stop(timeout=0.1)
+
+        # when
+        keeper.release.set()
+
+        # then
+        assert scheduler.stop()
+        scheduler.heartbeat()
+        scheduler.trigger()
+        time.sleep(0.1)
+        assert len(keeper.sync_times) == 1
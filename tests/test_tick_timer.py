@@ -0,0 +1,125 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2020 MakerDAO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import time
+
+from market_maker_keeper.order_book import OrderBookManager
+from market_maker_keeper.sync_scheduler import SyncScheduler
+from market_maker_keeper.tick_timer import RollingHistogram, TickTimer, sync_phase, timed_phase
+from tests.test_order_book import FakeExchange, FakeOrder, wait_until
+from tests.test_sync_scheduler import FakeKeeper
+
+
+@timed_phase('price')
+def slow_price():
+    time.sleep(0.01)
+    return 100
+
+
+class TestRollingHistogram:
+    def test_should_only_keep_most_recent_samples(self):
+        # given
+        histogram = RollingHistogram(100)
+
+        # when
+        for value in range(200):
+            histogram.add(value)
+
+        # then
+        assert histogram.count() == 100
+        assert histogram.percentile(0) == 100
+        assert histogram.percentile(99) == 199
+        assert histogram.metrics()['p50'] == 150
+        assert histogram.metrics()['mean'] == 149.5
+
+    def test_should_handle_no_samples(self):
+        assert RollingHistogram(10).percentile(99) is None
+        assert RollingHistogram(10).metrics() == {'count': 0}
+
+
+class TestTickTimer:
+    def test_should_measure_phases_within_ticks_only(self):
+        # given
+        timer = TickTimer(interval=1)
+        slow_price()
+
+        # when
+        with timer.tick():
+            slow_price()
+            with sync_phase('price'):
+                slow_price()
+
+        # then
+        durations = timer.metrics()['durations']
+        assert timer.metrics()['ticks'] == 1
+        assert durations['price']['count'] == 1
+        assert 0.02 <= durations['price']['max'] <= durations['total']['max']
+        assert durations['bands'] == {'count': 0}
+
+    def test_should_measure_order_book_manager_calls(self):
+        # given
+        exchange = FakeExchange([FakeOrder(1)])
+        manager = OrderBookManager(refresh_frequency=1)
+        manager.get_orders_with(exchange.get_orders)
+        manager.place_orders_with(exchange.place_order)
+        manager.start()
+        timer = TickTimer(interval=1)
+
+        # when
+        with timer.tick():
+            manager.get_order_book()
+            manager.place_orders([FakeOrder(2)])
+
+        # then
+        assert timer.metrics()['durations']['order_book']['count'] == 1
+        assert timer.metrics()['durations']['dispatch']['count'] == 1
+
+    def test_should_warn_once_p99_exceeds_interval(self, caplog):
+        # given
+        timer = TickTimer(interval=0.005)
+
+        # when
+        with caplog.at_level(logging.WARNING):
+            for _ in range(TickTimer.MIN_SAMPLES * 2):
+                with timer.tick():
+                    slow_price()
+
+        # then
+        assert timer.metrics()['overruns'] == TickTimer.MIN_SAMPLES * 2
+        assert len([record for record in caplog.records if 'takes too long' in record.getMessage()]) == 1
+        assert "slowest phase being 'price'" in caplog.text
+
+
+class TestSyncSchedulerTicks:
+    def test_should_coalesce_overdue_heartbeats(self):
+        # given
+        keeper = FakeKeeper()
+        keeper.release.clear()
+        scheduler = SyncScheduler(keeper.synchronize_orders, min_interval=0)
+        scheduler.heartbeat()
+        wait_until(lambda: len(keeper.sync_times) == 1)
+
+        # when
+        for _ in range(3):
+            scheduler.heartbeat()
+        keeper.release.set()
+
+        # then
+        wait_until(lambda: scheduler.metrics()['syncs'] == 2)
+        assert scheduler.metrics()['overdue'] == 3
+        assert scheduler.metrics()['ticks']['ticks'] == 2
@@ -0,0 +1,106 @@
+# This file is part of Maker Keeper Framework.
+#
+# Copyright (C) 2020 MakerDAO
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import json
+import threading
+
+import tornado.web
+import tornado.websocket
+from tornado.httpserver import HTTPServer
+from tornado.ioloop import IOLoop
+from tornado.testing import bind_unused_port
+
+
+class FakeWebSocketServer:
+    """Local WebSocket server running in a background thread, for testing WebSocket clients.
+
+    It records all messages received from clients and lets tests push messages to,
+    or drop connections of, all connected clients. Like `FeedEngine`, it runs Tornado
+    on an asyncio event loop, so needs Tornado 5.0 or newer.
+    """
+
+    def __init__(self):
+        self.received = []
+        self.connections = 0
+        self._clients = []
+        self._lock = threading.Lock()
+        self._started = threading.Event()
+        self._socket, self.port = bind_unused_port()
+        self._io_loop = None
+
+        threading.Thread(target=self._run, daemon=True).start()
+        self._started.wait()
+
+    @property
+    def url(self) -> str:
+        return f"ws://localhost:{self.port}/"
+
+    def send(self, message: dict):
+        """Sends the message, as JSON, to all connected clients."""
+        def send_to_all():
+            for client in list(self._clients):
+                client.write_message(json.dumps(message))
+
+        self._io_loop.add_callback(send_to_all)
+
+    def disconnect_all(self):
+        """Closes connections of all connected clients."""
+        def close_all():
+            for client in list(self._clients):
+                client.close()
+
+        self._io_loop.add_callback(close_all)
+
+    def client_count(self) -> int:
+        with self._lock:
+            return len(self._clients)
+
+    def stop(self):
+        self._io_loop.add_callback(self._io_loop.stop)
+
+    def _run(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+
+        server = self
+
+        class Handler(tornado.websocket.WebSocketHandler):
+            def open(self):
+                with server._lock:
+                    server._clients.append(self)
+                    server.connections += 1
+
+            def on_message(self, message):
+                with server._lock:
+                    server.received.append(json.loads(message))
+
+            def on_close(self):
+                with server._lock:
+                    if self in server._clients:
+                        server._clients.remove(self)
+
+        async def listen():
+            http_server = HTTPServer(tornado.web.Application([(r"/", Handler)]))
+            http_server.add_sockets([self._socket])
+
+            self._io_loop = IOLoop.current()
+
+        loop.run_until_complete(listen())
+
+        self._started.set()
+        loop.run_forever()